@@ -0,0 +1,65 @@
+"""Logins per second one worker process sustains at each bcrypt cost.
+
+    python benchmarks/bench_logins.py --costs 10 11 12 13 --seconds 5
+
+Each login is a full POST /login through the app (form validation, user
+lookup, bcrypt check and session cookie) against an in-memory database, so
+the numbers are an upper bound for a real worker. Pick the highest cost that
+still leaves enough headroom for your peak login rate.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskblog import create_app, db, bcrypt  # noqa: E402
+from flaskblog.config import Config  # noqa: E402
+from flaskblog.models import User  # noqa: E402
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SECRET_KEY = 'bench'
+    WTF_CSRF_ENABLED = False
+    REDIS_HOST = None
+    ELASTICSEARCH_URL = None
+
+
+def logins_per_second(app, cost, seconds):
+    app.config['BCRYPT_LOG_ROUNDS'] = cost
+    email = f'cost{cost}@example.com'
+    # Stored at the benchmarked cost, so no login pays for a rehash
+    db.session.add(User(username=f'cost{cost}', email=email,
+                        password=bcrypt.generate_password_hash('password', cost).decode('utf-8')))
+    db.session.commit()
+
+    client = app.test_client()
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        response = client.post('/login', data={'email': email, 'password': 'password'})
+        assert response.status_code == 302, response.status_code
+        client.get('/logout')
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--costs', type=int, nargs='+', default=[10, 11, 12, 13])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        print(f"{'cost':>4}  {'logins/s':>9}  {'ms/login':>9}")
+        for cost in args.costs:
+            rate = logins_per_second(app, cost, args.seconds)
+            print(f"{cost:>4}  {rate:>9.1f}  {1000 / rate:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Concurrent searches per second one worker process sustains, synchronous vs async search view.
+
+    ELASTICSEARCH_URL=http://localhost:9200 python benchmarks/bench_search.py --threads 1 4 16 --seconds 10
+
+Each thread plays one of a threaded worker's request threads (gunicorn
+--threads), sending GET /search with random two-word queries, a third of
+them filtered by category, through the app. The result cache is off, so every
+search reaches Elasticsearch. The async view (SEARCH_ASYNC) needs Flask's
+async extra (asgiref).
+
+The posts are seeded into a temporary SQLite database and indexed into the
+'post' index, replacing what is there: point it at a scratch Elasticsearch.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskblog import create_app, db  # noqa: E402
+from flaskblog.config import Config  # noqa: E402
+from flaskblog.models import Post  # noqa: E402
+from flaskblog.posts.forms import CATEGORIES  # noqa: E402
+from flaskblog.search import rebuild_index  # noqa: E402
+from flaskblog.seed import seed_database, WORDS  # noqa: E402
+
+
+def make_config(path, use_async):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SECRET_KEY = 'bench'
+        REDIS_HOST = None
+        SEARCH_BACKEND = 'elasticsearch'
+        SEARCH_CACHE_ENABLED = False
+        SEARCH_ASYNC = use_async
+        SERVER_TIMING_ENABLED = False
+    return BenchConfig
+
+
+def searches_per_second(app, threads, seconds, seed):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def run(n):
+        rng = random.Random(seed + n)
+        client = app.test_client()
+        mine = []
+        while time.perf_counter() < deadline:
+            args = {'q': ' '.join(rng.choices(WORDS[-60:], k=2))}
+            if rng.random() < 1 / 3:
+                args['category'] = rng.choice(CATEGORIES)
+            started = time.perf_counter()
+            response = client.get('/search', query_string=args)
+            mine.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                with lock:
+                    errors.append(response.status_code)
+        with lock:
+            latencies.extend(mine)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    if errors:
+        raise SystemExit(f"{len(errors)} searches failed, e.g. with status {errors[0]}")
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[int(len(latencies) * 0.95)] * 1000, statistics.fmean(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='flaskblog-search-bench-'), 'bench.db')
+    app = create_app(make_config(path, False))
+    with app.app_context():
+        if app.elasticsearch is None:
+            raise SystemExit("Set ELASTICSEARCH_URL")
+        db.create_all()
+        seed_database(max(10, args.posts // 50), args.posts, seed=args.seed, progress=lambda message: None)
+        rebuild_index(Post, progress=print)
+
+    print(f"{'view':<6} {'threads':>7}  {'searches/s':>10}  {'mean ms':>8}  {'p95 ms':>8}")
+    for use_async in (False, True):
+        app = create_app(make_config(path, use_async))
+        for threads in args.threads:
+            rate, p95, mean = searches_per_second(app, threads, args.seconds, args.seed)
+            print(f"{'async' if use_async else 'sync':<6} {threads:>7}  {rate:>10.1f}  {mean:>8.1f}  {p95:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""Request latency, throughput, SQL query counts and task throughput at several dataset sizes.
+
+    python benchmarks/suite.py --sizes 10000 100000 1000000
+    python benchmarks/suite.py --sizes 10000 --compare benchmarks/results/<earlier run>.json
+
+Each size gets its own SQLite database, filled by `flask seed`'s generator
+and kept in --data-dir so later runs skip the seeding; every run works on a
+fresh copy of it. Everything runs in this process against local stand-ins:
+the FTS5 search backend for Elasticsearch, the in-process cache fallbacks for
+Redis, the stub summarizer for OpenAI and eager TaskTiger tasks. Results are
+written as JSON (benchmarks/results/ by default) to compare against earlier
+runs.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskblog import create_app, db, tiger  # noqa: E402
+from flaskblog.config import Config  # noqa: E402
+from flaskblog.models import User, Post  # noqa: E402
+from flaskblog.search import rebuild_index  # noqa: E402
+from flaskblog.seed import seed_database, SEED_PASSWORD, WORDS  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class BenchConfig(Config):
+    SECRET_KEY = 'bench'
+    WTF_CSRF_ENABLED = False
+    REDIS_HOST = None
+    ELASTICSEARCH_URL = None
+    SEARCH_BACKEND = 'fts5'
+    SUMMARY_BACKEND = 'stub'
+    BCRYPT_LOG_ROUNDS = 4
+
+
+def make_app(path):
+    class SizeConfig(BenchConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+    return create_app(SizeConfig)
+
+
+def prepare(path, size, seed, progress):
+    """Seed the database at ``path`` unless an earlier run did; returns the seconds spent seeding."""
+    if os.path.exists(path):
+        progress(f"Reusing {path}")
+        return None
+    app = make_app(path + '.tmp')
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        seed_database(max(100, size // 50), size, seed=seed, progress=progress)
+        # Builds the FTS index too
+        rebuild_index(Post, progress=progress)
+        elapsed = time.perf_counter() - started
+        db.session.execute(db.text('PRAGMA wal_checkpoint(TRUNCATE)'))
+        db.session.remove()
+        db.engine.dispose()
+    os.replace(path + '.tmp', path)
+    return elapsed
+
+
+class QueryCounter:
+    def __init__(self, app):
+        self.count = 0
+        with app.app_context():
+            for engine in db.engines.values():
+                db.event.listen(engine, 'before_cursor_execute', self.record)
+
+    def record(self, *args):
+        self.count += 1
+
+
+def measure(counter, requests, make_request, warmup=5):
+    for _ in range(warmup):
+        make_request()
+    latencies, queries = [], []
+    started = time.perf_counter()
+    for _ in range(requests):
+        before = counter.count
+        request_started = time.perf_counter()
+        response = make_request()
+        latencies.append(time.perf_counter() - request_started)
+        queries.append(counter.count - before)
+        if response.status_code not in (200, 302):
+            raise SystemExit(f"{response.request.path} answered {response.status_code}")
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'rps': round(requests / elapsed, 1),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+        'queries_per_request': round(statistics.fmean(queries), 2),
+        'max_queries': max(queries),
+    }
+
+
+def _percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def bench_requests(app, requests, rng):
+    with app.app_context():
+        max_post = db.session.scalar(db.select(db.func.max(Post.id)))
+        # The most prolific author, so the user page is the heaviest one
+        top_author = db.session.execute(
+            db.select(User.username, User.email).join(Post).group_by(User.id)
+            .order_by(db.func.count(Post.id).desc()).limit(1)
+        ).one()
+
+    counter = QueryCounter(app)
+    anonymous = app.test_client()
+    author = app.test_client()
+    author.post('/login', data={'email': top_author.email, 'password': SEED_PASSWORD})
+
+    def query():
+        return ' '.join(rng.choices(WORDS[-60:], k=2))
+
+    cases = {
+        'home': lambda: anonymous.get('/'),
+        'home_page_5': lambda: anonymous.get('/?page=5'),
+        'post': lambda: anonymous.get(f'/post/{rng.randint(1, max_post)}'),
+        'user_posts': lambda: anonymous.get(f'/user/{top_author.username}'),
+        'search': lambda: anonymous.get('/search', query_string={'q': query()}),
+        'search_category': lambda: anonymous.get('/search', query_string={'q': query(), 'category': 'Tech'}),
+        'home_logged_in': lambda: author.get('/'),
+        'new_post': lambda: author.post('/post/new', data={
+            'title': query().capitalize(), 'content': ' '.join(rng.choices(WORDS, k=300)), 'category': 'Tech'}),
+    }
+    return {name: measure(counter, requests, make_request) for name, make_request in cases.items()}
+
+
+def bench_tasks(app, progress):
+    from flaskblog.summarizer import summarize_posts
+    results = {}
+    with app.app_context():
+        started = time.perf_counter()
+        _, done, _ = rebuild_index(Post, progress=lambda message: None)
+        results['reindex_docs_per_sec'] = round(done / (time.perf_counter() - started), 1)
+
+        ids = db.session.scalars(db.select(Post.id).where(Post.summary.is_(None)).limit(500)).all()
+        started = time.perf_counter()
+        summarize_posts(ids)
+        results['summaries_per_sec'] = round(len(ids) / (time.perf_counter() - started), 1) if ids else None
+    progress(f"Tasks: {results}")
+    return results
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = {run['posts']: run for run in json.load(f)['runs']}
+    print(f"\nCompared with {previous_path} (p95 ms / req/s / queries)")
+    for run in current['runs']:
+        before = previous.get(run['posts'])
+        if before is None:
+            continue
+        for name, now in run['endpoints'].items():
+            then = before['endpoints'].get(name)
+            if then is None:
+                continue
+            print(f"{run['posts']:>8} {name:<18} "
+                  f"{then['p95_ms']:>8.2f} -> {now['p95_ms']:<8.2f} "
+                  f"{then['rps']:>8.1f} -> {now['rps']:<8.1f} "
+                  f"{then['queries_per_request']:>5} -> {now['queries_per_request']}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=HERE, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--requests', type=int, default=200, help='Timed requests per endpoint and size.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(HERE, 'data'))
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/<timestamp>.json).')
+    parser.add_argument('--compare', help='An earlier results file to print the differences against.')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='flaskblog-bench-')
+    tiger.config['ALWAYS_EAGER'] = True
+    started_at = datetime.now(timezone.utc)
+    report = {
+        'meta': {
+            'started_at': started_at.isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'runs': [],
+    }
+
+    for size in args.sizes:
+        print(f"== {size} posts")
+        pristine = os.path.join(args.data_dir, f'bench-{size}-seed{args.seed}.db')
+        seed_seconds = prepare(pristine, size, args.seed, print)
+        # The benchmark writes posts; keep the seeded file as it was
+        work = os.path.join(work_dir, os.path.basename(pristine))
+        shutil.copyfile(pristine, work)
+        app = make_app(work)
+        endpoints = bench_requests(app, args.requests, random.Random(args.seed))
+        for name, result in endpoints.items():
+            print(f"{name:<18} p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  "
+                  f"{result['rps']:>8.1f} req/s  {result['queries_per_request']:>5} queries")
+        report['runs'].append({
+            'posts': size,
+            'seed_seconds': round(seed_seconds, 1) if seed_seconds is not None else None,
+            'endpoints': endpoints,
+            'tasks': bench_tasks(app, print),
+        })
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+        os.remove(work)
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    output = args.output or os.path.join(HERE, 'results', started_at.strftime('%Y%m%dT%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,74 +1,147 @@
-from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_mail import Mail
 from flask_migrate import Migrate
-from flaskblog.config import Config
-from elasticsearch import Elasticsearch
+from flaskblog.config import config_from_env
+from flaskblog.database import RoutingSession
+from flaskblog.metrics import TimedTaskTiger
+from flaskblog.clients import FlaskBlog
 import click
 from flask.cli import with_appcontext
 from redis import Redis
-from tasktiger import TaskTiger
 
 # 1. Initialize extensions without the 'app' yet
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
 login_manager = LoginManager()
 login_manager.login_view = 'users.login'
 login_manager.login_message_category = 'info'
 mail = Mail()
 migrate = Migrate()
-tiger = TaskTiger()
 
+# Tasks are declared against this instance at import time. The Redis client
+# (Docker hostname) only connects when the first task is queued.
+tiger = TimedTaskTiger(connection=Redis(host='redis', port=6379))
 
-# Initialize Redis connection globally with the Docker hostname
-redis_conn = Redis(host='redis', port=6379)
-tiger = TaskTiger(connection=redis_conn)
 
-
-def create_app(config_class=Config):
-    app = Flask(__name__)
+def create_app(config_class=None):
+    app = FlaskBlog(__name__)
     
-    # Load configurations
-    app.config.from_object(config_class)
+    # Load configurations (FLASKBLOG_CONFIG picks the environment when none is given)
+    app.config.from_object(config_class or config_from_env())
 
     # Bind extensions to the app
-    db.init_app(app)
+    from flaskblog.database import init_database
+    init_database(app, db)
     bcrypt.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
     migrate.init_app(app, db)
+    from flaskblog.metrics import init_metrics
+    init_metrics(app, db, tiger)
+    from flaskblog.lazyloads import init_lazy_load_guard
+    init_lazy_load_guard(app)
+
+    # app.elasticsearch and app.redis are built on first use (see flaskblog/clients.py)
+
+    from flaskblog.assets import init_assets
+    init_assets(app)
 
-    # Add Elasticsearch to the app instance
-    app.elasticsearch = Elasticsearch([app.config['ELASTICSEARCH_URL']]) \
-        if app.config['ELASTICSEARCH_URL'] else None
+    from flaskblog.fragments import cached_article
+    app.add_template_global(cached_article)
+    from flaskblog.avatars import avatar_srcsets
+    app.add_template_global(avatar_srcsets)
+    from flaskblog.summaries import push_enabled
+    app.add_template_global(push_enabled, 'summary_push_enabled')
 
 
     @app.cli.command("reindex")
+    @click.option('--workers', default=4, show_default=True, help='Bulk requests to keep in flight.')
+    @click.option('--chunk-size', default=500, show_default=True, help='Rows streamed per bulk request.')
+    @click.option('--keep-old', is_flag=True, help='Keep the previous index after the alias swap.')
     @with_appcontext
-    def reindex():
-        """Sync all database posts with the Elasticsearch index."""
+    def reindex(workers, chunk_size, keep_old):
+        """Rebuild the search index with English stemming and swap it in without downtime."""
         from flaskblog.models import Post
-        from flaskblog.search import add_to_index
-        
-        """Regenerate the search index with English stemming."""
-        if not app.elasticsearch:
+        from flaskblog.search import rebuild_index, search_backend
+        from flaskblog.database import replica_reads
+
+        if not search_backend().available():
             return
-    
-        # Wipe the old 'dumb' index
-        if app.elasticsearch.indices.exists(index='post'):
-            app.elasticsearch.indices.delete(index='post')
-    
-        # Create the new 'smart' index
-        Post.create_index()
-    
-        # Bulk sync
-        posts = Post.query.all()
-        for post in posts:
-            add_to_index('post', post)
-        
-        print(f'Successfully reindexed {len(posts)} posts with English Stemming.')
+
+        # A full table scan; keep it off the primary
+        with replica_reads(db):
+            index, done, failed = rebuild_index(Post, workers=workers, chunk_size=chunk_size,
+                                                keep_old=keep_old, progress=click.echo)
+        click.echo(f'Successfully reindexed {done} posts into {index} with English Stemming.')
+
+
+    @app.cli.group("assets")
+    def assets():
+        """Build the self-hosted, fingerprinted static files."""
+
+    @assets.command("vendor")
+    def vendor():
+        """Download the pinned third-party CSS/JS into static/vendor."""
+        from flaskblog.assets import vendor_assets
+        vendor_assets(app.static_folder, progress=click.echo)
+
+    @assets.command("check")
+    def check():
+        """Check the committed static/vendor files against their pinned hashes, offline."""
+        from flaskblog.assets import check_vendored, AssetError
+        try:
+            check_vendored(app.static_folder, progress=click.echo)
+        except AssetError as e:
+            raise click.ClickException(str(e))
+
+    @assets.command("build")
+    def build():
+        """Fingerprint and precompress static files and write the manifest."""
+        from flaskblog.assets import build_assets
+        build_assets(app.static_folder, progress=click.echo)
+
+
+    @app.cli.command("search-cache-stats")
+    @with_appcontext
+    def search_cache_stats():
+        """Show search result cache hits and misses."""
+        from flaskblog.search import search_cache_stats as stats
+        s = stats()
+        click.echo(f"hits={s['hits']} misses={s['misses']} hit_ratio={s['hit_ratio']:.1%}")
+
+
+    @app.cli.command("seed")
+    @click.option('--users', default=1000, show_default=True, help='Users to add.')
+    @click.option('--posts', default=10000, show_default=True, help='Posts to add.')
+    @click.option('--seed', 'rng_seed', default=0, show_default=True, help='Random seed, for repeatable data.')
+    @click.option('--batch-size', default=5000, show_default=True, help='Rows per INSERT batch.')
+    @with_appcontext
+    def seed(users, posts, rng_seed, batch_size):
+        """Fill the database with realistic synthetic users and posts."""
+        from flaskblog.seed import seed_database
+        seed_database(users, posts, seed=rng_seed, batch_size=batch_size, progress=click.echo)
+        click.echo("Done. Run `flask reindex` to make the new posts searchable.")
+
+
+    @app.cli.command("import-time")
+    @click.option('--runs', default=5, show_default=True, help='Fresh processes per process type; medians are shown.')
+    @click.option('--process', 'process_types', multiple=True, help='Only these process types (repeatable).')
+    @click.option('--output', type=click.Path(dir_okay=False), help='Also write the report as JSON.')
+    def import_time(runs, process_types, output):
+        """Show startup time and peak RSS of fresh web and worker processes."""
+        import json
+        import os
+        from flaskblog.startup import startup_report
+        report = startup_report(os.path.dirname(app.root_path), runs=runs, process_types=process_types)
+        click.echo(f"{'process':<8} {'startup':>9} {'wall':>9} {'max rss':>9} {'modules':>8}  heavy imports")
+        for name, row in report.items():
+            click.echo(f"{name:<8} {row['seconds'] * 1000:>7.0f}ms {row['wall_seconds'] * 1000:>7.0f}ms "
+                       f"{row['max_rss_mb']:>7.1f}MB {row['modules']:>8}  {', '.join(row['heavy']) or '-'}")
+        if output:
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=2)
 
 
     @app.cli.command("init-ai-fields")
@@ -0,0 +1,213 @@
+import base64
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import urllib.request
+from types import SimpleNamespace
+from flask import current_app, request, send_from_directory, url_for
+from flaskblog.avatars import AVATAR_VARIANT
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are written
+    brotli = None
+
+# Static files are served under names carrying a hash of their content
+# (main.css -> main.3b7c0e1f9a2d.css), listed in static/manifest.json by
+# `flask assets build`. Those URLs never change meaning, so they are sent with
+# a one year, immutable Cache-Control and repeat visits don't request them at
+# all. The build also writes .gz/.br files next to them so nothing is
+# compressed per request.
+
+# Third-party libraries committed in static/vendor (refreshed by
+# `flask assets vendor`), checked against the CDN's integrity hashes
+VENDOR_ASSETS = {
+    'bootstrap.min.css': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.0.1/dist/css/bootstrap.min.css',
+        'sha384-+0n0xVW2eSR5OomGNYDnhzAbDsOXxcvSN1TPprVMTNDbiYZCxYbOOl7+AMvyTG2x',
+    ),
+    'bootstrap.bundle.min.js': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.0.1/dist/js/bootstrap.bundle.min.js',
+        'sha384-gtEjrD/SeCtmISkJkNUaaKMoLD0//ElJ19smozuHV6z3Iehds+3Ulb9Bn9Plx0x4',
+    ),
+    'htmx.min.js': (
+        'https://unpkg.com/htmx.org@1.9.10/dist/htmx.min.js',
+        'sha384-D1Kt99CQMDuVetoL1lrYwg5t+9QdHe7NLX/SoJYkXDFfX37iInKRy5xLSi8nO7UC',
+    ),
+}
+
+MANIFEST = 'manifest.json'
+FINGERPRINTED = re.compile(r'\.[0-9a-f]{12}(\.[^.]+)?$')
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.map', '.html', '.ico'}
+# User uploads are named by content already and come and go at runtime
+SKIP_DIRS = {'profile_pics'}
+
+
+class AssetError(Exception):
+    pass
+
+
+def vendor_assets(static_folder, progress=print):
+    """Download the pinned third-party files into ``static/vendor``, verifying each one.
+
+    Needs the CDN, so it's run on a connected machine and ``static/vendor`` is
+    committed; image builds only check the copies with ``check_vendored``.
+    """
+    vendor_dir = os.path.join(static_folder, 'vendor')
+    os.makedirs(vendor_dir, exist_ok=True)
+    for name, (url, integrity) in VENDOR_ASSETS.items():
+        with urllib.request.urlopen(url, timeout=30) as response:
+            body = response.read()
+        if not _matches(body, integrity):
+            raise AssetError(f"{url} does not match its pinned hash {integrity}")
+        with open(os.path.join(vendor_dir, name), 'wb') as f:
+            f.write(body)
+        progress(f"Vendored {name} ({len(body)} bytes)")
+
+
+def check_vendored(static_folder, progress=print):
+    """Raise AssetError unless every vendored file is present and matches its pinned hash."""
+    for name, (url, integrity) in VENDOR_ASSETS.items():
+        path = os.path.join(static_folder, 'vendor', name)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            raise AssetError(f"static/vendor/{name} is missing; run `flask assets vendor` and commit it")
+        if not _matches(body, integrity):
+            raise AssetError(f"static/vendor/{name} does not match its pinned hash {integrity}")
+    progress(f"Vendored files match their pinned hashes ({len(VENDOR_ASSETS)})")
+
+
+def _matches(body, integrity):
+    algorithm, expected = integrity.split('-', 1)
+    return base64.b64encode(hashlib.new(algorithm, body).digest()).decode('ascii') == expected
+
+
+def build_assets(static_folder, progress=print):
+    """Fingerprint and precompress every static file and write the manifest.
+
+    Returns the new manifest. Files from the previous build that are no
+    longer referenced are removed.
+    """
+    manifest_path = os.path.join(static_folder, MANIFEST)
+    previous = _read_manifest(manifest_path)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if os.path.relpath(os.path.join(root, d), static_folder) not in SKIP_DIRS)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            logical = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            if logical == MANIFEST or name.endswith(('.gz', '.br')) or FINGERPRINTED.search(name):
+                continue
+            with open(path, 'rb') as f:
+                body = f.read()
+            stem, ext = os.path.splitext(logical)
+            hashed = f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}"
+            manifest[logical] = hashed
+            hashed_path = os.path.join(static_folder, hashed)
+            if not os.path.exists(hashed_path):
+                _write(hashed_path, body)
+            if ext in COMPRESSIBLE:
+                _precompress(hashed_path, body)
+
+    for stale in set(previous.values()) - set(manifest.values()):
+        for suffix in ('', '.gz', '.br'):
+            path = os.path.join(static_folder, stale + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+    _write(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    progress(f"Fingerprinted {len(manifest)} static files" +
+             ("" if brotli else " (brotli not installed, gzip only)"))
+    return manifest
+
+
+def _precompress(path, body):
+    variants = [('.gz', gzip.compress(body, compresslevel=9, mtime=0))]
+    if brotli:
+        variants.append(('.br', brotli.compress(body, quality=11)))
+    for suffix, compressed in variants:
+        # Not worth a separate response if it barely shrinks
+        if len(compressed) < len(body) * 0.9:
+            _write(path + suffix, compressed)
+
+
+def _write(path, body):
+    with open(path + '.tmp', 'wb') as f:
+        f.write(body)
+    os.replace(path + '.tmp', path)
+
+
+def _read_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def init_assets(app):
+    """Serve static files through the manifest built by `flask assets build`, if there is one."""
+    load_manifest(app)
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        # url_for('static', filename='main.css') -> /static/main.3b7c0e1f9a2d.css
+        if endpoint == 'static' and 'filename' in values:
+            manifest = current_app.extensions['assets']['manifest']
+            values['filename'] = manifest.get(values['filename'], values['filename'])
+
+    app.view_functions['static'] = send_static
+    app.add_template_global(vendor_asset)
+
+
+def load_manifest(app):
+    manifest = _read_manifest(os.path.join(app.static_folder, MANIFEST))
+    # Changes whenever a build changes any asset URL
+    version = hashlib.sha1(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    app.extensions['assets'] = {'manifest': manifest, 'hashed': set(manifest.values()), 'version': version}
+
+
+def send_static(filename):
+    assets = current_app.extensions['assets']
+    immutable = filename in assets['hashed'] or (
+        filename.startswith('profile_pics/') and AVATAR_VARIANT.match(filename.rsplit('/', 1)[-1]))
+
+    response = None
+    if filename in assets['hashed']:
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[encoding] and \
+                    os.path.exists(os.path.join(current_app.static_folder, filename + suffix)):
+                response = send_from_directory(current_app.static_folder, filename + suffix,
+                                               mimetype=mimetypes.guess_type(filename)[0])
+                response.headers['Content-Encoding'] = encoding
+                break
+        response = response or send_from_directory(current_app.static_folder, filename)
+        response.vary.add('Accept-Encoding')
+    else:
+        response = send_from_directory(current_app.static_folder, filename)
+
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['ASSETS_MAX_AGE']
+        response.cache_control.immutable = True
+    return response
+
+
+def vendor_asset(name):
+    """URL of a vendored library, or its CDN copy with the integrity hash when the
+    file is missing from static/vendor (``integrity`` is None for the local copy)."""
+    vendored = current_app.extensions['assets'].setdefault('vendored', {})
+    if name not in vendored:
+        vendored[name] = os.path.exists(os.path.join(current_app.static_folder, 'vendor', name))
+        if not vendored[name]:
+            current_app.logger.warning(f"static/vendor/{name} is missing, pages load it from "
+                                       f"{VENDOR_ASSETS[name][0]}; run `flask assets vendor`")
+    if vendored[name]:
+        return SimpleNamespace(url=url_for('static', filename='vendor/' + name), integrity=None)
+    url, integrity = VENDOR_ASSETS[name]
+    return SimpleNamespace(url=url, integrity=integrity)
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import re
+from flask import current_app, url_for
+
+# Profile pictures are stored under a hash of the uploaded bytes, so the same
+# upload is only processed and stored once. Each one is saved at every size in
+# AVATAR_SIZES, as WebP plus a JPEG fallback:
+#
+#   <digest>-65.webp  <digest>-130.webp  <digest>-250.webp
+#   <digest>-65.jpg   <digest>-130.jpg   <digest>-250.jpg
+#
+# ``User.image_file`` holds the AVATAR_FALLBACK_SIZE JPEG, so anything that only
+# knows the file name still gets a working image.
+DIGEST_LENGTH = 24
+AVATAR_NAME = re.compile(r'^(?P<digest>[0-9a-f]{%d})-\d+\.jpg$' % DIGEST_LENGTH)
+# Any stored variant; named by content, so it can be cached forever
+AVATAR_VARIANT = re.compile(r'^[0-9a-f]{%d}-\d+\.(jpg|webp)$' % DIGEST_LENGTH)
+
+
+def avatar_dir():
+    return os.path.join(current_app.root_path, current_app.config['UPLOADED_PHOTOS_DEST'])
+
+
+def upload_dir():
+    """Where raw uploads wait for the worker to process them."""
+    return os.path.join(avatar_dir(), 'processing')
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            sha.update(block)
+    return sha.hexdigest()[:DIGEST_LENGTH]
+
+
+def variant_name(digest, size, ext):
+    return f'{digest}-{size}.{ext}'
+
+
+def process_avatar(raw_path):
+    """Write every size and format for the upload at ``raw_path`` and return the new ``image_file``."""
+    sizes = current_app.config['AVATAR_SIZES']
+    fallback_size = current_app.config['AVATAR_FALLBACK_SIZE']
+    digest = file_digest(raw_path)
+    image_file = variant_name(digest, fallback_size, 'jpg')
+    folder = avatar_dir()
+    if os.path.exists(os.path.join(folder, image_file)):
+        # Someone uploaded exactly this picture before
+        return image_file
+
+    # Only the worker resizes; web processes never import Pillow
+    from PIL import Image, ImageOps
+    with Image.open(raw_path) as img:
+        # JPEGs decode straight at a fraction (1/2 to 1/8) of their size when the
+        # largest avatar still fits; other formats ignore this
+        img.draft('RGB', (max(sizes), max(sizes)))
+        img = ImageOps.exif_transpose(img).convert('RGB')
+
+    for size in sorted(set(sizes) | {fallback_size}, reverse=True):
+        variant = ImageOps.fit(img, (size, size), Image.LANCZOS)
+        if size in sizes:
+            _save_variant(variant, os.path.join(folder, variant_name(digest, size, 'webp')), 'WEBP')
+        if size == fallback_size:
+            fallback = variant
+        else:
+            _save_variant(variant, os.path.join(folder, variant_name(digest, size, 'jpg')), 'JPEG')
+    # Its existence marks the picture as processed (see above), so it's written last
+    _save_variant(fallback, os.path.join(folder, image_file), 'JPEG')
+    return image_file
+
+
+def _save_variant(img, path, format):
+    options = {'quality': 80, 'method': 6} if format == 'WEBP' else \
+        {'quality': 85, 'optimize': True, 'progressive': True}
+    # Write to a temporary name first so a half-written file is never served
+    img.save(path + '.tmp', format=format, **options)
+    os.replace(path + '.tmp', path)
+
+
+def delete_avatar(image_file):
+    """Remove a picture and all its variants. Callers check nobody else uses it."""
+    folder = avatar_dir()
+    match = AVATAR_NAME.match(image_file)
+    if match:
+        names = [variant_name(match['digest'], size, ext)
+                 for size in current_app.config['AVATAR_SIZES'] for ext in ('webp', 'jpg')]
+    else:
+        names = [image_file]
+    for name in names:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def avatar_srcsets(image_file):
+    """``{'webp': srcset, 'jpg': srcset}`` for a processed picture, or None for older single-file ones."""
+    match = AVATAR_NAME.match(image_file)
+    if not match:
+        return None
+    return {
+        ext: ', '.join(
+            f"{url_for('static', filename='profile_pics/' + variant_name(match['digest'], size, ext))} {size}w"
+            for size in current_app.config['AVATAR_SIZES']
+        )
+        for ext in ('webp', 'jpg')
+    }
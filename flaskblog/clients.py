@@ -0,0 +1,84 @@
+import asyncio
+import threading
+from flask import Flask
+
+# Network clients hanging off the app are built the first time they're used,
+# not in create_app. One-shot CLI commands, workers that never search and
+# processes started before Elasticsearch is up don't pay for a client (or the
+# import of its library) they never touch. Each attribute can be assigned
+# directly, e.g. a mock in tests.
+
+
+class lazy_client:
+    """App attribute built once by ``factory(app)`` on first access; the factory returns None when unconfigured."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._lock = threading.Lock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, app, owner=None):
+        if app is None:
+            return self
+        try:
+            return app.__dict__[self.name]
+        except KeyError:
+            pass
+        with self._lock:
+            if self.name not in app.__dict__:
+                app.__dict__[self.name] = self.factory(app)
+        return app.__dict__[self.name]
+
+    def __set__(self, app, value):
+        app.__dict__[self.name] = value
+
+
+def _elasticsearch(app):
+    # Only the 'elasticsearch' search backend uses it
+    if not app.config['ELASTICSEARCH_URL'] or app.config['SEARCH_BACKEND'] != 'elasticsearch':
+        return None
+    from elasticsearch import Elasticsearch
+    return Elasticsearch([app.config['ELASTICSEARCH_URL']])
+
+
+def _async_elasticsearch(app):
+    # For the async search view (SEARCH_ASYNC). Only ever used on app.io_loop, so
+    # every request shares its connection pool. The httpx node needs elasticsearch 8.13+.
+    if not app.config['ELASTICSEARCH_URL'] or app.config['SEARCH_BACKEND'] != 'elasticsearch':
+        return None
+    from elasticsearch import AsyncElasticsearch
+    return AsyncElasticsearch([app.config['ELASTICSEARCH_URL']], node_class='httpxasync')
+
+
+class EventLoopThread:
+    """An event loop running on a daemon thread, shared by every request in the process.
+
+    Async views get a fresh event loop per request, and an async client's
+    connections belong to the loop they were opened on. Running the client's
+    calls here instead lets requests share one pool.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='io-loop', daemon=True).start()
+
+    async def run(self, coro):
+        """Await ``coro`` on the shared loop from any other loop."""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+
+def _redis(app):
+    # Shared client for caches (TaskTiger keeps its own connection)
+    if not app.config['REDIS_HOST']:
+        return None
+    from redis import Redis
+    return Redis(host=app.config['REDIS_HOST'], port=6379)
+
+
+class FlaskBlog(Flask):
+    elasticsearch = lazy_client(_elasticsearch)
+    async_elasticsearch = lazy_client(_async_elasticsearch)
+    io_loop = lazy_client(lambda app: EventLoopThread())
+    redis = lazy_client(_redis)
@@ -0,0 +1,71 @@
+import hashlib
+from datetime import timezone
+from flask import current_app, request, session, render_template, make_response
+from flask_login import current_user
+
+# Pages built from posts and their authors carry an ETag and Last-Modified
+# derived from the rows' updated_at columns. A client that sends them back gets
+# a 304 without the page being rendered.
+
+
+def as_utc(value):
+    # SQLite hands back naive datetimes; they are stored in UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def post_validators(posts):
+    """What a page showing ``posts`` depends on: each post's and author's id and updated_at."""
+    parts = []
+    for post in posts:
+        parts += [post.id, post.updated_at, post.user_id, post.author.updated_at]
+    modified = [as_utc(value) for post in posts for value in (post.updated_at, post.author.updated_at)]
+    return parts, max(modified, default=None)
+
+
+def feed_validators(page):
+    """Validators for a ``pagination.FeedPage``: its posts plus the pagination links,
+    which change when posts are added or removed elsewhere in the feed."""
+    parts, last_modified = post_validators(page.items)
+    parts += [page.page_numbers, page.has_newer, page.has_older]
+    return parts, last_modified
+
+
+def render_conditional(template_name, validators, last_modified=None, **context):
+    """Render ``template_name``, or answer 304 if the client's copy is still current.
+
+    ``validators`` lists everything the page depends on besides the viewer,
+    who is always included because the navbar and edit buttons differ per user.
+    """
+    etag = _etag(validators)
+    # Flashed messages are shown once; a 304 would swallow them
+    if '_flashes' not in session and _is_current(etag, last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render_template(template_name, **context))
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Browsers and proxies may keep the page but must check it's current before reuse
+    response.cache_control.no_cache = True
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+    response.vary.add('Cookie')
+    return response
+
+
+def _etag(validators):
+    viewer = current_user.get_id() if current_user.is_authenticated else None
+    # A deploy can change the markup (and asset URLs) of every page
+    version = (current_app.config['FRAGMENT_CACHE_VERSION'], current_app.extensions['assets']['version'])
+    raw = repr((version, viewer, request.full_path, list(validators)))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _is_current(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    # Last-Modified says nothing about who is looking, so only anonymous pages go by it
+    if request.if_modified_since and last_modified is not None and not current_user.is_authenticated:
+        # HTTP dates have one-second resolution
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
@@ -3,12 +3,150 @@ import os
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///site.db')
+    # Applied to every SQLite connection, in this order (see flaskblog/database.py)
+    SQLITE_PRAGMAS = {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    }
+    # Connection pool for server databases (ignored for SQLite)
+    DB_POOL_SIZE = 5
+    DB_MAX_OVERFLOW = 10
+    DB_POOL_TIMEOUT = 10
+    DB_POOL_RECYCLE = 1800
+    DB_POOL_PRE_PING = True
+    # Optional read replica for GET requests; writers stay on the primary this long after a write
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    DB_REPLICA_PIN_SECONDS = 10
     MAIL_SERVER = 'sandbox.smtp.mailtrap.io'
     MAIL_PORT = 2525
     MAIL_USE_TLS = True
     MAIL_USERNAME = os.environ.get('EMAIL_USER')
     MAIL_PASSWORD = os.environ.get('EMAIL_PASS')
+    # Profile pictures, relative to the package; the app serves them as static/profile_pics
     UPLOADED_PHOTOS_DEST = 'static/profile_pics'
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL') or 'http://elasticsearch:9200'
-    REDIS_HOST = 'redis'
-    OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
\ No newline at end of file
+    REDIS_HOST = os.environ.get('REDIS_HOST') or 'redis'
+    OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+    # bcrypt cost for new hashes; older hashes are upgraded when their owner logs in
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS') or 12)
+    # Hashing runs on this many threads per process, with at most PASSWORD_HASH_QUEUE
+    # more requests waiting (each up to PASSWORD_HASH_TIMEOUT seconds) before a 503
+    PASSWORD_HASH_WORKERS = os.cpu_count() or 2
+    PASSWORD_HASH_QUEUE = 32
+    PASSWORD_HASH_TIMEOUT = 10
+    POSTS_PER_PAGE = 5
+    # Feeds link to this many numbered pages, deeper pages are reached with cursors
+    FEED_NUMBERED_PAGES = 5
+
+    # Search index updates are collected in Redis and flushed in one bulk request
+    # at most SEARCH_INDEX_FLUSH_MS after the first change, or as soon as
+    # SEARCH_INDEX_BATCH_SIZE posts are waiting
+    SEARCH_INDEX_FLUSH_MS = 500
+    SEARCH_INDEX_BATCH_SIZE = 500
+
+    # 'elasticsearch', or 'fts5' to search inside the SQLite database with no search server
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or 'elasticsearch'
+    # Categories listed next to search results, most matches first
+    SEARCH_MAX_FACETS = 20
+
+    # Serve /search from an async view that sends the search and the facet counts to
+    # Elasticsearch together over one shared async client (needs Flask's async extra)
+    SEARCH_ASYNC = os.environ.get('SEARCH_ASYNC', '').lower() in ('1', 'true')
+
+    # Render search results from the documents stored in Elasticsearch instead of the database
+    SEARCH_RESULTS_FROM_SOURCE = True
+
+    # AI summaries: 'openai', or 'stub' for a local stand-in (tests, benchmarks).
+    # Pending posts are batched for up to SUMMARY_BATCH_WAIT_MS, SUMMARY_BATCH_SIZE
+    # posts per backend call, with at most SUMMARY_MAX_IN_FLIGHT calls at once
+    SUMMARY_BACKEND = os.environ.get('SUMMARY_BACKEND') or 'openai'
+    SUMMARY_MODEL = 'gpt-3.5-turbo'
+    SUMMARY_TIMEOUT = 30
+    SUMMARY_BATCH_SIZE = 8
+    SUMMARY_BATCH_WAIT_MS = 1000
+    SUMMARY_MAX_IN_FLIGHT = 4
+    SUMMARY_CACHE_TTL = 30 * 24 * 3600
+    SUMMARY_STUB_LATENCY = 0.0
+
+    # Push finished AI summaries to open pages over server-sent events (needs Redis).
+    # Each open stream holds a server thread, so streams are short and the
+    # browser reconnects after SUMMARY_STREAM_RETRY_MS with what is still pending.
+    SUMMARY_PUSH_ENABLED = True
+    SUMMARY_STREAM_TIMEOUT = 20
+    SUMMARY_STREAM_KEEPALIVE = 10
+    SUMMARY_STREAM_RETRY_MS = 1000
+    SUMMARY_STREAM_MAX_POSTS = 50
+
+    # Cache of search results per normalized query and page, dropped on every index write
+    SEARCH_CACHE_ENABLED = True
+    SEARCH_CACHE_TTL = 300
+
+    # Raise (or with 'warn', log) when a request lazy-loads one of these relationships
+    # with SQL, naming the template line that did it (see flaskblog/lazyloads.py)
+    STRICT_LAZY_LOADS = False
+    STRICT_LAZY_LOAD_RELATIONSHIPS = ('User.posts', 'Post.author')
+
+    # Request timings: a Server-Timing header on every response and Prometheus
+    # histograms per endpoint at /metrics (see flaskblog/metrics.py). /metrics
+    # answers 404 unless METRICS_ENDPOINT is set, and with METRICS_TOKEN only
+    # scrapers sending "Authorization: Bearer <token>" get an answer
+    METRICS_ENABLED = True
+    METRICS_ENDPOINT = os.environ.get('METRICS_ENDPOINT', '').lower() in ('1', 'true')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    SERVER_TIMING_ENABLED = True
+    METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    METRICS_QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+    # Logged-in users' identities are cached in Redis and, briefly, in each process
+    USER_CACHE_TTL = 300
+    USER_CACHE_LOCAL_TTL = 5
+
+    # Fingerprinted static files (see `flask assets build`) are cached by browsers this long
+    ASSETS_MAX_AGE = 365 * 24 * 3600
+
+    # Profile pictures are stored at each of these widths, as WebP and JPEG;
+    # User.image_file names the AVATAR_FALLBACK_SIZE JPEG
+    AVATAR_SIZES = (65, 130, 250)
+    AVATAR_FALLBACK_SIZE = 130
+
+    # Rendered post fragments: bump FRAGMENT_CACHE_VERSION whenever the article templates change
+    FRAGMENT_CACHE_ENABLED = True
+    FRAGMENT_CACHE_VERSION = 2
+    FRAGMENT_CACHE_SIZE = 2048
+    FRAGMENT_CACHE_TTL = 24 * 3600
+
+    # How listing views load post authors: 'joined' (one JOIN) or 'selectin' (one extra IN query)
+    AUTHOR_LOAD_STRATEGY = {
+        'main.home': 'joined',
+        'users.user_posts': 'joined',
+        'main.search': 'selectin',
+    }
+
+
+
+class ProductionConfig(Config):
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 20)
+
+
+class WorkerConfig(ProductionConfig):
+    # Tasks run one at a time; they can afford to wait for the web tier's writes
+    SQLITE_PRAGMAS = {**Config.SQLITE_PRAGMAS, 'busy_timeout': 30000}
+    DB_POOL_SIZE = 2
+    DB_MAX_OVERFLOW = 2
+    DB_POOL_TIMEOUT = 30
+
+
+CONFIGS = {
+    'default': Config,
+    'production': ProductionConfig,
+    'worker': WorkerConfig,
+}
+
+
+def config_from_env():
+    """The Config subclass named by FLASKBLOG_CONFIG (default, production or worker)."""
+    return CONFIGS[os.environ.get('FLASKBLOG_CONFIG') or 'default']
@@ -0,0 +1,119 @@
+import time
+from contextlib import contextmanager
+from functools import partial
+from flask import request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Engine settings come from the DB_* / SQLITE_PRAGMAS config keys, so each
+# environment's Config subclass picks its own.
+#
+# SQLite (web and worker share one file): every connection switches to the
+# write-ahead log, so readers no longer block on a committing writer and vice
+# versa, and waits up to busy_timeout ms for the write lock instead of failing
+# with "database is locked". synchronous=NORMAL is safe under WAL and saves an
+# fsync per commit.
+#
+# Server databases (Postgres, MySQL) get a sized connection pool that checks
+# connections before use and replaces them before the server drops them.
+#
+# With DATABASE_REPLICA_URL set, reads go to that database (the 'replica' bind)
+# where stale data is acceptable: GET/HEAD requests, and code wrapped in
+# ``replica_reads()``. Everything else stays on the primary, including every
+# query after the first write in a session. A client that just wrote something
+# is kept on the primary for DB_REPLICA_PIN_SECONDS, long enough for the
+# replica to catch up, so the redirect after saving shows the saved data.
+REPLICA = 'replica'
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class RoutingSession(Session):
+    """Session that sends plain SELECTs to the replica while ``info['use_replica']`` is set."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            engines = self._db.engines
+            if REPLICA in engines:
+                if getattr(clause, 'is_select', False) and not self._flushing:
+                    if self.info.get('use_replica'):
+                        return engines[REPLICA]
+                else:
+                    # This may write: read our own writes from here on
+                    self.info['use_replica'] = False
+                    self.info['wrote'] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def replica_reads(db):
+    """Send this block's reads to the replica (if there is one), e.g. for bulk exports."""
+    previous = db.session.info.get('use_replica', False)
+    db.session.info['use_replica'] = True
+    try:
+        yield
+    finally:
+        db.session.info['use_replica'] = previous
+
+
+def engine_options(config, url=None):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database (or ``url``).
+
+    Anything set in SQLALCHEMY_ENGINE_OPTIONS itself wins over the DB_* keys.
+    """
+    options = {}
+    if make_url(url or config['SQLALCHEMY_DATABASE_URI']).get_backend_name() != 'sqlite':
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT'],
+            pool_recycle=config['DB_POOL_RECYCLE'],
+            pool_pre_ping=config['DB_POOL_PRE_PING'],
+        )
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def init_database(app, db):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    replica_url = app.config['DATABASE_REPLICA_URL']
+    if replica_url:
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds[REPLICA] = {'url': replica_url, **engine_options(app.config, replica_url)}
+        app.config['SQLALCHEMY_BINDS'] = binds
+        _route_requests(app, db)
+    db.init_app(app)
+    # No tables belong to the replica bind; without this create_all/drop_all would try to manage it
+    db.metadatas.pop(REPLICA, None)
+    pragmas = app.config['SQLITE_PRAGMAS']
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite' and pragmas:
+                event.listen(engine, 'connect', partial(_apply_pragmas, pragmas))
+
+
+def _apply_pragmas(pragmas, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        # In order: busy_timeout first so switching journal_mode waits for other connections
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def _route_requests(app, db):
+    @app.before_request
+    def route_reads():
+        if request.endpoint == 'static':
+            # Reading the session would add Vary: Cookie to cacheable files
+            return
+        pinned = session.get('_db_primary_until', 0) > time.time()
+        db.session.info['use_replica'] = request.method in SAFE_METHODS and not pinned
+        db.session.info['wrote'] = False
+
+    @app.after_request
+    def pin_writers(response):
+        if db.session.info.pop('wrote', False):
+            session['_db_primary_until'] = time.time() + app.config['DB_REPLICA_PIN_SECONDS']
+        return response
@@ -0,0 +1,251 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from flask import current_app
+from elasticsearch import NotFoundError
+from elasticsearch.helpers import bulk
+from flaskblog import db
+from flaskblog.search import SearchBackend
+
+# The Elasticsearch search backend (SEARCH_BACKEND = 'elasticsearch'), through
+# ``current_app.elasticsearch``. Kept apart from flaskblog.search so the client
+# library is only imported by processes that search with it, on first use.
+
+
+def document(model):
+    return model.search_document()
+
+def ensure_index(model):
+    """Create the model's index if needed, remembering per app that it exists.
+
+    Returns False when the index had to be created (so it's still empty).
+    """
+    known = current_app.extensions.setdefault('search_indices', set())
+    index = model.__tablename__
+    if index in known:
+        return True
+    existed = current_app.elasticsearch.indices.exists(index=index)
+    if not existed:
+        model.create_index()
+    known.add(index)
+    return bool(existed)
+
+async def ensure_index_async(model):
+    """``ensure_index`` through the async client, so an async view never blocks on it."""
+    known = current_app.extensions.setdefault('search_indices', set())
+    index = model.__tablename__
+    if index in known:
+        return True
+    existed = await current_app.io_loop.run(
+        _ensure_index(current_app.async_elasticsearch, index, model.index_body()))
+    known.add(index)
+    return existed
+
+async def _ensure_index(es, index, body):
+    # Runs on the shared loop, in one hop
+    if await es.indices.exists(index=index):
+        return True
+    # The results and facet requests may both get here first
+    await es.options(ignore_status=400).indices.create(index=index, body=body)
+    return False
+
+def forget_index(model):
+    # Called when a search finds the index gone, so the next one checks again
+    current_app.extensions.get('search_indices', set()).discard(model.__tablename__)
+
+
+class ElasticsearchBackend(SearchBackend):
+    """Search through ``current_app.elasticsearch``; every call is a no-op when it's None."""
+
+    def available(self):
+        return current_app.elasticsearch is not None
+
+    def _query(self, model, expression, category=None):
+        match = {'multi_match': {'query': expression, 'fields': model.__search_fields__, 'fuzziness': 'AUTO'}}
+        if category is None:
+            return match
+        # Filter context: doesn't affect scoring and ES caches the matching documents
+        return {'bool': {'must': match, 'filter': [{'term': {model.__facet_field__: category}}]}}
+
+    def _aggs(self, model):
+        return {'facets': {'terms': {'field': model.__facet_field__,
+                                     'size': current_app.config['SEARCH_MAX_FACETS']}}}
+
+    def _facets(self, search):
+        aggregations = search.get('aggregations')
+        if aggregations is None:
+            return None
+        return [(bucket['key'], bucket['doc_count']) for bucket in aggregations['facets']['buckets']]
+
+    def _search_request(self, model, expression, page, per_page, category):
+        # Results can be rendered from the stored document, which never needs the full text
+        source = {'excludes': ['content']} if current_app.config['SEARCH_RESULTS_FROM_SOURCE'] else False
+        return dict(
+            index=model.__tablename__,
+            query=self._query(model, expression, category),
+            highlight={'fields': {'title': {},'content': {}}},
+            # Unfiltered, the same request can count the categories
+            aggs=self._aggs(model) if category is None else None,
+            source=source,
+            from_=(page - 1) * per_page,
+            size=per_page
+        )
+
+    def _facets_request(self, model, expression):
+        # size=0 requests are kept in ES's shard request cache until the index refreshes
+        return dict(index=model.__tablename__, query=self._query(model, expression),
+                    aggs=self._aggs(model), size=0)
+
+    def _results(self, search, category):
+        ids = [int(hit['_id']) for hit in search['hits']['hits']]
+        total = search['hits']['total']['value']
+        hits = search['hits']['hits']
+        return ids, total, hits, self._facets(search) if category is None else None
+
+    def search(self, model, expression, page, per_page, category=None):
+        if not ensure_index(model):
+            return [], 0, [], []  # Proactively fixed the missing index, nothing in it yet
+        request = self._search_request(model, expression, page, per_page, category)
+        try:
+            search = current_app.elasticsearch.search(**request)
+        except NotFoundError:
+            forget_index(model)
+            return [], 0, [], []
+        return self._results(search, category)
+
+    def facets(self, model, expression):
+        if not ensure_index(model):
+            return []
+        request = self._facets_request(model, expression)
+        try:
+            search = current_app.elasticsearch.search(**request)
+        except NotFoundError:
+            forget_index(model)
+            return []
+        return self._facets(search) or []
+
+    # The same through the async client, run on the process's shared loop.
+    # Requests are built here, where the app context is; the loop thread has none.
+
+    async def search_async(self, model, expression, page, per_page, category=None):
+        if not await ensure_index_async(model):
+            return [], 0, [], []
+        request = self._search_request(model, expression, page, per_page, category)
+        try:
+            search = await current_app.io_loop.run(current_app.async_elasticsearch.search(**request))
+        except NotFoundError:
+            forget_index(model)
+            return [], 0, [], []
+        return self._results(search, category)
+
+    async def facets_async(self, model, expression):
+        if not await ensure_index_async(model):
+            return []
+        request = self._facets_request(model, expression)
+        try:
+            search = await current_app.io_loop.run(current_app.async_elasticsearch.search(**request))
+        except NotFoundError:
+            forget_index(model)
+            return []
+        return self._facets(search) or []
+
+    def index(self, index, model):
+        # Check if Elasticsearch is configured
+        if not current_app.elasticsearch:
+            return
+        # Returns once the document is searchable, so the result cache is only invalidated after that
+        current_app.elasticsearch.index(index=index, id=model.id, document=document(model), refresh='wait_for')
+
+    def remove(self, index, doc_id):
+        # Remove document from index when a post is deleted
+        if not current_app.elasticsearch:
+            return
+        current_app.elasticsearch.delete(index=index, id=doc_id, refresh='wait_for')
+
+    def sync(self, model, ids):
+        if not current_app.elasticsearch:
+            return
+        index = model.__tablename__
+        rows = db.session.scalars(
+            db.select(model).options(*model.search_load_options()).where(model.id.in_(ids))
+        ).all()
+        found = {row.id for row in rows}
+        actions = [{'_op_type': 'index', '_index': index, '_id': row.id, '_source': document(row)}
+                   for row in rows]
+        actions += [{'_op_type': 'delete', '_index': index, '_id': doc_id}
+                    for doc_id in ids if doc_id not in found]
+        # Deleting a document that was never indexed is fine. Like ``index``,
+        # waits for the changes to be searchable before the caller bumps generations
+        bulk(current_app.elasticsearch, actions, ignore_status=(404,), refresh='wait_for')
+
+    def rebuild(self, model, workers=4, chunk_size=500, keep_old=False, progress=print):
+        """Build the new index next to the live one and swap it in atomically.
+
+        Rows are streamed from the database ``chunk_size`` at a time and sent
+        through the bulk API with up to ``workers`` requests in flight. The new
+        index is named ``<index>-<timestamp>`` and is built with refresh and
+        replicas off; when it's complete the ``<index>`` alias is moved onto it in
+        a single ``update_aliases`` call, so searches never see a missing or
+        half-built index.
+        """
+        es = current_app.elasticsearch
+        alias = model.__tablename__
+        new_index = f"{alias}-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}"
+
+        body = model.index_body()
+        body['settings']['index'] = {'refresh_interval': '-1', 'number_of_replicas': 0}
+        es.indices.create(index=new_index, body=body)
+
+        total = db.session.scalar(db.select(db.func.count()).select_from(model))
+        done = failed = 0
+        started = time.perf_counter()
+
+        def send(actions):
+            # Runs on a worker thread; rows were already turned into plain dicts
+            return bulk(es, actions, raise_on_error=False, stats_only=True)
+
+        rows = db.session.execute(
+            db.select(model).options(*model.search_load_options()).execution_options(yield_per=chunk_size)
+        ).scalars()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for chunk in rows.partitions():
+                actions = [{'_index': new_index, '_id': row.id, '_source': document(row)} for row in chunk]
+                # Keep the stream from running ahead of the bulk requests
+                if len(pending) >= workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        ok, errors = future.result()
+                        done, failed = done + ok, failed + errors
+                        _report(progress, done, total, started)
+                pending.add(pool.submit(send, actions))
+            for future in pending:
+                ok, errors = future.result()
+                done, failed = done + ok, failed + errors
+            _report(progress, done, total, started)
+
+        es.indices.put_settings(index=new_index, settings={
+            'index': {'refresh_interval': None, 'number_of_replicas': None}
+        })
+        es.indices.refresh(index=new_index)
+
+        actions = [{'add': {'index': new_index, 'alias': alias}}]
+        old_indices = []
+        if es.indices.exists_alias(name=alias):
+            old_indices = list(es.indices.get_alias(name=alias).keys())
+            actions += [{'remove': {'index': old, 'alias': alias}} for old in old_indices]
+        elif es.indices.exists(index=alias):
+            # An index created before aliases were used; drop it in the same atomic step
+            actions.append({'remove_index': {'index': alias}})
+        es.indices.update_aliases(actions=actions)
+
+        if not keep_old:
+            for old in old_indices:
+                es.indices.delete(index=old)
+        return new_index, done, failed
+
+
+def _report(progress, done, total, started):
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed else 0
+    progress(f"Indexed {done}/{total} documents ({rate:.0f} docs/sec)")
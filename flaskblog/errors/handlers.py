@@ -1,4 +1,5 @@
 from flask import Blueprint, render_template
+from flaskblog.passwords import PasswordHasherBusy
 
 errors = Blueprint('errors', __name__)
 
@@ -16,3 +17,9 @@ def error_403(error):
 @errors.app_errorhandler(500)
 def error_500(error):
     return render_template('errors/500.html'), 500
+
+
+@errors.app_errorhandler(PasswordHasherBusy)
+def error_hasher_busy(error):
+    # Too many logins/sign-ups at once; the pool frees up within seconds
+    return render_template('errors/503.html'), 503, {'Retry-After': '5'}
@@ -0,0 +1,156 @@
+import threading
+from flask import current_app, g, render_template
+from markupsafe import Markup, escape
+from redis.exceptions import RedisError
+from flaskblog.cache import LRUCache
+
+# Rendered fragments live in Redis (shared by every web process) with an LRU in front.
+# A fragment's key embeds generation counters for its post and its author, so bumping
+# a counter is enough to invalidate every cached copy, in every process.
+
+
+class _LocalState:
+    def __init__(self, maxsize):
+        self.fragments = LRUCache(maxsize=maxsize)
+        # Generation counters used when Redis isn't configured (tests, single-process dev servers)
+        self.generations = {}
+        self.lock = threading.Lock()
+
+
+def _local():
+    state = current_app.extensions.get('fragment_cache')
+    if state is None:
+        state = _LocalState(current_app.config['FRAGMENT_CACHE_SIZE'])
+        current_app.extensions['fragment_cache'] = state
+    return state
+
+
+def _post_key(post_id):
+    return f'fragment:gen:post:{post_id}'
+
+
+def _author_key(user_id):
+    return f'fragment:gen:user:{user_id}'
+
+
+def _bump(*keys):
+    # Forget the generations this context already fetched
+    g.pop('fragment_generations', None)
+    redis = current_app.redis
+    if redis is None:
+        local = _local()
+        with local.lock:
+            for key in keys:
+                local.generations[key] = local.generations.get(key, 0) + 1
+        return
+    try:
+        pipe = redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.incr(key)
+        pipe.execute()
+    except RedisError as e:
+        current_app.logger.warning(f"Could not invalidate fragments {', '.join(keys)}: {e}")
+
+
+def invalidate_posts(post_ids):
+    """Drop every cached fragment of these posts."""
+    if post_ids:
+        _bump(*(_post_key(post_id) for post_id in post_ids))
+
+
+def invalidate_authors(user_ids):
+    """Drop every cached fragment showing these users' names or pictures."""
+    if user_ids:
+        _bump(*(_author_key(user_id) for user_id in user_ids))
+
+
+def prefetch_generations(posts):
+    """Fetch the generation counters for a whole page of posts in one round trip."""
+    keys = set()
+    for post in posts:
+        keys.add(_post_key(post.id))
+        keys.add(_author_key(post.user_id))
+    try:
+        _load_generations(list(keys))
+    except RedisError as e:
+        current_app.logger.warning(f"Fragment cache unavailable: {e}")
+
+
+def _load_generations(keys):
+    known = g.setdefault('fragment_generations', {})
+    missing = [key for key in keys if key not in known]
+    if not missing:
+        return known
+    redis = current_app.redis
+    if redis is None:
+        local = _local()
+        with local.lock:
+            known.update({key: local.generations.get(key, 0) for key in missing})
+    else:
+        values = redis.mget(missing)
+        known.update({key: int(value or 0) for key, value in zip(missing, values)})
+    return known
+
+
+def _slot(name):
+    return Markup(f'<!--slot:{name}-->')
+
+
+def cached_article(post, template_name, variant=None, **slots):
+    """Render a post's article fragment, reusing a cached copy while it's current.
+
+    The cached HTML never contains viewer-specific markup. Anything that
+    depends on the request (summary buttons, search highlights) is rendered
+    by the caller and passed in as a slot, which the template marks with
+    ``{{ slot('name') }}`` and which is filled in after the cache lookup.
+    """
+    if not current_app.config['FRAGMENT_CACHE_ENABLED']:
+        html = render_template(template_name, post=post, variant=variant, slot=_slot)
+        return _fill_slots(html, slots)
+
+    post_key, author_key = _post_key(post.id), _author_key(post.user_id)
+    try:
+        generations = _load_generations([post_key, author_key])
+    except RedisError as e:
+        current_app.logger.warning(f"Fragment cache unavailable: {e}")
+        html = render_template(template_name, post=post, variant=variant, slot=_slot)
+        return _fill_slots(html, slots)
+
+    key = (f"fragment:{current_app.config['FRAGMENT_CACHE_VERSION']}:{template_name}:{variant}:"
+           f"{post.id}:{generations[post_key]}:{generations[author_key]}")
+    fragments = _local().fragments
+    html = fragments.get(key)
+    if html is None:
+        html = _get_shared(key)
+        if html is None:
+            html = render_template(template_name, post=post, variant=variant, slot=_slot)
+            _set_shared(key, html)
+        fragments.set(key, html)
+    return _fill_slots(html, slots)
+
+
+def _get_shared(key):
+    redis = current_app.redis
+    if redis is None:
+        return None
+    try:
+        value = redis.get(key)
+    except RedisError:
+        return None
+    return value.decode('utf-8') if value is not None else None
+
+
+def _set_shared(key, html):
+    redis = current_app.redis
+    if redis is None:
+        return
+    try:
+        redis.set(key, html, ex=current_app.config['FRAGMENT_CACHE_TTL'])
+    except RedisError:
+        pass
+
+
+def _fill_slots(html, slots):
+    for name, value in slots.items():
+        html = html.replace(f'<!--slot:{name}-->', str(escape(value)))
+    return Markup(html)
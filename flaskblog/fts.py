@@ -0,0 +1,178 @@
+import re
+import time
+from flask import current_app
+from sqlalchemy import DDL, event
+from markupsafe import escape
+from flaskblog import db
+from flaskblog.search import SearchBackend
+
+# Search inside SQLite with FTS5, for deployments without Elasticsearch
+# (SEARCH_BACKEND = 'fts5'). Each searchable model gets an external-content
+# FTS5 table, ``<table>_fts``, over its ``__searchable__`` columns, with the
+# porter stemmer so "build" finds "building". Triggers on the model's table
+# update it in the same transaction as the row, so there are no index tasks
+# and a search right after a commit sees it. Results are ranked with bm25,
+# weighted by the boosts in ``__search_fields__`` (title^3). The FTS tables and
+# triggers are schema: the migrations create them, as does ``db.create_all()``.
+#
+# Hits carry highlights but no stored document; the results page loads the
+# posts themselves in one query. Queries are declared as SELECTs (.columns())
+# so a read replica can serve them.
+
+MAX_TERMS = 32
+# Private-use markers, swapped for <em> once the text around them is escaped
+OPEN, CLOSE = '\ue000', '\ue001'
+SNIPPET_TOKENS = 32
+
+
+def match_expression(expression):
+    """An FTS5 query matching any word of ``expression``, like multi_match's default.
+
+    Every word is quoted, so FTS5 operators and punctuation typed by the user are just text.
+    """
+    terms = re.findall(r'\w+', expression)[:MAX_TERMS]
+    return ' OR '.join(f'"{term}"' for term in terms)
+
+
+def _highlight(text):
+    return str(escape(text)).replace(OPEN, '<em>').replace(CLOSE, '</em>')
+
+
+def _weights(model):
+    boosts = dict(field.partition('^')[::2] for field in model.__search_fields__)
+    return [float(boosts.get(column) or 1) for column in model.__searchable__]
+
+
+def fts_table_statements(table, columns):
+    """Create ``<table>_fts`` over ``columns`` and fill it from the rows already there."""
+    fts = f'{table}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({', '.join(columns)}, content='{table}', "
+        f"content_rowid='id', tokenize='porter unicode61')",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def fts_trigger_statements(table, columns):
+    """The triggers keeping ``<table>_fts`` in step with ``table``.
+
+    SQLite migrations that rebuild ``table`` (batch_alter_table copies it)
+    drop them, so those migrations run these again.
+    """
+    fts = f'{table}_fts'
+    names = ', '.join(columns)
+    new = ', '.join(f'new.{column}' for column in columns)
+    old = ', '.join(f'old.{column}' for column in columns)
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END",
+    ]
+
+
+def install_fts_ddl(model):
+    """Create the model's FTS table with its table on SQLite, for ``db.create_all()``.
+
+    Existing databases get it from the migrations.
+    """
+    table = model.__table__
+    for statement in fts_table_statements(table.name, model.__searchable__) + \
+            fts_trigger_statements(table.name, model.__searchable__):
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(table, 'after_drop', DDL(f'DROP TABLE IF EXISTS {table.name}_fts').execute_if(dialect='sqlite'))
+
+
+class FTS5Backend(SearchBackend):
+    transactional = True
+
+    def available(self):
+        """False, with an error logged, until the migrations have created the FTS tables."""
+        state = current_app.extensions.setdefault('fts_tables', {})
+        if 'ready' not in state:
+            if db.engine.dialect.name != 'sqlite':
+                raise RuntimeError("SEARCH_BACKEND 'fts5' needs a SQLite database")
+            state['ready'] = db.session.execute(
+                db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name LIKE '%_fts'").columns()
+            ).first() is not None
+            if not state['ready']:
+                current_app.logger.error("No FTS5 tables; run `flask db upgrade`")
+        return state['ready']
+
+    def search(self, model, expression, page, per_page, category=None):
+        match = match_expression(expression)
+        if not match:
+            return [], 0, [], []
+        table = model.__tablename__
+        fts = f'{table}_fts'
+        columns = model.__searchable__
+        where = f"{fts} MATCH :match"
+        params = {'match': match}
+        if category is not None:
+            where += f" AND {table}.{model.__facet_field__} = :category"
+            params['category'] = category
+        source = f"{fts} JOIN {table} ON {table}.id = {fts}.rowid"
+        total = db.session.execute(
+            db.text(f"SELECT count(*) FROM {source} WHERE {where}").columns(), params
+        ).scalar()
+        if not total:
+            return [], 0, [], None
+
+        # The first column (the title) is highlighted whole, the others as snippets
+        marked = [f"highlight({fts}, 0, :open, :close)"] + [
+            f"snippet({fts}, {i}, :open, :close, '...', {SNIPPET_TOKENS})" for i in range(1, len(columns))]
+        weights = ', '.join(str(weight) for weight in _weights(model))
+        rows = db.session.execute(
+            db.text(f"SELECT {fts}.rowid, {', '.join(marked)} FROM {source} WHERE {where} "
+                    f"ORDER BY bm25({fts}, {weights}) LIMIT :limit OFFSET :offset").columns(),
+            dict(params, open=OPEN, close=CLOSE, limit=per_page, offset=(page - 1) * per_page),
+        ).all()
+
+        ids, hits = [], []
+        for row in rows:
+            highlight = {column: [_highlight(text)] for column, text in zip(columns, row[1:])
+                         if text and OPEN in text}
+            ids.append(row[0])
+            hits.append({'_id': str(row[0]), 'highlight': highlight})
+        # Counted by facets() in a separate GROUP BY
+        return ids, total, hits, None
+
+    def facets(self, model, expression):
+        match = match_expression(expression)
+        if not match:
+            return []
+        table = model.__tablename__
+        fts = f'{table}_fts'
+        field = f'{table}.{model.__facet_field__}'
+        rows = db.session.execute(
+            db.text(f"SELECT {field}, count(*) AS n FROM {fts} JOIN {table} ON {table}.id = {fts}.rowid "
+                    f"WHERE {fts} MATCH :match GROUP BY {field} ORDER BY n DESC, {field} "
+                    f"LIMIT :limit").columns(),
+            {'match': match, 'limit': current_app.config['SEARCH_MAX_FACETS']},
+        ).all()
+        return [tuple(row) for row in rows]
+
+    # The triggers keep the index current, so there is nothing to push
+
+    def index(self, index, model):
+        pass
+
+    def remove(self, index, doc_id):
+        pass
+
+    def sync(self, model, ids):
+        pass
+
+    def rebuild(self, model, workers=4, chunk_size=500, keep_old=False, progress=print):
+        """Refill the FTS table from the model's table and merge its segments."""
+        fts = f'{model.__tablename__}_fts'
+        started = time.perf_counter()
+        db.session.execute(db.text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+        db.session.execute(db.text(f"INSERT INTO {fts}({fts}) VALUES ('optimize')"))
+        db.session.commit()
+        done = db.session.scalar(db.select(db.func.count()).select_from(model))
+        progress(f"Indexed {done}/{done} documents in {time.perf_counter() - started:.2f}s")
+        return fts, done, 0
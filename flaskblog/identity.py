@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from flask_login import UserMixin
+from redis.exceptions import RedisError
+from flaskblog import db
+from flaskblog.models import User
+
+# ``current_user`` for logged-in requests comes from here instead of a primary
+# key query. Identities are kept in Redis for USER_CACHE_TTL seconds and in each
+# process for USER_CACHE_LOCAL_TTL seconds in front of it. Committing a change
+# to a user's name, email, picture or password drops both copies (other
+# processes' local copies expire within the local TTL).
+
+
+class SessionUser(UserMixin):
+    """Detached, read-only snapshot of a ``User`` for ``current_user``.
+
+    Compares equal to the ``User`` row with the same id, so checks like
+    ``post.author == current_user`` work as before. Views that change the
+    user load the row itself.
+    """
+
+    def __init__(self, id, username, email, image_file, updated_at):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.image_file = image_file
+        self.updated_at = updated_at
+
+    def __eq__(self, other):
+        if isinstance(other, (SessionUser, User)):
+            return self.id == other.id
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"SessionUser('{self.username}', '{self.email}', '{self.image_file}')"
+
+    def to_json(self):
+        return json.dumps({'id': self.id, 'username': self.username, 'email': self.email,
+                           'image_file': self.image_file, 'updated_at': self.updated_at.isoformat()})
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        data['updated_at'] = datetime.fromisoformat(data['updated_at'])
+        return cls(**data)
+
+
+class _LocalIdentities:
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, user_id, identity, ttl):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + ttl, identity)
+
+    def delete(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+
+def _local():
+    state = current_app.extensions.get('identity_cache')
+    if state is None:
+        state = current_app.extensions['identity_cache'] = _LocalIdentities()
+    return state
+
+
+def _key(user_id):
+    return f'user:identity:{user_id}'
+
+
+def load_identity(user_id):
+    """The ``SessionUser`` for ``user_id``, or None if there is no such user."""
+    local = _local()
+    identity = local.get(user_id)
+    if identity is not None:
+        return identity
+
+    redis = current_app.redis
+    if redis is not None:
+        try:
+            raw = redis.get(_key(user_id))
+        except RedisError as e:
+            current_app.logger.warning(f"Identity cache unavailable: {e}")
+            raw = None
+        if raw is not None:
+            identity = SessionUser.from_json(raw)
+
+    if identity is None:
+        row = db.session.execute(
+            db.select(User.id, User.username, User.email, User.image_file, User.updated_at)
+            .where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        identity = SessionUser(*row)
+        if redis is not None:
+            try:
+                redis.set(_key(user_id), identity.to_json(), ex=current_app.config['USER_CACHE_TTL'])
+            except RedisError as e:
+                current_app.logger.warning(f"Identity cache unavailable: {e}")
+
+    local.set(user_id, identity, current_app.config['USER_CACHE_LOCAL_TTL'])
+    return identity
+
+
+def invalidate_identity(user_id):
+    _local().delete(user_id)
+    redis = current_app.redis
+    if redis is None:
+        return
+    try:
+        redis.delete(_key(user_id))
+    except RedisError as e:
+        current_app.logger.error(f"Cached identity for user {user_id} could not be dropped: {e}")
@@ -0,0 +1,71 @@
+import os
+import sys
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context
+from sqlalchemy import event
+from flaskblog.database import RoutingSession
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# With STRICT_LAZY_LOADS on (development and tests), a relationship listed in
+# STRICT_LAZY_LOAD_RELATIONSHIPS that lazy-loads with SQL while a request is
+# being handled is an error: the view should have loaded it up front (a join,
+# selectinload, or the identity map). These loads are usually a template
+# touching ``post.author`` once per row, the start of an N+1. Set the flag to
+# 'warn' to log the violations instead of raising.
+#
+# Each violation names the template and line that triggered it, or the
+# nearest frame of our own code when it didn't come from a template. Code that
+# really means to load lazily wraps itself in ``allow_lazy_loads()``.
+
+
+class LazyLoadError(Exception):
+    pass
+
+
+@contextmanager
+def allow_lazy_loads():
+    previous = g.get('_allow_lazy_loads', False)
+    g._allow_lazy_loads = True
+    try:
+        yield
+    finally:
+        g._allow_lazy_loads = previous
+
+
+def init_lazy_load_guard(app):
+    if app.config['STRICT_LAZY_LOADS'] and not event.contains(RoutingSession, 'do_orm_execute', _check_load):
+        event.listen(RoutingSession, 'do_orm_execute', _check_load)
+
+
+def _check_load(orm_execute_state):
+    if not orm_execute_state.is_select or orm_execute_state.lazy_loaded_from is None \
+            or not has_request_context():
+        return
+    mode = current_app.config['STRICT_LAZY_LOADS']
+    if not mode or g.get('_allow_lazy_loads'):
+        return
+    relationship = orm_execute_state.loader_strategy_path[-1]
+    name = f'{relationship.parent.class_.__name__}.{relationship.key}'
+    if name not in current_app.config['STRICT_LAZY_LOAD_RELATIONSHIPS']:
+        return
+    message = f"Lazy load of {name} at {_trigger()}; load it in the view instead"
+    if mode == 'warn':
+        current_app.logger.warning(message)
+    else:
+        raise LazyLoadError(message)
+
+
+def _trigger():
+    """``template.html:12``, or ``path.py:34`` when no template is rendering."""
+    ours = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            return f'{template.name or "<string>"}:{template.get_corresponding_lineno(frame.f_lineno)}'
+        filename = frame.f_code.co_filename
+        if ours is None and filename.startswith(PACKAGE_DIR) and filename != __file__:
+            ours = f'{filename}:{frame.f_lineno}'
+        frame = frame.f_back
+    return ours or 'unknown'
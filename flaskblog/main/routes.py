@@ -1,5 +1,9 @@
 from flask import render_template, request, Blueprint, current_app, url_for
 from flaskblog.models import Post
+from flaskblog.pagination import paginate_feed
+from flaskblog.fragments import prefetch_generations
+from flaskblog.search import SearchHit
+from flaskblog.conditional import render_conditional, feed_validators
 from flaskblog import db
 
 main = Blueprint('main', __name__)
@@ -8,9 +12,10 @@ main = Blueprint('main', __name__)
 @main.route("/")
 @main.route("/home")
 def home():
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.date_posted.desc()).paginate(page=page, per_page=5)
-    return render_template("home.html", posts=posts)
+    posts = paginate_feed()
+    validators, last_modified = feed_validators(posts)
+    prefetch_generations(posts.items)
+    return render_conditional("home.html", validators, last_modified, posts=posts)
 
 @main.route("/about")
 def about():
@@ -18,41 +23,69 @@ def about():
 
 @main.route("/search")
 def search():
+    q, page, category, per_page = _search_args()
+    if not q:
+        return render_template('search.html', title='Search', posts=[], total=0)
+
+    # Execute search via the Mixin
+    ids, total, hits = Post.search(q, page, per_page, category=category)
+    facets = Post.search_facets(q)
+    return _search_results(q, page, category, per_page, ids, total, hits, facets)
+
+
+async def search_async():
+    """``search`` as an async view, used instead when SEARCH_ASYNC is set.
+
+    The search and the facet counts go out together through the shared
+    async Elasticsearch client (see ``Post.search_async``).
+    """
+    q, page, category, per_page = _search_args()
+    if not q:
+        return render_template('search.html', title='Search', posts=[], total=0)
+
+    ids, total, hits, facets = await Post.search_async(q, page, per_page, category=category)
+    return _search_results(q, page, category, per_page, ids, total, hits, facets)
+
+
+@main.record_once
+def _use_async_search(state):
+    # Same URL and endpoint, so links to main.search don't change
+    if state.app.config['SEARCH_ASYNC']:
+        state.app.view_functions['main.search'] = search_async
+
+
+def _search_args():
     # Retrieve query and page number from URL parameters
     q = request.args.get('q', '')
     page = request.args.get('page', 1, type=int)
+    category = request.args.get('category') or None
     per_page = current_app.config.get('POSTS_PER_PAGE', 5)
+    return q, page, category, per_page
 
-    if not q:
-        return render_template('search.html', title='Search', posts=[], total=0)
 
-    # Execute search via the Mixin
-    ids, total, hits = Post.search(q, page, per_page)
-    
-    # Query database for the full objects based on IDs returned by Elasticsearch
+def _search_results(q, page, category, per_page, ids, total, hits, facets):
     if total > 0:
-        # Fetch posts and maintain the relevance order from Elasticsearch
-        posts = db.session.execute(
-            db.select(Post).filter(Post.id.in_(ids))
-        ).scalars().all()
-        posts.sort(key=lambda x: ids.index(x.id))
-
-        # Match the highlight snippets from 'hits' to the 'posts' objects
-        for i, post in enumerate(posts):
-            # look for the hit that matches this post ID
-            # In most cases, it's hits[i], but searching by ID is safer
-            hit = next((h for h in hits if int(h['_id']) == post.id), None)
-            if hit and 'highlight' in hit:
-                post.highlights = hit['highlight']
-            else:
-                post.highlights = {}
+        posts = SearchHit.from_hits(hits) if current_app.config['SEARCH_RESULTS_FROM_SOURCE'] else None
+        if posts is None:
+            # Query database for the full objects based on IDs returned by Elasticsearch
+            rank = {post_id: i for i, post_id in enumerate(ids)}
+            posts = db.session.execute(
+                db.select(Post).options(Post.with_author()).filter(Post.id.in_(ids))
+            ).scalars().all()
+            # Keep Elasticsearch's relevance order and attach each post's highlight snippets
+            posts.sort(key=lambda post: rank[post.id])
+            highlights = {int(hit['_id']): hit.get('highlight', {}) for hit in hits}
+            for post in posts:
+                post.highlights = highlights[post.id]
+        prefetch_generations(posts)
     else:
         posts = []
 
     # Calculate pagination URLs
-    next_url = url_for('main.search', q=q, page=page + 1) \
+    next_url = url_for('main.search', q=q, category=category, page=page + 1) \
         if total > page * per_page else None
-    prev_url = url_for('main.search', q=q, page=page - 1) \
+    prev_url = url_for('main.search', q=q, category=category, page=page - 1) \
         if page > 1 else None
 
-    return render_template('search.html', title='Search Results', posts=posts, total=total, q=q, next_url=next_url, prev_url=prev_url)
\ No newline at end of file
+    return render_template('search.html', title='Search Results', posts=posts, total=total, q=q, next_url=next_url, prev_url=prev_url,
+                           facets=facets, category=category)
@@ -0,0 +1,282 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import Response, abort, current_app, g, request, before_render_template, template_rendered
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from tasktiger import TaskTiger
+
+# Where a request's time goes. While a request runs, SQL statements, search
+# backend calls, template rendering and TaskTiger enqueues add their time to
+# that request's phases. The response reports them in a Server-Timing header
+# (shown in the browser's network panel), and each request is added to
+# per-endpoint histograms served at /metrics in the Prometheus text format,
+# together with the TaskTiger queue sizes. /metrics is off unless
+# METRICS_ENDPOINT is set, and can require a METRICS_TOKEN.
+#
+# Histograms live in the process: with several server processes, each one's
+# /metrics shows only the requests it served.
+#
+# Tasks run by the worker aren't timed (there is no request); tasks run
+# eagerly count towards the enqueue time of the request that queued them.
+# What the worker does report is how long each task waited for an app context
+# (worker.task_context). Those totals are kept in Redis, so the web process's
+# /metrics can serve them next to the queue sizes.
+
+PHASES = {
+    'db': 'SQL',
+    'search': 'Search backend',
+    'render': 'Templates',
+    'enqueue': 'Task enqueues',
+}
+# The phases of the current request, {phase: [count, seconds]}; None outside requests
+_timings = ContextVar('flaskblog_timings', default=None)
+# Hash of '<task>:count' and '<task>:seconds' totals written by the workers
+TASK_SETUP_KEY = 'metrics:task_setup'
+
+
+def record(phase, seconds, count=1):
+    timings = _timings.get()
+    if timings is not None:
+        timing = timings.setdefault(phase, [0, 0.0])
+        timing[0] += count
+        timing[1] += seconds
+
+
+@contextmanager
+def timed(phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+class TimedTaskTiger(TaskTiger):
+    """TaskTiger that adds the time spent queueing tasks to the current request."""
+
+    def delay(self, *args, **kwargs):
+        with timed('enqueue'):
+            return super().delay(*args, **kwargs)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The last count is for values above every bucket (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metrics:
+    """Per-process request counters and histograms, keyed by label values."""
+
+    def __init__(self, latency_buckets, query_buckets):
+        self.latency_buckets = latency_buckets
+        self.query_buckets = query_buckets
+        self.requests = {}
+        self.durations = {}
+        self.phases = {}
+        self.queries = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, histograms, labels, buckets):
+        histogram = histograms.get(labels)
+        if histogram is None:
+            histogram = histograms[labels] = Histogram(buckets)
+        return histogram
+
+    def observe(self, endpoint, method, status, duration, timings):
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._histogram(self.durations, (endpoint, method), self.latency_buckets).observe(duration)
+            for phase in PHASES:
+                if phase in timings:
+                    self._histogram(self.phases, (endpoint, phase), self.latency_buckets).observe(timings[phase][1])
+            queries = timings.get('db', (0, 0.0))[0]
+            self._histogram(self.queries, (endpoint,), self.query_buckets).observe(queries)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            _counter(lines, 'flaskblog_requests_total', 'Requests served.',
+                     ('endpoint', 'method', 'status'), self.requests)
+            _histograms(lines, 'flaskblog_request_duration_seconds', 'Time from the start of the request to the response.',
+                        ('endpoint', 'method'), self.durations)
+            _histograms(lines, 'flaskblog_request_phase_seconds', 'Time a request spent in SQL, search, templates or enqueues.',
+                        ('endpoint', 'phase'), self.phases)
+            _histograms(lines, 'flaskblog_request_sql_queries', 'SQL statements per request.',
+                        ('endpoint',), self.queries)
+        return lines
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _counter(lines, name, help, names, values):
+    lines += [f'# HELP {name} {help}', f'# TYPE {name} counter']
+    for labels, value in sorted(values.items()):
+        lines.append(f'{name}{_labels(names, labels)} {value}')
+
+
+def _histograms(lines, name, help, names, histograms):
+    lines += [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+    for labels, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + [float('inf')], histogram.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else _number(bound)
+            lines.append(f'{name}_bucket{_labels(names, labels, [("le", le)])} {cumulative}')
+        lines.append(f'{name}_sum{_labels(names, labels)} {_number(histogram.sum)}')
+        lines.append(f'{name}_count{_labels(names, labels)} {cumulative}')
+
+
+def _queue_sizes(lines, tiger):
+    """TaskTiger tasks per queue and state; nothing without Redis."""
+    if current_app.redis is None:
+        return
+    try:
+        stats = tiger.get_queue_stats()
+    except RedisError as e:
+        current_app.logger.warning(f"Task queue sizes unavailable: {e}")
+        return
+    name = 'flaskblog_task_queue_tasks'
+    lines += [f'# HELP {name} TaskTiger tasks per queue and state.', f'# TYPE {name} gauge']
+    for queue, states in sorted(stats.items()):
+        for state, count in sorted(states.items()):
+            lines.append(f'{name}{_labels(("queue", "state"), (queue, state))} {count}')
+
+
+def record_task_setup(name, seconds):
+    """Add one run of task ``name`` and its app setup time to the shared totals."""
+    if current_app.redis is None:
+        return
+    try:
+        pipe = current_app.redis.pipeline()
+        pipe.hincrby(TASK_SETUP_KEY, f'{name}:count', 1)
+        pipe.hincrbyfloat(TASK_SETUP_KEY, f'{name}:seconds', seconds)
+        pipe.execute()
+    except RedisError as e:
+        current_app.logger.warning(f"Task setup time not recorded: {e}")
+
+
+def _task_setup(lines):
+    """Runs and app setup seconds per task, from Redis or else this process's own tasks."""
+    if current_app.redis is None:
+        from flaskblog.worker import setup_stats
+        totals = {name: (stats['count'], stats['total']) for name, stats in setup_stats.items()}
+    else:
+        try:
+            raw = current_app.redis.hgetall(TASK_SETUP_KEY)
+        except RedisError as e:
+            current_app.logger.warning(f"Task setup times unavailable: {e}")
+            return
+        totals = {}
+        for field, value in raw.items():
+            name, _, kind = field.decode().rpartition(':')
+            count, seconds = totals.get(name, (0, 0.0))
+            totals[name] = (int(value), seconds) if kind == 'count' else (count, float(value))
+    _counter(lines, 'flaskblog_task_setup_total', 'Task runs whose app setup was timed.',
+             ('task',), {(name,): count for name, (count, seconds) in totals.items()})
+    _counter(lines, 'flaskblog_task_setup_seconds_total', 'Time tasks spent getting an app context.',
+             ('task',), {(name,): _number(float(seconds)) for name, (count, seconds) in totals.items()})
+
+
+def server_timing(timings, total):
+    entries = []
+    for phase, description in PHASES.items():
+        if phase in timings:
+            count, seconds = timings[phase]
+            entries.append(f'{phase};dur={seconds * 1000:.1f};desc="{description} ({count})"')
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def init_metrics(app, db, tiger):
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.extensions['metrics'] = Metrics(list(app.config['METRICS_LATENCY_BUCKETS']),
+                                        list(app.config['METRICS_QUERY_BUCKETS']))
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _query_started)
+            event.listen(engine, 'after_cursor_execute', _query_finished)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+
+    @app.before_request
+    def start_timing():
+        g._metrics_started = time.perf_counter()
+        g._render_started = []
+        _timings.set({})
+
+    @app.after_request
+    def finish_timing(response):
+        timings = _timings.get()
+        if timings is None:
+            return response
+        total = time.perf_counter() - g._metrics_started
+        if app.config['SERVER_TIMING_ENABLED']:
+            response.headers['Server-Timing'] = server_timing(timings, total)
+        app.extensions['metrics'].observe(request.endpoint or 'unmatched', request.method,
+                                          response.status_code, total, timings)
+        return response
+
+    @app.teardown_request
+    def stop_timing(exc):
+        _timings.set(None)
+
+    @app.route('/metrics')
+    def metrics():
+        # Latencies and cache stats per route aren't for every visitor
+        if not app.config['METRICS_ENDPOINT']:
+            abort(404)
+        token = app.config['METRICS_TOKEN']
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(403)
+        lines = app.extensions['metrics'].render()
+        _queue_sizes(lines, tiger)
+        _task_setup(lines)
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    record('db', time.perf_counter() - context._metrics_started)
+
+
+def _render_started(app, template, context, **extra):
+    if _timings.get() is not None:
+        g.setdefault('_render_started', []).append(time.perf_counter())
+
+
+def _render_finished(app, template, context, **extra):
+    started = g.get('_render_started')
+    if _timings.get() is None or not started:
+        return
+    begun = started.pop()
+    # Templates rendered while rendering another (fragments) are part of its time
+    if not started:
+        record('render', time.perf_counter() - begun)
@@ -1,39 +1,105 @@
+import asyncio
 import jwt
-from flask import current_app
+from flask import current_app, request, has_request_context
+from redis.exceptions import RedisError
 from flaskblog import db, login_manager
 from datetime import datetime, timedelta, timezone
 from flask_login import UserMixin
-from flaskblog.search import add_to_index, remove_from_index
+from flaskblog.search import (add_to_index, remove_from_index, mark_dirty, search_backend, bump_generation,
+                              get_cached_results, cache_results, get_cached_facets, cache_facets)
 from flaskblog import tiger
+from flaskblog.fragments import invalidate_posts, invalidate_authors
+from flaskblog.fts import install_fts_ddl
+from flaskblog.metrics import timed
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # A cached, detached snapshot; see flaskblog.identity
+    from flaskblog.identity import load_identity
+    return load_identity(int(user_id))
 
 
 class SearchableMixin(object):
     @classmethod
-    def search(cls, expression, page, per_page):
+    def search(cls, expression, page, per_page, category=None):
         # Query the specific index for this model
-        if not current_app.elasticsearch:
+        backend = search_backend()
+        if not backend.available():
             return [], 0, []
-        if not current_app.elasticsearch.indices.exists(index=cls.__tablename__):
-            cls.create_index()  # Proactively fix the missing index
-            return [], 0, []
-        search = current_app.elasticsearch.search(
-            index=cls.__tablename__,
-            query={'multi_match': {'query': expression, 'fields': ['*'], 'fuzziness': 'AUTO'}},
-            highlight={'fields': {'title': {},'content': {}}},
-            from_=(page - 1) * per_page,
-            size=per_page
-        )
-        ids = [int(hit['_id']) for hit in search['hits']['hits']]
-        total = search['hits']['total']['value']
-        hits = search['hits']['hits']
+        cached = get_cached_results(cls.__tablename__, expression, page, per_page, category)
+        if cached is not None:
+            return cached
+        with timed('search'):
+            ids, total, hits, facets = backend.search(cls, expression, page, per_page, category)
 
+        cache_results(cls.__tablename__, expression, page, per_page, ids, total, hits, category)
+        if facets is not None:
+            # Counted in passing; saves search_facets() a request
+            cache_facets(cls.__tablename__, expression, facets)
         return ids, total, hits
+
+    @classmethod
+    def search_facets(cls, expression):
+        """``[(category, count), ...]`` for every match of ``expression``, whatever category is selected."""
+        backend = search_backend()
+        if not backend.available():
+            return []
+        facets = get_cached_facets(cls.__tablename__, expression)
+        if facets is None:
+            with timed('search'):
+                facets = backend.facets(cls, expression)
+            cache_facets(cls.__tablename__, expression, facets)
+        return facets
     
+    @classmethod
+    async def search_async(cls, expression, page, per_page, category=None):
+        """``search()`` and ``search_facets()`` together: ``(ids, total, hits, facets)``.
+
+        What isn't cached is fetched through the backend's async client, with
+        the page and (for a category filter) the facet counts in flight at once.
+        """
+        backend = search_backend()
+        if not backend.available():
+            return [], 0, [], []
+        table = cls.__tablename__
+        results = get_cached_results(table, expression, page, per_page, category)
+        facets = get_cached_facets(table, expression)
+        pending = {}
+        if results is None:
+            pending['results'] = backend.search_async(cls, expression, page, per_page, category)
+        if facets is None and (category is not None or results is not None):
+            # An unfiltered search counts the categories on the way
+            pending['facets'] = backend.facets_async(cls, expression)
+        if pending:
+            with timed('search'):
+                done = dict(zip(pending, await asyncio.gather(*pending.values())))
+            if 'results' in done:
+                ids, total, hits, counted = done['results']
+                results = ids, total, hits
+                cache_results(table, expression, page, per_page, ids, total, hits, category)
+                if counted is not None:
+                    facets = counted
+                    cache_facets(table, expression, facets)
+            if 'facets' in done:
+                facets = done['facets']
+                cache_facets(table, expression, facets)
+        if facets is None:
+            # The backend didn't count them with the results
+            with timed('search'):
+                facets = await backend.facets_async(cls, expression)
+            cache_facets(table, expression, facets)
+        return (*results, facets)
+
+    def search_document(self):
+        # Loop through the searchable fields defined in the model
+        return {field: getattr(self, field) for field in self.__searchable__}
+
+    @classmethod
+    def search_load_options(cls):
+        # Loader options for queries that build many documents at once
+        return []
+
     @classmethod
     def add_to_index(cls, model):
         add_to_index(cls.__tablename__, model)
@@ -43,10 +109,9 @@ class SearchableMixin(object):
         remove_from_index(cls.__tablename__, model)
 
     @classmethod
-    def create_index(cls):
-        index = cls.__tablename__
+    def index_body(cls):
         # Define the specialized settings for English stemming
-        settings = {
+        return {
             "settings": {
                 "analysis": {
                     "analyzer": {
@@ -59,25 +124,59 @@ class SearchableMixin(object):
             "mappings": {
                 "properties": {
                     "title": {"type": "text", "analyzer": "english"},
-                    "content": {"type": "text", "analyzer": "english"}
+                    "content": {"type": "text", "analyzer": "english"},
+                    # Stored only so results can be rendered without the database
+                    "excerpt": {"type": "text", "index": False},
+                    "author": {"type": "keyword", "index": False},
+                    "author_image": {"type": "keyword", "index": False},
+                    "user_id": {"type": "integer", "index": False},
+                    "date_posted": {"type": "date", "index": False},
+                    # Filtered and aggregated on; changing this needs `flask reindex`
+                    "category": {"type": "keyword"}
                 }
             }
         }
-        
+
+    @classmethod
+    def create_index(cls):
+        index = cls.__tablename__
         if not current_app.elasticsearch.indices.exists(index=index):
-            current_app.elasticsearch.indices.create(index=index, body=settings)
+            current_app.elasticsearch.indices.create(index=index, body=cls.index_body())
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
 
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    image_file = db.Column(db.String(20), nullable=False, default='default.jpg')
+    image_file = db.Column(db.String(64), nullable=False, default='default.jpg')
     password = db.Column(db.String(60), nullable=False)
+    # Bumped on every change; pages showing the user use it as a cache validator
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow)
     posts = db.relationship('Post', backref='author', lazy=True)
 
     def __repr__(self):
         return f"User('{self.username}', '{self.email}', '{self.image_file}')"
+
+    @staticmethod
+    def after_update(mapper, connection, target):
+        state = db.inspect(target)
+        session = db.object_session(target) or db.session
+        if any(state.attrs[name].history.has_changes() for name in ('username', 'email', 'image_file', 'password')):
+            # Dropped from the identity cache once the change is committed
+            session.info.setdefault('identity_updates', set()).add(target.id)
+        # Cached post fragments show the author's name and picture
+        if state.attrs.username.history.has_changes() or state.attrs.image_file.history.has_changes():
+            session.info.setdefault('author_updates', set()).add(target.id)
+            # Their search documents carry the name and picture too; the index
+            # tasks invalidate the posts again once those are reindexed
+            post_ids = connection.execute(db.select(Post.id).where(Post.user_id == target.id)).scalars()
+            updates = session.info.setdefault('search_updates', {})
+            for post_id in post_ids:
+                updates.setdefault(post_id, 'index')
     
     def get_reset_token(self, expires_sec=1800):
         # Create a payload with an expiration time
@@ -97,7 +196,14 @@ class User(db.Model, UserMixin):
 
 
 class Post(SearchableMixin, db.Model):
-    __searchable__ = ['title', 'content'] # Define fields for Elasticsearch
+    __searchable__ = ['title', 'content'] # Define fields for the search index
+    __search_fields__ = ['title^3', 'content'] # Title is 3x more important
+    __facet_field__ = 'category' # Search results can be filtered and counted by it
+    __table_args__ = (
+        # Keyset pagination seeks on (date_posted, id), globally and per author
+        db.Index('ix_post_date_posted_id', 'date_posted', 'id'),
+        db.Index('ix_post_user_id_date_posted_id', 'user_id', 'date_posted', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     date_posted = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
@@ -105,27 +211,151 @@ class Post(SearchableMixin, db.Model):
     summary = db.Column(db.Text, nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     category = db.Column(db.String(20), nullable=False, default='General')
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow)
 
     def __repr__(self):
         return f"Post('{self.title}', '{self.date_posted}')"
+
+    @property
+    def excerpt(self):
+        return self.content[:200] + ('...' if len(self.content) > 200 else '')
+
+    @classmethod
+    def search_load_options(cls):
+        return [cls.with_author('joined')]
+
+    def search_document(self):
+        # Searchable text plus what the results page shows, see search.SearchHit
+        doc = super().search_document()
+        doc.update({
+            'excerpt': self.excerpt,
+            'author': self.author.username,
+            'author_image': self.author.image_file,
+            'user_id': self.user_id,
+            'date_posted': self.date_posted.isoformat(),
+            'category': self.category,
+        })
+        return doc
+
+    @classmethod
+    def with_author(cls, strategy=None):
+        """Loader option that fetches the authors for a whole page of posts in bulk.
+
+        Without it every ``post.author`` in a listing template fires its own
+        ``SELECT user``. When no strategy is given, the current view's entry in
+        ``AUTHOR_LOAD_STRATEGY`` is used, falling back to a joined load.
+        """
+        if strategy is None and has_request_context():
+            strategy = current_app.config['AUTHOR_LOAD_STRATEGY'].get(request.endpoint)
+        # The 'author' backref only exists once the mappers are configured
+        db.configure_mappers()
+        if strategy == 'selectin':
+            return db.selectinload(cls.author)
+        return db.joinedload(cls.author)
     
     @staticmethod
     def after_insert(mapper, connection, target):
-        from flaskblog.tasks import update_index_task
-        tiger.delay(update_index_task, args=(target.id,))
+        stage_fragment_update(target)
+        stage_index_update(target, 'index')
 
     @staticmethod
     def after_update(mapper, connection, target):
-        from flaskblog.tasks import update_index_task
-        tiger.delay(update_index_task, args=(target.id,))
+        stage_fragment_update(target)
+        stage_index_update(target, 'index')
 
     @staticmethod
     def after_delete(mapper, connection, target):
-        from flaskblog.tasks import remove_index_task
-        tiger.delay(remove_index_task, args=(target.id,))
-    
+        stage_fragment_update(target)
+        stage_index_update(target, 'delete')
+
+
+def stage_fragment_update(post):
+    # Bumped once the transaction commits, so no request caches the old row under the new generation
+    session = db.object_session(post) or db.session
+    session.info.setdefault('fragment_updates', set()).add(post.id)
+
+
+def stage_index_update(post, op):
+    # Collected per transaction so repeated flushes of one post become a single update
+    session = db.object_session(post) or db.session
+    session.info.setdefault('search_updates', {})[post.id] = op
+
+
+def queue_search_updates(session):
+    """Hand the committed transaction's post changes to the search indexer."""
+    updates = session.info.pop('search_updates', None)
+    if not updates:
+        return
+    if search_backend().transactional:
+        # The commit already updated the index; only cached results are stale
+        bump_generation('post')
+        return
+    from flaskblog.tasks import update_index_task, remove_index_task, flush_search_index_task
+    # A fresh app context gives eagerly-run tasks (tests) their own session;
+    # this one is still finishing its commit and can't run queries
+    with current_app.app_context():
+        _queue_search_updates(updates, update_index_task, remove_index_task, flush_search_index_task)
+
+
+def _queue_search_updates(updates, update_index_task, remove_index_task, flush_search_index_task):
+    try:
+        if current_app.redis is None:
+            # No shared queue to batch through, so fall back to one task per post
+            for post_id, op in updates.items():
+                if op == 'delete':
+                    tiger.delay(remove_index_task, args=(post_id,))
+                else:
+                    tiger.delay(update_index_task, args=(post_id,))
+            return
+        waiting = mark_dirty('post', updates.keys())
+        if waiting >= current_app.config['SEARCH_INDEX_BATCH_SIZE']:
+            tiger.delay(flush_search_index_task)
+        else:
+            # Unique task: every commit within the window shares one flush
+            tiger.delay(flush_search_index_task,
+                        when=timedelta(milliseconds=current_app.config['SEARCH_INDEX_FLUSH_MS']))
+    except RedisError as e:
+        current_app.logger.error(f"Search updates for posts {sorted(updates)} were not queued: {e}")
+
+
+def discard_search_updates(session):
+    session.info.pop('search_updates', None)
+
+
+def invalidate_fragments(session):
+    invalidate_posts(session.info.pop('fragment_updates', None))
+    invalidate_authors(session.info.pop('author_updates', None))
+
+
+def discard_fragment_updates(session):
+    session.info.pop('fragment_updates', None)
+    session.info.pop('author_updates', None)
+
+
+def invalidate_identities(session):
+    user_ids = session.info.pop('identity_updates', None)
+    if not user_ids:
+        return
+    from flaskblog.identity import invalidate_identity
+    for user_id in user_ids:
+        invalidate_identity(user_id)
+
+
+def discard_identity_updates(session):
+    session.info.pop('identity_updates', None)
+
+
+# SQLite databases built with create_all() get the FTS5 search table too
+install_fts_ddl(Post)
 
 # Register the listeners to the SQLAlchemy session
 db.event.listen(Post, 'after_insert', Post.after_insert)
 db.event.listen(Post, 'after_update', Post.after_update)
-db.event.listen(Post, 'after_delete', Post.after_delete)
\ No newline at end of file
+db.event.listen(Post, 'after_delete', Post.after_delete)
+db.event.listen(User, 'after_update', User.after_update)
+db.event.listen(db.session, 'after_commit', queue_search_updates)
+db.event.listen(db.session, 'after_rollback', discard_search_updates)
+db.event.listen(db.session, 'after_commit', invalidate_fragments)
+db.event.listen(db.session, 'after_rollback', discard_fragment_updates)
+db.event.listen(db.session, 'after_commit', invalidate_identities)
+db.event.listen(db.session, 'after_rollback', discard_identity_updates)
\ No newline at end of file
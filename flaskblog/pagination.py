@@ -0,0 +1,126 @@
+from datetime import datetime
+from flask import request, abort, current_app
+from flaskblog import db
+from flaskblog.models import Post
+
+# Cursors look like '20260310142501123456-42': date_posted down to the microsecond, then the id
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(post):
+    return f"{post.date_posted.strftime(CURSOR_FORMAT)}-{post.id}"
+
+
+def decode_cursor(cursor):
+    try:
+        stamp, post_id = cursor.split('-')
+        return datetime.strptime(stamp, CURSOR_FORMAT), int(post_id)
+    except ValueError:
+        abort(404)
+
+
+class FeedPage:
+    """One page of a newest-first post feed.
+
+    ``page`` is the page number for the first few (numbered) pages and None
+    when the page was reached through a cursor. ``count`` is the number of
+    matching posts, counted no further than the numbered pages reach;
+    ``count_is_capped`` says there may be more.
+    """
+
+    def __init__(self, items, page, has_newer, has_older, count, per_page, numbered):
+        self.items = items
+        self.page = page
+        self.has_newer = has_newer
+        self.has_older = has_older
+        self.count = count
+        self.count_is_capped = count >= per_page * numbered
+        self.page_numbers = list(range(1, max(1, -(-count // per_page)) + 1))
+
+    @property
+    def newer_args(self):
+        """URL arguments for the link to newer posts, or None on the first page."""
+        if not self.has_newer:
+            return None
+        if self.page:
+            return {'page': self.page - 1}
+        # An empty cursor page has nothing to seek from
+        if not self.items:
+            return None
+        return {'before': encode_cursor(self.items[0])}
+
+    @property
+    def older_args(self):
+        """URL arguments for the link to older posts, or None on the last page."""
+        if not self.has_older:
+            return None
+        if self.page and self.page < len(self.page_numbers):
+            return {'page': self.page + 1}
+        if not self.items:
+            return None
+        # Past the numbered pages everything is cursor based
+        return {'after': encode_cursor(self.items[-1])}
+
+
+def paginate_feed(*criteria):
+    """Paginate the posts matching ``criteria``, newest first.
+
+    The first ``FEED_NUMBERED_PAGES`` pages are served by ``?page=``; their
+    OFFSET and the count behind the page links are capped at that many pages.
+    Deeper pages are reached with ``?after=``/``?before=`` cursors on
+    ``(date_posted, id)``, which seek straight into the composite index, so
+    page 1000 costs the same as page 2.
+    """
+    per_page = current_app.config['POSTS_PER_PAGE']
+    numbered = current_app.config['FEED_NUMBERED_PAGES']
+    key = db.tuple_(Post.date_posted, Post.id)
+    query = db.select(Post).options(Post.with_author()).where(*criteria)
+
+    after = request.args.get('after')
+    before = request.args.get('before')
+    if after:
+        cursor = decode_cursor(after)
+        rows = db.session.scalars(
+            query.where(key < cursor)
+            .order_by(Post.date_posted.desc(), Post.id.desc())
+            .limit(per_page + 1)
+        ).all()
+        # The cursor's post may have been deleted since, so look for anything newer
+        count, has_newer = _capped_count(criteria, per_page * numbered, probe=key >= cursor)
+        return FeedPage(rows[:per_page], None, has_newer, len(rows) > per_page,
+                        count, per_page, numbered)
+    if before:
+        cursor = decode_cursor(before)
+        rows = db.session.scalars(
+            query.where(key > cursor)
+            .order_by(Post.date_posted.asc(), Post.id.asc())
+            .limit(per_page + 1)
+        ).all()
+        items = list(reversed(rows[:per_page]))
+        count, has_older = _capped_count(criteria, per_page * numbered, probe=key <= cursor)
+        return FeedPage(items, None, len(rows) > per_page, has_older,
+                        count, per_page, numbered)
+
+    page = request.args.get('page', 1, type=int)
+    if page < 1 or page > numbered:
+        abort(404)
+    rows = db.session.scalars(
+        query.order_by(Post.date_posted.desc(), Post.id.desc())
+        .offset((page - 1) * per_page)
+        .limit(per_page + 1)
+    ).all()
+    if not rows and page != 1:
+        abort(404)
+    return FeedPage(rows[:per_page], page, page > 1, len(rows) > per_page,
+                    _capped_count(criteria, per_page * numbered), per_page, numbered)
+
+
+def _capped_count(criteria, limit, probe=None):
+    # Count at most the rows the numbered pages can show instead of the whole table.
+    # With a probe, the same statement also says whether any matching post satisfies it.
+    capped = db.select(Post.id).where(*criteria).limit(limit).subquery()
+    if probe is None:
+        return db.session.scalar(db.select(db.func.count()).select_from(capped))
+    found = db.exists().where(*criteria, probe)
+    count, probed = db.session.execute(db.select(db.func.count(), found).select_from(capped)).one()
+    return count, bool(probed)
@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask import current_app
+from flaskblog import bcrypt
+
+# bcrypt is slow on purpose. Hashes are computed on a small per-process pool
+# (bcrypt releases the GIL, so PASSWORD_HASH_WORKERS hashes really run in
+# parallel) and at most PASSWORD_HASH_QUEUE more may wait for it. Past that,
+# requests are turned away at once instead of every thread in the server
+# piling up behind a login storm.
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class _Hasher:
+    def __init__(self, workers, queue):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self.slots = threading.BoundedSemaphore(workers + queue)
+
+
+def _hasher():
+    hasher = current_app.extensions.get('password_hasher')
+    if hasher is None:
+        hasher = _Hasher(current_app.config['PASSWORD_HASH_WORKERS'], current_app.config['PASSWORD_HASH_QUEUE'])
+        current_app.extensions['password_hasher'] = hasher
+    return hasher
+
+
+def _run(fn, *args):
+    hasher = _hasher()
+    if not hasher.slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+    try:
+        future = hasher.executor.submit(fn, *args)
+    except BaseException:
+        hasher.slots.release()
+        raise
+    # The slot is held until the hash is done, even if this request stopped waiting for it
+    future.add_done_callback(lambda f: hasher.slots.release())
+    try:
+        return future.result(timeout=current_app.config['PASSWORD_HASH_TIMEOUT'])
+    except TimeoutError:
+        future.cancel()
+        raise PasswordHasherBusy()
+
+
+def hash_password(password):
+    rounds = current_app.config['BCRYPT_LOG_ROUNDS']
+    return _run(lambda: bcrypt.generate_password_hash(password, rounds).decode('utf-8'))
+
+
+def hash_cost(password_hash):
+    # '$2b$12$<salt+hash>' -> 12
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def verify_password(user, password):
+    """Check ``password`` against ``user.password``.
+
+    A correct password stored at a different cost than BCRYPT_LOG_ROUNDS is
+    rehashed at the current cost; the caller commits.
+    """
+    if not _run(bcrypt.check_password_hash, user.password, password):
+        return False
+    if hash_cost(user.password) != current_app.config['BCRYPT_LOG_ROUNDS']:
+        user.password = hash_password(password)
+    return True
@@ -2,14 +2,11 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, TextAreaField, SelectField
 from wtforms.validators import DataRequired
 
+CATEGORIES = ['General', 'Tech', 'Finance', 'Life']
+
 
 class PostForm(FlaskForm):
     title = StringField('Title', validators=[DataRequired()])
     content = TextAreaField('Content', validators=[DataRequired()])
-    category = SelectField('Category', choices=[
-        ('General', 'General'), 
-        ('Tech', 'Tech'), 
-        ('Finance', 'Finance'), 
-        ('Life', 'Life')
-    ])
+    category = SelectField('Category', choices=[(name, name) for name in CATEGORIES])
     submit = SubmitField('Post')
\ No newline at end of file
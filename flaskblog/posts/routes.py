@@ -1,9 +1,12 @@
 from flask import (render_template, url_for, flash,
-                   redirect, request, abort, Blueprint)
+                   redirect, request, abort, Blueprint, Response, stream_with_context)
 from flask_login import current_user, login_required
 from flaskblog import db
 from flaskblog.models import Post
 from flaskblog.posts.forms import PostForm
+from flaskblog.summaries import push_enabled, parse_post_ids, summary_events
+from flaskblog.summarizer import request_summary, queue_summaries
+from flaskblog.conditional import render_conditional, post_validators
 
 posts = Blueprint('posts', __name__)
 
@@ -13,12 +16,13 @@ posts = Blueprint('posts', __name__)
 def new_post():
     form = PostForm()
     if form.validate_on_submit():
-        post = Post(title=form.title.data, content=form.content.data, author=current_user, category=form.category.data)
+        post = Post(title=form.title.data, content=form.content.data, user_id=current_user.id, category=form.category.data)
+        summarized = request_summary(post)
         db.session.add(post)
         db.session.commit()
 
-        from flaskblog.tasks import summarize_post_task
-        summarize_post_task.delay(post.id)
+        if not summarized:
+            queue_summaries([post.id])
         
         flash('Your post has been created! AI is summarizing your post...', 'success')
         return redirect(url_for('main.home'))
@@ -27,14 +31,15 @@ def new_post():
 
 @posts.route("/post/<int:post_id>")
 def post(post_id):
-    post = db.get_or_404(Post, post_id)
-    return render_template('post.html', title=post.title, post=post)
+    post = db.get_or_404(Post, post_id, options=[Post.with_author()])
+    validators, last_modified = post_validators([post])
+    return render_conditional('post.html', validators, last_modified, title=post.title, post=post)
 
 
 @posts.route("/post/<int:post_id>/update", methods=['GET', 'POST'])
 @login_required
 def update_post(post_id):
-    post = db.get_or_404(Post, post_id)
+    post = db.get_or_404(Post, post_id, options=[Post.with_author()])
     if post.author != current_user:
         abort(403)
     form = PostForm()
@@ -55,7 +60,7 @@ def update_post(post_id):
 @posts.route("/post/<int:post_id>/delete", methods=['POST'])
 @login_required
 def delete_post(post_id):
-    post = db.get_or_404(Post, post_id)
+    post = db.get_or_404(Post, post_id, options=[Post.with_author()])
     if post.author != current_user:
         abort(403)
     db.session.delete(post)
@@ -65,24 +70,35 @@ def delete_post(post_id):
 
 @posts.route("/post/<int:post_id>/status")
 def post_status(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = db.get_or_404(Post, post_id, options=[Post.with_author()])
     if post.summary:
         return render_template('partials/_summary_content.html', post=post)
     
     return render_template('partials/_summary_loading.html', post=post)
 
+@posts.route("/summaries/stream")
+def summary_stream():
+    # One connection per page carries the summaries of every pending post on it
+    post_ids = parse_post_ids(request.args.get('ids', ''))
+    if not post_ids or not push_enabled():
+        # 204 tells EventSource not to reconnect; the page falls back to polling
+        return '', 204
+    return Response(stream_with_context(summary_events(post_ids)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @posts.route("/post/<int:post_id>/summarize", methods=['POST'])
 @login_required
 def trigger_summary(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = db.get_or_404(Post, post_id, options=[Post.with_author()])
     if post.author != current_user:
         abort(403)
     
-    # Reset summary to None to trigger the "Loading" state in the UI
-    post.summary = None
+    # Unchanged content gets its cached summary back; otherwise the summary
+    # is reset to None, which shows the "Loading" state in the UI
+    if request_summary(post):
+        db.session.commit()
+        return render_template('partials/_summary_content.html', post=post)
     db.session.commit()
-    
-    from flaskblog.tasks import summarize_post_task
-    summarize_post_task.delay(post.id)
+    queue_summaries([post.id])
     
     return render_template('partials/_summary_loading.html', post=post)
\ No newline at end of file
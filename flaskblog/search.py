@@ -1,48 +1,282 @@
+import hashlib
+import json
+from abc import ABC, abstractmethod
+from datetime import datetime
+from types import SimpleNamespace
 from flask import current_app
+from redis.exceptions import RedisError
+from flaskblog.cache import LRUCache
+from flaskblog.metrics import timed
 
-def add_to_index(index, model):
-    # Check if Elasticsearch is configured
-    if not current_app.elasticsearch:
+
+# Search result cache. Entries are keyed by the index's generation, which every
+# index write bumps, so results cached before a write are never served after it.
+
+def _local_results():
+    # Used when Redis isn't configured
+    state = current_app.extensions.get('search_cache')
+    if state is None:
+        state = {'results': LRUCache(maxsize=1024), 'generations': {}, 'stats': {'hits': 0, 'misses': 0}}
+        current_app.extensions['search_cache'] = state
+    return state
+
+def bump_generation(index):
+    """Invalidate every cached result for ``index``."""
+    redis = current_app.redis
+    if redis is None:
+        generations = _local_results()['generations']
+        generations[index] = generations.get(index, 0) + 1
         return
-    payload = {}
-    # Loop through the searchable fields defined in the model
-    for field in model.__searchable__:
-        payload[field] = getattr(model, field)
-    current_app.elasticsearch.index(index=index, id=model.id, document=payload)
+    try:
+        redis.incr(f'search:generation:{index}')
+    except RedisError as e:
+        current_app.logger.warning(f"Could not bump search generation for {index}: {e}")
 
-def remove_from_index(index, model):
-    # Remove document from index when a post is deleted
-    if not current_app.elasticsearch:
+def _query_key(kind, index, expression, category=None):
+    normalized = ' '.join(expression.lower().split())
+    digest = hashlib.sha1(f'{normalized}\0{category or ""}'.encode('utf-8')).hexdigest()
+    redis = current_app.redis
+    if redis is None:
+        generation = _local_results()['generations'].get(index, 0)
+    else:
+        generation = int(redis.get(f'search:generation:{index}') or 0)
+    return f'search:{kind}:{index}:{generation}:{digest}'
+
+def _results_key(index, expression, page, per_page, category=None):
+    return f"{_query_key('results', index, expression, category)}:{page}:{per_page}"
+
+def _count(outcome):
+    redis = current_app.redis
+    if redis is None:
+        _local_results()['stats'][outcome] += 1
+    else:
+        redis.hincrby('search:cache:stats', outcome, 1)
+
+def _cache_get(make_key, count=True):
+    if not current_app.config['SEARCH_CACHE_ENABLED']:
+        return None
+    try:
+        key = make_key()
+        if current_app.redis is None:
+            cached = _local_results()['results'].get(key)
+        else:
+            raw = current_app.redis.get(key)
+            cached = json.loads(raw) if raw is not None else None
+        if count:
+            _count('hits' if cached is not None else 'misses')
+    except RedisError as e:
+        current_app.logger.warning(f"Search cache unavailable: {e}")
+        return None
+    return cached
+
+def _cache_set(make_key, value):
+    if not current_app.config['SEARCH_CACHE_ENABLED']:
         return
-    current_app.elasticsearch.delete(index=index, id=model.id)
-
-def query_index(index, query, page, per_page):
-    if not current_app.elasticsearch:
-        return [], 0, []
-    
-    search = current_app.elasticsearch.search(
-        index=index,
-        body={
-            'query': {
-                'multi_match': {
-                    'query': query, 
-                    'fields': ['title^3', 'content'], # Title is 3x more important
-                    'fuzziness': 'AUTO' 
-                }
-            },
-            'highlight': {
-                'fields': {
-                    'title': {},
-                    'content': {}
-                }
-            },
-            'from': (page - 1) * per_page,
-            'size': per_page
-        }
-    )
-    
-    ids = [int(hit['_id']) for hit in search['hits']['hits']]
-    total = search['hits']['total']['value']
-    hits = search['hits']['hits'] # This contains the highlights
-    
-    return ids, total, hits
\ No newline at end of file
+    try:
+        key = make_key()
+        if current_app.redis is None:
+            _local_results()['results'].set(key, value)
+        else:
+            current_app.redis.set(key, json.dumps(value), ex=current_app.config['SEARCH_CACHE_TTL'])
+    except RedisError as e:
+        current_app.logger.warning(f"Search cache unavailable: {e}")
+
+def get_cached_results(index, expression, page, per_page, category=None):
+    """Return cached ``(ids, total, hits)`` for a query, or None on a miss."""
+    cached = _cache_get(lambda: _results_key(index, expression, page, per_page, category))
+    if cached is None:
+        return None
+    return cached['ids'], cached['total'], cached['hits']
+
+def cache_results(index, expression, page, per_page, ids, total, hits, category=None):
+    # Only what the results page uses: ids, highlights and the stored display fields
+    value = {
+        'ids': ids,
+        'total': total,
+        'hits': [{key: hit[key] for key in ('_id', '_source', 'highlight') if key in hit} for hit in hits],
+    }
+    _cache_set(lambda: _results_key(index, expression, page, per_page, category), value)
+
+def get_cached_facets(index, expression):
+    """Return cached ``[(category, count), ...]`` for a query, or None on a miss."""
+    # Not in the stats, which count searches
+    cached = _cache_get(lambda: _query_key('facets', index, expression), count=False)
+    return [tuple(facet) for facet in cached] if cached is not None else None
+
+def cache_facets(index, expression, facets):
+    _cache_set(lambda: _query_key('facets', index, expression), [list(facet) for facet in facets])
+
+def search_cache_stats():
+    if current_app.redis is None:
+        stats = dict(_local_results()['stats'])
+    else:
+        raw = current_app.redis.hgetall('search:cache:stats')
+        stats = {'hits': int(raw.get(b'hits', 0)), 'misses': int(raw.get(b'misses', 0))}
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
+
+
+class SearchHit:
+    """A post rendered straight from its stored search document, without a DB query.
+
+    Has the attributes the search results template reads from a Post.
+    """
+
+    def __init__(self, hit):
+        source = hit['_source']
+        self.id = int(hit['_id'])
+        self.title = source['title']
+        self.excerpt = source['excerpt']
+        self.category = source['category']
+        self.user_id = source['user_id']
+        self.author = SimpleNamespace(username=source['author'], image_file=source['author_image'])
+        self.date_posted = datetime.fromisoformat(source['date_posted'])
+        self.highlights = hit.get('highlight', {})
+
+    @staticmethod
+    def from_hits(hits):
+        """Build results for every hit, or None if any document predates the stored fields."""
+        try:
+            return [SearchHit(hit) for hit in hits]
+        except KeyError:
+            return None
+
+class SearchBackend(ABC):
+    """What ``SearchableMixin``, the index tasks and `flask reindex` need from a search engine.
+
+    Picked by SEARCH_BACKEND. Whatever the engine, ``search`` returns
+    ``(ids, total, hits, facets)`` with hits shaped like Elasticsearch's
+    (``_id``, optionally ``_source`` and ``highlight``) and ``facets`` as
+    from ``facets()``, or None when the backend didn't count them on the way.
+    """
+
+    # True when the database updates the index in the writing transaction, so no index tasks are queued
+    transactional = False
+
+    def available(self):
+        return True
+
+    @abstractmethod
+    def search(self, model, expression, page, per_page, category=None):
+        """One page of matches, only in ``category`` if given."""
+
+    @abstractmethod
+    def facets(self, model, expression):
+        """``[(category, count), ...]`` over all matches, most common first."""
+
+    async def search_async(self, model, expression, page, per_page, category=None):
+        """``search`` for async views; backends without an async client just call it."""
+        return self.search(model, expression, page, per_page, category)
+
+    async def facets_async(self, model, expression):
+        return self.facets(model, expression)
+
+    @abstractmethod
+    def index(self, index, model):
+        pass
+
+    @abstractmethod
+    def remove(self, index, doc_id):
+        pass
+
+    @abstractmethod
+    def sync(self, model, ids):
+        pass
+
+    @abstractmethod
+    def rebuild(self, model, workers=4, chunk_size=500, keep_old=False, progress=print):
+        """Rebuild the model's whole index; returns ``(index name, documents, failures)``."""
+
+
+def search_backend(app=None):
+    """The app's search backend, picked by SEARCH_BACKEND and built once."""
+    app = app or current_app._get_current_object()
+    backend = app.extensions.get('search_backend')
+    if backend is None:
+        name = app.config['SEARCH_BACKEND']
+        if name == 'elasticsearch':
+            from flaskblog.elastic import ElasticsearchBackend
+            backend = ElasticsearchBackend()
+        elif name == 'fts5':
+            from flaskblog.fts import FTS5Backend
+            backend = FTS5Backend()
+        else:
+            raise ValueError(f"Unknown SEARCH_BACKEND {name!r}")
+        app.extensions['search_backend'] = backend
+    return backend
+
+
+def add_to_index(index, model):
+    with timed('search'):
+        search_backend().index(index, model)
+
+def remove_from_index(index, model):
+    # Background tasks only have the id of the deleted row
+    with timed('search'):
+        search_backend().remove(index, getattr(model, 'id', model))
+
+# How long a rebuild may take before writes stop being recorded for replay
+REBUILD_MARKER_TTL = 24 * 60 * 60
+
+def mark_dirty(index, ids):
+    """Queue documents for the next batched sync; returns how many are waiting."""
+    key = f'search:dirty:{index}'
+    pipe = current_app.redis.pipeline()
+    pipe.sadd(key, *ids)
+    pipe.scard(key)
+    pipe.exists(f'search:rebuilding:{index}')
+    _, waiting, rebuilding = pipe.execute()
+    if rebuilding:
+        # These writes reach the index that is about to be replaced; replayed after the swap
+        current_app.redis.sadd(f'search:rebuild-dirty:{index}', *ids)
+    return waiting
+
+def drain_dirty(index, limit):
+    popped = current_app.redis.spop(f'search:dirty:{index}', limit)
+    return [int(doc_id) for doc_id in popped or []]
+
+def sync_documents(model, ids):
+    """Bring the index in line with the current rows for ``ids`` in one bulk request.
+
+    Rows are loaded with a single IN query; ids without a row are deleted
+    from the index, so inserts, edits and deletes all go through here.
+    """
+    with timed('search'):
+        search_backend().sync(model, ids)
+
+def rebuild_index(model, workers=4, chunk_size=500, keep_old=False, progress=print):
+    """Rebuild a model's index without interrupting searches; see the backend's ``rebuild``.
+
+    Documents written while the new index is built go to the live one, which
+    the swap retires. ``mark_dirty`` also records their ids while the rebuild
+    runs, and they are synced again once the new index is live. Without
+    Redis there is no shared record of them, and nothing is replayed.
+    """
+    index = model.__tablename__
+    backend = search_backend()
+    replay = current_app.redis is not None and not backend.transactional
+    if replay:
+        # Expires on its own if this process dies mid-rebuild
+        current_app.redis.set(f'search:rebuilding:{index}', 1, ex=REBUILD_MARKER_TTL)
+    try:
+        result = backend.rebuild(model, workers=workers, chunk_size=chunk_size,
+                                 keep_old=keep_old, progress=progress)
+    finally:
+        if replay:
+            pipe = current_app.redis.pipeline()
+            pipe.delete(f'search:rebuilding:{index}')
+            pipe.smembers(f'search:rebuild-dirty:{index}')
+            pipe.delete(f'search:rebuild-dirty:{index}')
+            written = [int(doc_id) for doc_id in pipe.execute()[1]]
+    if replay and written:
+        from flaskblog import tiger
+        from flaskblog.tasks import flush_search_index_task
+        progress(f"Replaying {len(written)} documents written during the rebuild.")
+        mark_dirty(index, written)
+        tiger.delay(flush_search_index_task)
+    bump_generation(index)
+    index, done, failed = result
+    if failed:
+        progress(f"{failed} documents failed to index.")
+    return result
@@ -0,0 +1,120 @@
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from flaskblog import db, bcrypt
+from flaskblog.models import User, Post
+from flaskblog.posts.forms import CATEGORIES
+
+# Synthetic data for `flask seed` and the benchmarks. Rows go in with bulk
+# Core inserts, bypassing the ORM events, so nothing is queued for indexing
+# or summarizing; run `flask reindex` afterwards if search should see them.
+#
+# The shape roughly follows a real blog: a few authors write most posts
+# (Zipf), post lengths are log-normal (median ~250 words, a long tail of
+# essays), most posts are 'General' or 'Tech', and dates spread over the
+# last two years in posting order.
+
+SEED_PASSWORD = 'password'
+CATEGORY_WEIGHTS = {'General': 5, 'Tech': 3, 'Finance': 1, 'Life': 2}
+WORDS = (
+    "the a of to and in is it for on with as was at by an be this that from or have are not but "
+    "what all were when we there can your which their said if do will each about how up out them "
+    "then she many some so these would other into has more her two like him see time could no make "
+    "than first been its who now people my made over did down only way find use may water long little "
+    "very after words called just where most know get through back much before go good new write our "
+    "used me man too any day same right look think also around another came come work three word must "
+    "because does part even place well such here take why things help put years different away again "
+    "off went old number great tell men say small every found still between name should home big give "
+    "air line set own under read last never us left end along while might next sound below saw something "
+    "thought both few those always looked show large often together asked house world going want school "
+    "important until form food keep children feet land side without boy once animals life enough took "
+    "sometimes four head above kind began almost live page got earth need far hand high year mother light "
+    "parts country father let night following picture being study second eyes soon times story boys since "
+    "white days ever paper hard near sentence better best across during today others however sure means "
+    "knew its try told young miles sun ways thing whole hear example heard several change answer room sea "
+    "against top turned learn point city play toward five using himself usually flask python database "
+    "server request cache index query search summary docker redis worker budget market savings garden"
+).split()
+
+
+def _sentences(rng, count):
+    sentences = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=max(4, int(rng.gauss(14, 5))))
+        sentences.append(' '.join(words).capitalize() + '.')
+    return sentences
+
+
+def _author_weights(count):
+    # Zipf with s=1.1: the top 1% of authors write about half the posts
+    cumulative, total = [], 0.0
+    for rank in range(1, count + 1):
+        total += 1 / rank ** 1.1
+        cumulative.append(total)
+    return cumulative
+
+
+def seed_database(users, posts, seed=0, batch_size=5000, progress=print):
+    """Add ``users`` users and ``posts`` posts; returns ``(users, posts)`` added.
+
+    Every seeded user's password is SEED_PASSWORD.
+    """
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    first_user = (db.session.scalar(db.select(db.func.max(User.id))) or 0) + 1
+    first_post = (db.session.scalar(db.select(db.func.max(Post.id))) or 0) + 1
+    # One hash for everyone; bcrypt per row would dominate the run
+    password = bcrypt.generate_password_hash(SEED_PASSWORD).decode('utf-8')
+    now = datetime.now(timezone.utc)
+
+    for start in range(0, users, batch_size):
+        ids = range(first_user + start, first_user + min(start + batch_size, users))
+        db.session.execute(db.insert(User.__table__), [
+            {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com',
+             'password': password, 'image_file': 'default.jpg', 'updated_at': now}
+            for i in ids
+        ])
+        db.session.commit()
+    if users:
+        progress(f"Added {users} users")
+
+    author_ids = db.session.scalars(db.select(User.id).order_by(User.id)).all()
+    if posts and not author_ids:
+        raise ValueError("Posts need at least one user")
+    # Shuffled so the prolific authors aren't simply the oldest accounts
+    rng.shuffle(author_ids)
+    author_weights = _author_weights(len(author_ids))
+    categories = [name for name in CATEGORIES if name in CATEGORY_WEIGHTS]
+    category_weights = [CATEGORY_WEIGHTS[name] for name in categories]
+    # Posts are stitched together from a fixed pool of sentences, which is much faster than word by word
+    pool = _sentences(rng, 5000)
+    span = timedelta(days=730).total_seconds()
+
+    for start in range(0, posts, batch_size):
+        count = min(batch_size, posts - start)
+        authors = rng.choices(author_ids, cum_weights=author_weights, k=count)
+        kinds = rng.choices(categories, weights=category_weights, k=count)
+        rows = []
+        for offset in range(count):
+            n = start + offset
+            words = min(5000, max(20, int(rng.lognormvariate(math.log(250), 0.8))))
+            content = ' '.join(rng.choices(pool, k=max(1, words // 14)))
+            posted = now - timedelta(seconds=span * (1 - (n + 1) / posts))
+            rows.append({
+                'id': first_post + n,
+                'title': ' '.join(rng.choices(WORDS, k=rng.randint(3, 9))).capitalize(),
+                'content': content,
+                # Most posts have been summarized already
+                'summary': content.split('.', 1)[0] + '.' if rng.random() < 0.8 else None,
+                'user_id': authors[offset],
+                'category': kinds[offset],
+                'date_posted': posted,
+                'updated_at': posted,
+            })
+        db.session.execute(db.insert(Post.__table__), rows)
+        db.session.commit()
+        done = start + count
+        elapsed = time.perf_counter() - started
+        progress(f"Added {done}/{posts} posts ({done / elapsed:.0f} posts/sec)")
+    return users, posts
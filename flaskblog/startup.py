@@ -0,0 +1,69 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# What it costs to start each kind of process, for `flask import-time`. Every
+# measurement runs in a fresh interpreter, since this one has imported
+# everything already. The worker builds its app with FLASKBLOG_CONFIG=worker,
+# like docker-compose's worker service.
+
+PROCESS_TYPES = {
+    # The floor: what every process pays before doing anything
+    'import': ({}, "import flaskblog"),
+    # `flask run`/gunicorn and one-shot CLI commands load run.py, which builds the app
+    'web': ({}, "import run"),
+    'worker': ({'FLASKBLOG_CONFIG': 'worker'}, "import flaskblog.tasks\nfrom flaskblog.worker import get_app\nget_app()"),
+}
+# Libraries only some processes need; listed when a process imported them
+HEAVY_MODULES = ('elasticsearch', 'openai', 'PIL', 'alembic', 'flaskblog.tasks')
+
+_CHILD = """
+import json, resource, sys, time
+started = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - started
+try:
+    # Peak RSS of this program; ru_maxrss on Linux also counts the parent's memory copied by fork
+    with open('/proc/self/status') as f:
+        rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+except OSError:
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024  # bytes on macOS
+print(json.dumps({
+    'seconds': elapsed,
+    'max_rss_kb': rss_kb,
+    'modules': len(sys.modules),
+    'heavy': [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+
+def measure(code, env=None, cwd=None):
+    """Start a Python process that runs ``code``; its import/setup time, peak RSS and modules."""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', _CHILD, code, *HEAVY_MODULES], capture_output=True,
+                            text=True, cwd=cwd, env={**os.environ, **(env or {})})
+    wall = time.perf_counter() - started
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed')
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample['wall_seconds'] = wall
+    return sample
+
+
+def startup_report(root, runs=5, process_types=None):
+    """Median startup figures per process type, measured ``runs`` times each from ``root``."""
+    report = {}
+    for name in process_types or PROCESS_TYPES:
+        env, code = PROCESS_TYPES[name]
+        samples = [measure(code, env, cwd=root) for _ in range(runs)]
+        report[name] = {
+            'seconds': statistics.median(s['seconds'] for s in samples),
+            'wall_seconds': statistics.median(s['wall_seconds'] for s in samples),
+            'max_rss_mb': statistics.median(s['max_rss_kb'] for s in samples) / 1024,
+            'modules': samples[-1]['modules'],
+            'heavy': samples[-1]['heavy'],
+        }
+    return report
@@ -0,0 +1,65 @@
+// Waits for the AI summaries of every pending post on the page over one
+// server-sent-events connection and swaps each one in as it arrives.
+(function () {
+    var streamUrl = document.currentScript.dataset.streamUrl;
+    var source = null;
+    var watching = '';
+    // Cleared when the server refuses the stream; from then on pending posts poll
+    var streaming = !!window.EventSource;
+
+    function pending() {
+        return Array.prototype.map.call(
+            document.querySelectorAll('[data-summary-pending]'),
+            function (el) { return el.dataset.summaryPending; }
+        );
+    }
+
+    function fallBackToPolling() {
+        document.querySelectorAll('[data-summary-pending]').forEach(function (el) {
+            htmx.trigger(el, 'summary-fallback');
+        });
+    }
+
+    function connect() {
+        if (!streaming) {
+            fallBackToPolling();
+            return;
+        }
+        var ids = pending().join(',');
+        if (ids === watching) {
+            return;
+        }
+        if (source) {
+            source.close();
+            source = null;
+        }
+        watching = ids;
+        if (!ids) {
+            return;
+        }
+        source = new EventSource(streamUrl + '?ids=' + ids);
+        source.addEventListener('summary', function (event) {
+            var data = JSON.parse(event.data);
+            var el = document.querySelector('[data-summary-pending="' + data.id + '"]');
+            if (el) {
+                el.insertAdjacentHTML('afterend', data.html);
+                var section = el.nextElementSibling;
+                el.remove();
+                htmx.process(section);
+            }
+            connect();
+        });
+        source.onerror = function () {
+            // EventSource retries on its own unless the server refused the stream
+            if (source.readyState === EventSource.CLOSED) {
+                source = null;
+                streaming = false;
+                fallBackToPolling();
+            }
+        };
+    }
+
+    document.addEventListener('DOMContentLoaded', connect);
+    // "Generate summary" swaps in new pending posts
+    document.body.addEventListener('htmx:afterSettle', connect);
+})();
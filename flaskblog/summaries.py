@@ -0,0 +1,85 @@
+import json
+import time
+from flask import current_app, render_template
+from redis.exceptions import RedisError
+from flaskblog import db
+from flaskblog.models import Post
+
+# Workers publish the id of every post whose summary they wrote. Each page that
+# shows pending summaries keeps one server-sent-events connection open and gets
+# the finished fragments pushed to it, instead of polling once per post.
+SUMMARY_CHANNEL = 'summaries:ready'
+
+
+def push_enabled():
+    """Whether pages should wait for pushed summaries rather than poll for them."""
+    return current_app.config['SUMMARY_PUSH_ENABLED'] and current_app.redis is not None
+
+
+def publish_summary(post_id):
+    redis = current_app.redis
+    if redis is None:
+        return
+    try:
+        redis.publish(SUMMARY_CHANNEL, post_id)
+    except RedisError as e:
+        # Pages still pick the summary up through their fallback poll
+        current_app.logger.warning(f"Could not publish summary for post {post_id}: {e}")
+
+
+def parse_post_ids(value):
+    """Turn '3,5,8' into {3, 5, 8}, capped so one connection can't watch the whole table."""
+    ids = set()
+    for part in value.split(','):
+        if part.strip().isdigit():
+            ids.add(int(part))
+    return set(sorted(ids)[:current_app.config['SUMMARY_STREAM_MAX_POSTS']])
+
+
+def summary_events(post_ids):
+    """Yield an SSE event with the rendered summary for each post in ``post_ids`` as it finishes.
+
+    The stream ends once every post has its summary, or after
+    ``SUMMARY_STREAM_TIMEOUT`` seconds, when the browser reconnects with
+    whatever is still pending. The timeout is kept to seconds: the stream
+    ties up a server thread for as long as it is open.
+    """
+    waiting = set(post_ids)
+    pubsub = current_app.redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(SUMMARY_CHANNEL)
+    try:
+        # How long the browser waits before reconnecting once this stream ends
+        yield f"retry: {current_app.config['SUMMARY_STREAM_RETRY_MS']}\n\n"
+        # Summaries written between rendering the page and subscribing
+        for event in _finished(waiting):
+            yield event
+        deadline = time.monotonic() + current_app.config['SUMMARY_STREAM_TIMEOUT']
+        while waiting and time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=current_app.config['SUMMARY_STREAM_KEEPALIVE'])
+            if message is None:
+                # Keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+                continue
+            post_id = int(message['data'])
+            if post_id in waiting:
+                for event in _finished(waiting, {post_id}):
+                    yield event
+    finally:
+        pubsub.close()
+
+
+def _finished(waiting, candidates=None):
+    candidates = waiting if candidates is None else candidates
+    posts = db.session.scalars(
+        db.select(Post).options(Post.with_author('joined'))
+        .where(Post.id.in_(candidates), Post.summary.is_not(None))
+        .execution_options(populate_existing=True)
+    ).all()
+    events = []
+    for post in posts:
+        waiting.discard(post.id)
+        html = render_template('partials/_summary_content.html', post=post)
+        events.append(f"event: summary\ndata: {json.dumps({'id': post.id, 'html': html})}\n\n")
+    # Don't hold a connection (or a SQLite read lock) open while waiting for the next message
+    db.session.rollback()
+    return events
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from flask import current_app
+from redis.exceptions import RedisError
+from flaskblog import db, tiger
+from flaskblog.cache import LRUCache
+from flaskblog.models import Post
+from flaskblog.summaries import publish_summary
+
+# Summaries are cached by a hash of the post content, so regenerating or
+# re-saving an unchanged post never reaches the backend. Posts waiting for a
+# summary are collected in a Redis set and summarized in batches, several
+# posts per backend call, with at most SUMMARY_MAX_IN_FLIGHT calls at once.
+
+
+class SummaryError(Exception):
+    pass
+
+
+class OpenAIBackend:
+    def __init__(self, client, model, timeout):
+        self.client = client
+        self.model = model
+        self.timeout = timeout
+
+    def summarize(self, texts):
+        """Return one summary per text, in order."""
+        if len(texts) == 1:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant that summarizes blog posts."},
+                    {"role": "user", "content": f"Summarize this post in two sentences: {texts[0]}"}
+                ],
+                timeout=self.timeout
+            )
+            return [response.choices[0].message.content]
+
+        posts = "\n\n".join(f"Post {i}:\n{text}" for i, text in enumerate(texts, 1))
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that summarizes blog posts."},
+                {"role": "user", "content": (
+                    f"Summarize each of these {len(texts)} posts in two sentences. Reply with a JSON "
+                    f'object {{"summaries": [...]}} holding the summaries in the same order.\n\n{posts}'
+                )}
+            ],
+            response_format={"type": "json_object"},
+            timeout=self.timeout
+        )
+        try:
+            summaries = json.loads(response.choices[0].message.content)['summaries']
+        except (ValueError, KeyError, TypeError) as e:
+            raise SummaryError(f"Unreadable batch response: {e}")
+        if len(summaries) != len(texts):
+            raise SummaryError(f"Asked for {len(texts)} summaries, got {len(summaries)}")
+        return [str(summary) for summary in summaries]
+
+
+class StubBackend:
+    """Local stand-in for tests and benchmarks: the first two sentences, after an optional delay."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def summarize(self, texts):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [' '.join(re.split(r'(?<=[.!?])\s+', text.strip())[:2]) for text in texts]
+
+
+def get_backend(app=None):
+    """The app's summary backend, picked by SUMMARY_BACKEND and built once."""
+    app = app or current_app._get_current_object()
+    backend = app.extensions.get('summary_backend')
+    if backend is None:
+        name = app.config['SUMMARY_BACKEND']
+        if name == 'openai':
+            from flaskblog.worker import get_openai_client
+            backend = OpenAIBackend(get_openai_client(app), app.config['SUMMARY_MODEL'],
+                                    app.config['SUMMARY_TIMEOUT'])
+        elif name == 'stub':
+            backend = StubBackend(app.config['SUMMARY_STUB_LATENCY'])
+        else:
+            raise ValueError(f"Unknown SUMMARY_BACKEND {name!r}")
+        app.extensions['summary_backend'] = backend
+    return backend
+
+
+def _cache_key(content):
+    # Switching backend or model produces new summaries
+    source = f"{current_app.config['SUMMARY_BACKEND']}:{current_app.config['SUMMARY_MODEL']}"
+    digest = hashlib.sha256(f'{source}\0{content}'.encode('utf-8')).hexdigest()
+    return f'summary:content:{digest}'
+
+
+def _local_summaries():
+    # Used when Redis isn't configured
+    summaries = current_app.extensions.get('summary_cache')
+    if summaries is None:
+        summaries = current_app.extensions['summary_cache'] = LRUCache(maxsize=1024)
+    return summaries
+
+
+def cached_summary(content):
+    """The summary already generated for exactly this content, if any."""
+    key = _cache_key(content)
+    redis = current_app.redis
+    if redis is None:
+        return _local_summaries().get(key)
+    try:
+        value = redis.get(key)
+    except RedisError:
+        return None
+    return value.decode('utf-8') if value is not None else None
+
+
+def _store_summary(content, summary):
+    key = _cache_key(content)
+    redis = current_app.redis
+    if redis is None:
+        _local_summaries().set(key, summary)
+        return
+    try:
+        redis.set(key, summary, ex=current_app.config['SUMMARY_CACHE_TTL'])
+    except RedisError as e:
+        current_app.logger.warning(f"Could not cache summary: {e}")
+
+
+def request_summary(post):
+    """Give ``post`` its summary, from the cache when the content was summarized before.
+
+    Returns True when the summary is filled in already. Otherwise the summary
+    is reset to None (pending) and the caller queues the post with
+    ``queue_summaries`` once it has committed.
+    """
+    summary = cached_summary(post.content)
+    post.summary = summary
+    return summary is not None
+
+
+def queue_summaries(post_ids):
+    from flaskblog.tasks import summarize_post_task, flush_summaries_task
+    try:
+        if current_app.redis is None:
+            # No shared queue to batch through, so fall back to one task per post
+            for post_id in post_ids:
+                tiger.delay(summarize_post_task, args=(post_id,))
+            return
+        waiting = mark_pending(post_ids)
+        if waiting >= current_app.config['SUMMARY_BATCH_SIZE']:
+            tiger.delay(flush_summaries_task)
+        else:
+            # Unique task: every post queued within the window shares one flush
+            tiger.delay(flush_summaries_task,
+                        when=timedelta(milliseconds=current_app.config['SUMMARY_BATCH_WAIT_MS']))
+    except RedisError as e:
+        current_app.logger.error(f"Summaries for posts {sorted(post_ids)} were not queued: {e}")
+
+
+def mark_pending(post_ids):
+    """Add posts to the next summary batch; returns how many are waiting."""
+    pipe = current_app.redis.pipeline()
+    pipe.sadd('summary:pending', *post_ids)
+    pipe.scard('summary:pending')
+    return pipe.execute()[-1]
+
+
+def drain_pending(limit):
+    popped = current_app.redis.spop('summary:pending', limit)
+    return [int(post_id) for post_id in popped or []]
+
+
+def summarize_posts(post_ids):
+    """Write summaries for ``post_ids``, commit, and notify open pages.
+
+    Posts with identical content share one summary, and cached content is
+    never sent to the backend. The rest go out ``SUMMARY_BATCH_SIZE`` per
+    call with up to ``SUMMARY_MAX_IN_FLIGHT`` calls running concurrently.
+    Returns the ids whose summary couldn't be generated.
+    """
+    backend = get_backend()
+    posts = db.session.scalars(db.select(Post).where(Post.id.in_(post_ids))).all()
+
+    by_content = {}
+    for post in posts:
+        summary = cached_summary(post.content)
+        if summary is not None:
+            post.summary = summary
+        else:
+            by_content.setdefault(post.content, []).append(post)
+
+    contents = list(by_content)
+    size = current_app.config['SUMMARY_BATCH_SIZE']
+    chunks = [contents[i:i + size] for i in range(0, len(contents), size)]
+    failed = []
+    if chunks:
+        with ThreadPoolExecutor(max_workers=current_app.config['SUMMARY_MAX_IN_FLIGHT']) as pool:
+            futures = [(chunk, pool.submit(backend.summarize, chunk)) for chunk in chunks]
+            for chunk, future in futures:
+                try:
+                    summaries = future.result()
+                except Exception as e:
+                    current_app.logger.error(f"Error summarizing {len(chunk)} posts: {e}")
+                    failed += [post.id for content in chunk for post in by_content[content]]
+                    continue
+                for content, summary in zip(chunk, summaries):
+                    _store_summary(content, summary)
+                    for post in by_content[content]:
+                        post.summary = summary
+
+    db.session.commit()
+    for post in posts:
+        if post.id not in failed:
+            publish_summary(post.id)
+    return failed
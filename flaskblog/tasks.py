@@ -1,101 +1,114 @@
 import os
 from flask_mail import Message
-from flaskblog import mail, tiger, create_app, db
+from flaskblog import tiger, db
 from flaskblog.models import Post
-from flaskblog.search import remove_from_index
-from PIL import Image
-from flask import current_app
-import openai
+from flaskblog.search import remove_from_index, drain_dirty, mark_dirty, sync_documents, bump_generation
+from flaskblog.fragments import invalidate_posts
+from flaskblog.avatars import process_avatar, delete_avatar, upload_dir
+from flaskblog.summarizer import summarize_posts, drain_pending, mark_pending, SummaryError
+from flaskblog.worker import task_context, send_mail
 
+# Each task family has its own queue, grouped by whether someone is waiting on
+# it. Workers pick queues by prefix: docker-compose runs workers for
+# 'interactive' only, so reset emails and index updates never sit behind a
+# backlog of summaries, and separate 'bulk' workers that take at most
+# `--max-workers-per-queue` tasks from each bulk queue at once (OpenAI rate
+# limits, memory for image resizing).
+EMAIL_QUEUE = 'interactive.email'
+SEARCH_QUEUE = 'interactive.search'
+AVATAR_QUEUE = 'bulk.avatars'
+SUMMARY_QUEUE = 'bulk.summaries'
 
-@tiger.task(retry=True, unique=True)
+
+@tiger.task(queue=SEARCH_QUEUE, retry=True, unique=True)
 def update_index_task(model_id):
-    app = create_app()
-    with app.app_context():
+    with task_context('update_index_task'):
         # Force a session refresh to see the latest DB state
         db.session.expire_all()
         post = db.session.get(Post, model_id)
         if post:
             Post.add_to_index(post)
+            bump_generation('post')
+            # Search results render fragments from the stored document, which only now is current
+            invalidate_posts([post.id])
 
-@tiger.task(retry=True)
+@tiger.task(queue=SEARCH_QUEUE, retry=True)
 def remove_index_task(post_id):
-    # Tell Elasticsearch to delete the document with this ID
-    remove_from_index('post', post_id)
+    with task_context('remove_index_task'):
+        # Tell Elasticsearch to delete the document with this ID
+        remove_from_index('post', post_id)
+        bump_generation('post')
+
+@tiger.task(queue=SEARCH_QUEUE, retry=True, unique=True)
+def flush_search_index_task():
+    with task_context('flush_search_index_task') as app:
+        while True:
+            post_ids = drain_dirty('post', app.config['SEARCH_INDEX_BATCH_SIZE'])
+            if not post_ids:
+                break
+            try:
+                sync_documents(Post, post_ids)
+            except Exception:
+                # Put the batch back so the retry picks it up
+                mark_dirty('post', post_ids)
+                raise
+            bump_generation('post')
+            invalidate_posts(post_ids)
 
-@tiger.task(retry=True, unique=True)
+@tiger.task(queue=EMAIL_QUEUE, retry=True, unique=True)
 def send_async_email(subject, sender, recipients, text_body, html_body=None):
-    app = create_app()
-    with app.app_context():
+    with task_context('send_async_email') as app:
         msg = Message(subject, sender=sender, recipients=recipients)
         msg.body = text_body
         msg.html = html_body
-        mail.send(msg)
+        send_mail(app, msg)
 
-@tiger.task(retry=True)
+@tiger.task(queue=AVATAR_QUEUE, retry=True)
 def process_profile_pic_task(user_id, picture_fn, old_picture):
     from flaskblog.models import User
-    from flaskblog import create_app, db
 
-    app = current_app._get_current_object() if current_app else create_app()
-    
-    with app.app_context():
-        # Define paths
-        temp_path = os.path.join(app.root_path, 'static/profile_pics/processing', picture_fn)
-        final_path = os.path.join(app.root_path, 'static/profile_pics', picture_fn)
+    with task_context('process_profile_pic_task') as app:
+        temp_path = os.path.join(upload_dir(), picture_fn)
         
         # Resize the image (Heavy Lifting)
         try:
-            output_size = (125, 125)
-            i = Image.open(temp_path)
-            i.thumbnail(output_size)
-            i.save(final_path)
+            image_file = process_avatar(temp_path)
             
             # Update the database
             user = db.session.get(User, user_id)
             if user:
-                user.image_file = picture_fn
+                user.image_file = image_file
                 db.session.commit()
                 
             # Cleanup: Remove the raw temp file
             if os.path.exists(temp_path):
                 os.remove(temp_path)
                 
-            # Cleanup: Remove old picture if it's not the default
-            if old_picture and old_picture != 'default.jpg':
-                old_path = os.path.join(app.root_path, 'static/profile_pics', old_picture)
-                if os.path.exists(old_path):
-                    os.remove(old_path)
-        except Exception as e:
-            # Might want to log this in a real production app
-            print(f"Error processing image: {e}")
+            # Cleanup: Remove old picture if it's not the default and no one else uploaded it too
+            if old_picture and old_picture not in ('default.jpg', image_file):
+                shared = db.session.scalar(db.select(User.id).filter_by(image_file=old_picture).limit(1))
+                if shared is None:
+                    delete_avatar(old_picture)
+        except Exception:
+            app.logger.exception(f"Error processing picture {picture_fn} for user {user_id}")
 
-@tiger.task(retry=True)
+@tiger.task(queue=SUMMARY_QUEUE, retry=True)
 def summarize_post_task(post_id):
-    app = current_app._get_current_object() if current_app else create_app()
-    with app.app_context():
-        post = db.session.get(Post, post_id)
-        if not post:
-            return
-
-        # Initialize client
-        client = openai.OpenAI(api_key=app.config['OPENAI_API_KEY'])
-
-        try:
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that summarizes blog posts."},
-                    {"role": "user", "content": f"Summarize this post in two sentences: {post.content}"}
-                ]
-            )
-        
-            summary = response.choices[0].message.content
-        
-            # Update the database
-            post.summary = summary
-            db.session.commit()
+    with task_context('summarize_post_task'):
+        if summarize_posts([post_id]):
+            # Fails the task so TaskTiger retries it
+            raise SummaryError(f"Could not summarize post {post_id}")
 
-        except Exception as e:
-            # Log the error
-            print(f"Error summarizing post {post_id}: {e}")
\ No newline at end of file
+@tiger.task(queue=SUMMARY_QUEUE, retry=True, unique=True)
+def flush_summaries_task():
+    with task_context('flush_summaries_task') as app:
+        while True:
+            # Enough for every in-flight call to carry a full batch
+            post_ids = drain_pending(app.config['SUMMARY_BATCH_SIZE'] * app.config['SUMMARY_MAX_IN_FLIGHT'])
+            if not post_ids:
+                break
+            failed = summarize_posts(post_ids)
+            if failed:
+                # Put them back so the retry picks them up; the rest are cached by now
+                mark_pending(failed)
+                raise SummaryError(f"Could not summarize posts {failed}")
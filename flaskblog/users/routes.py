@@ -1,11 +1,14 @@
 from flask import render_template, url_for, flash, redirect, request, Blueprint
 from flask_login import login_user, current_user, logout_user, login_required
-from flaskblog import db, bcrypt, tiger
+from flaskblog import db, tiger
 from flaskblog.models import User, Post
 from flaskblog.users.forms import (RegistrationForm, LoginForm, UpdateAccountForm,
                                    RequestResetForm, ResetPasswordForm)
 from flaskblog.users.utils import save_picture, send_reset_email
-from flaskblog.tasks import process_profile_pic_task
+from flaskblog.passwords import hash_password, verify_password
+from flaskblog.pagination import paginate_feed
+from flaskblog.fragments import prefetch_generations
+from flaskblog.conditional import render_conditional, feed_validators, as_utc
 
 
 users = Blueprint('users', __name__)
@@ -17,7 +20,7 @@ def register():
         return redirect(url_for('main.home'))
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_password = hash_password(form.password.data)
         user = User(username=form.username.data, email=form.email.data, password=hashed_password)
         db.session.add(user)
         db.session.commit()
@@ -32,7 +35,9 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        if user and verify_password(user, form.password.data):
+            # Saves the password if it was rehashed at the current cost
+            db.session.commit()
             login_user(user, remember=form.remember.data)
             flash('You have been logged in!', 'success')
             next_page = request.args.get('next')
@@ -52,30 +57,35 @@ def logout():
 def account():
     form = UpdateAccountForm()
     if form.validate_on_submit():
+        # current_user is a cached snapshot; changes go through the row
+        user = db.session.get(User, current_user.id)
         if form.picture.data:
             # Save the raw file quickly
             picture_fn = save_picture(form.picture.data)
-            # Queue the processing task
-            tiger.delay(process_profile_pic_task, args=(current_user.id, picture_fn, current_user.image_file))
+            # Queue the processing task (the task module pulls in Pillow, so only when needed)
+            from flaskblog.tasks import process_profile_pic_task
+            tiger.delay(process_profile_pic_task, args=(user.id, picture_fn, user.image_file))
             flash('Your profile picture is being processed and will appear in a few minutes', 'info')
-        current_user.username = form.username.data
-        current_user.email = form.email.data
+        user.username = form.username.data
+        user.email = form.email.data
         db.session.commit()
         flash('Your account has been updated!', 'success')
         return redirect(url_for('users.account'))
     elif request.method == 'GET':
         form.username.data = current_user.username
         form.email.data = current_user.email
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    return render_template("account.html", title="Account", image_file=image_file, form=form)
+    return render_template("account.html", title="Account", form=form)
 
 
 @users.route("/user/<string:username>")
 def user_posts(username):
-    page = request.args.get('page', 1, type=int)
     user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(author=user).order_by(Post.date_posted.desc()).paginate(page=page, per_page=5)
-    return render_template("user_posts.html", posts=posts, user=user)
+    posts = paginate_feed(Post.user_id == user.id)
+    prefetch_generations(posts.items)
+    validators, last_modified = feed_validators(posts)
+    validators += [user.updated_at, posts.count]
+    last_modified = max(filter(None, [last_modified, as_utc(user.updated_at)]))
+    return render_conditional("user_posts.html", validators, last_modified, posts=posts, user=user)
 
 
 @users.route("/reset_password", methods=['GET', 'POST'])
@@ -101,7 +111,7 @@ def reset_token(token):
         return redirect(url_for('users.reset_request'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_password = hash_password(form.password.data)
         user.password = hashed_password
         db.session.commit()
         flash(f'Your password has been updated! You are now able to log in', 'success')
@@ -1,8 +1,7 @@
 import os
 import secrets
-from flask import url_for, current_app
-from flaskblog.tasks import send_async_email
-from flaskblog import tiger
+from flask import url_for
+from flaskblog.avatars import upload_dir
 
 
 def save_picture(form_picture):
@@ -12,7 +11,7 @@ def save_picture(form_picture):
     picture_fn = random_hex + f_ext
 
     # Save to a 'processing' subdirectory so the main folder stays clean
-    upload_folder = os.path.join(current_app.root_path, 'static/profile_pics/processing')
+    upload_folder = upload_dir()
     
     if not os.path.exists(upload_folder):
         os.makedirs(upload_folder)
@@ -36,4 +35,5 @@ If you did not make this request, then simply ignore this email and no changes w
 '''
 
     # Hand it off to TaskTiger/Redis
+    from flaskblog.tasks import send_async_email
     send_async_email.delay(subject, sender, recipients, text_body)
\ No newline at end of file
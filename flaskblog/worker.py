@@ -0,0 +1,96 @@
+"""Per-process Flask app for TaskTiger workers.
+
+Tasks used to call ``create_app()`` on every run, rebuilding the app, its
+blueprints and its Elasticsearch connection pool each time. Here the app is
+built once per worker process and reused, together with the clients hanging
+off it. Run the worker with ``--executor sync`` so tasks execute in that
+long-lived process instead of a fresh fork per task.
+"""
+import smtplib
+import time
+from contextlib import contextmanager
+from flask import current_app, has_app_context
+from flaskblog.metrics import record_task_setup
+
+_app = None
+
+# Task name -> {'count', 'total', 'max'} of the seconds this process spent getting an app context
+setup_stats = {}
+
+
+def get_app():
+    global _app
+    if _app is None:
+        from flaskblog import create_app
+        _app = create_app()
+    return _app
+
+
+@contextmanager
+def task_context(name):
+    """Run a task body inside an app context, timing how long it took to get one.
+
+    When an app context is already active (eager tasks in tests, tasks
+    called from a request) that app is used as is.
+    """
+    started = time.perf_counter()
+    if has_app_context():
+        _record(name, started)
+        yield current_app._get_current_object()
+        return
+    app = get_app()
+    with app.app_context():
+        _record(name, started)
+        yield app
+
+
+def _record(name, started):
+    elapsed = time.perf_counter() - started
+    stats = setup_stats.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+    stats['count'] += 1
+    stats['total'] += elapsed
+    stats['max'] = max(stats['max'], elapsed)
+    current_app.logger.debug(f"{name}: app setup took {elapsed * 1000:.2f} ms")
+    # Totals across every worker, served by /metrics
+    record_task_setup(name, elapsed)
+
+
+def get_openai_client(app):
+    """One OpenAI client (and HTTP connection pool) per app."""
+    client = app.extensions.get('openai')
+    if client is None:
+        import openai
+        client = openai.OpenAI(api_key=app.config['OPENAI_API_KEY'])
+        app.extensions['openai'] = client
+    return client
+
+
+def send_mail(app, message):
+    """Send through a long-lived SMTP connection, reconnecting once if the server dropped it."""
+    from flaskblog import mail
+    for attempt in (1, 2):
+        connection = app.extensions.get('smtp_connection')
+        if connection is None:
+            connection = mail.connect().__enter__()
+            app.extensions['smtp_connection'] = connection
+        try:
+            connection.send(message)
+            return
+        except smtplib.SMTPServerDisconnected:
+            _drop_connection(app)
+            if attempt == 2:
+                raise
+        except (smtplib.SMTPException, OSError):
+            # A reset socket or a confused session isn't reused by the retry or the next email
+            _drop_connection(app)
+            raise
+
+
+def _drop_connection(app):
+    connection = app.extensions.pop('smtp_connection', None)
+    if connection is None:
+        return
+    try:
+        connection.__exit__(None, None, None)
+    except (smtplib.SMTPException, OSError):
+        pass
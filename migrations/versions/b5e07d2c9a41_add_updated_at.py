@@ -0,0 +1,40 @@
+"""Add updated_at to post and user
+
+Revision ID: b5e07d2c9a41
+Revises: 3f8a61c0d924
+Create Date: 2026-10-18 16:02:19.804113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e07d2c9a41'
+down_revision = '3f8a61c0d924'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    # Existing rows: a post was last changed no earlier than it was posted,
+    # users have nothing better than the migration time
+    op.execute("UPDATE post SET updated_at = date_posted")
+    op.execute("UPDATE \"user\" SET updated_at = CURRENT_TIMESTAMP")
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
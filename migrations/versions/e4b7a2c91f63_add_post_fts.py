@@ -0,0 +1,37 @@
+"""Add the FTS5 search table and its triggers for post
+
+Revision ID: e4b7a2c91f63
+Revises: b5e07d2c9a41
+Create Date: 2026-10-18 18:24:51.206734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flaskblog.fts import fts_table_statements, fts_trigger_statements
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7a2c91f63'
+down_revision = 'b5e07d2c9a41'
+branch_labels = None
+depends_on = None
+
+# Later migrations that rebuild post with batch_alter_table drop its triggers
+# and must run fts_trigger_statements('post', SEARCHABLE) again afterwards
+SEARCHABLE = ['title', 'content']
+
+
+def upgrade():
+    # Only SQLite has FTS5 (SEARCH_BACKEND = 'fts5')
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in fts_table_statements('post', SEARCHABLE) + fts_trigger_statements('post', SEARCHABLE):
+        op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for trigger in ('insert', 'delete', 'update'):
+        op.execute(f'DROP TRIGGER IF EXISTS post_fts_{trigger}')
+    op.execute('DROP TABLE IF EXISTS post_fts')
@@ -1,6 +1,7 @@
 import os
 import pytest
-import shutil
+from contextlib import contextmanager
+from unittest.mock import patch
 from flaskblog import create_app, db
 from flaskblog.config import Config
 from flaskblog.models import User, Post
@@ -12,10 +13,16 @@ class TestConfig(Config):
     SECRET_KEY = 'test_secret_key'
     WTF_CSRF_ENABLED = False # Makes testing forms easier
     SERVER_NAME = "localhost.localdomain"
+    REDIS_HOST = None # Caches fall back to process-local state
+    BCRYPT_LOG_ROUNDS = 4 # The lowest cost bcrypt allows, keeps the suite fast
+    STRICT_LAZY_LOADS = True # Views must load the relationships their templates use
 
 @pytest.fixture
-def app():
+def app(tmp_path):
     app = create_app(TestConfig)
+    # Uploaded and processed pictures stay out of the source tree
+    app.config['UPLOADED_PHOTOS_DEST'] = str(tmp_path / 'profile_pics')
+    os.makedirs(tmp_path / 'profile_pics' / 'processing')
     with app.app_context():
         db.create_all()
         yield app
@@ -53,23 +60,9 @@ def test_user(app):
     return user
 
 @pytest.fixture
-def cleanup_test_images(app):
-    # Setting up a specific path just for test uploads
-    test_upload_dir = 'static/test_uploads'
-    full_test_path = os.path.join(app.root_path, test_upload_dir)
-    
-    # Creating the directory if it doesn't exist yet
-    if not os.path.exists(full_test_path):
-        os.makedirs(full_test_path)
-    
-    # Overriding the app config to point to the test folder
-    app.config['UPLOADED_PHOTOS_DEST'] = test_upload_dir
-    
-    yield # This is where the test actually runs
-    
-    # Wiping the entire test folder after the test finishes
-    if os.path.exists(full_test_path):
-        shutil.rmtree(full_test_path)
+def avatar_folder(app):
+    """The test's profile picture folder, with raw uploads in its processing/ subfolder."""
+    return app.config['UPLOADED_PHOTOS_DEST']
 
 @pytest.fixture
 def cleanup_search(app):
@@ -111,4 +104,82 @@ def sample_post(app):
         db.session.add(post)
         db.session.commit()
         yield post
-        db.drop_all()
\ No newline at end of file
+        db.drop_all()
+
+
+@pytest.fixture
+def assert_max_queries(app):
+    """Fail if more SQL statements run than allowed, listing what ran.
+
+    ``with assert_max_queries(2):`` limits a block. ``assert_max_queries.per_request('main.home', 2)``
+    limits every later request to that endpoint in the test. Statements on every
+    engine (the primary and any replica) count.
+    """
+    from flask import request, request_started, request_finished
+    # The statement lists being filled: one per open block, plus the current request's
+    recording = []
+    in_request = []
+    budgets = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        for statements in recording:
+            statements.append(statement)
+
+    @contextmanager
+    def _assert_max_queries(limit):
+        statements = []
+        recording.append(statements)
+        try:
+            yield statements
+        finally:
+            recording.remove(statements)
+        assert len(statements) <= limit, \
+            f"{len(statements)} queries (limit {limit}):\n" + "\n".join(statements)
+
+    def per_request(endpoint, limit):
+        budgets[endpoint] = limit
+
+    def started(sender, **extra):
+        in_request.clear()
+
+    def finished(sender, response, **extra):
+        limit = budgets.get(request.endpoint)
+        assert limit is None or len(in_request) <= limit, \
+            f"{request.endpoint} ran {len(in_request)} queries (budget {limit}):\n" + "\n".join(in_request)
+
+    engines = list(db.engines.values())
+    for engine in engines:
+        db.event.listen(engine, 'before_cursor_execute', record)
+    recording.append(in_request)
+    request_started.connect(started, app)
+    request_finished.connect(finished, app)
+    _assert_max_queries.per_request = per_request
+    yield _assert_max_queries
+    request_finished.disconnect(finished, app)
+    request_started.disconnect(started, app)
+    for engine in engines:
+        db.event.remove(engine, 'before_cursor_execute', record)
+
+
+@pytest.fixture
+def queued_tasks(app):
+    """Record the tasks commits queue instead of running them, for the rest of the test."""
+    with patch('flaskblog.tiger.delay') as delay:
+        yield delay
+
+
+@pytest.fixture
+def make_posts(app, queued_tasks):
+    """Create posts by distinct authors. Later commits in the test queue no tasks either."""
+    def _make_posts(count, author=None):
+        posts = []
+        for i in range(count):
+            user = author or User(username=f'author{i}', email=f'author{i}@test.com', password='password')
+            post = Post(title=f'Post {i}', content=f'Content {i}', author=user, summary='')
+            db.session.add(post)
+            posts.append(post)
+        db.session.commit()
+        queued_tasks.reset_mock()
+        return posts
+
+    return _make_posts
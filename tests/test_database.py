@@ -0,0 +1,78 @@
+from sqlalchemy import text
+from flaskblog import create_app, db
+from flaskblog.config import Config, WorkerConfig
+from flaskblog.database import engine_options
+
+
+def test_sqlite_connections_use_wal(tmp_path):
+    class FileConfig(Config):
+        TESTING = True
+        REDIS_HOST = None
+        ELASTICSEARCH_URL = None
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'blog.db'}"
+
+    app = create_app(FileConfig)
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+            assert conn.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+        db.engine.dispose()
+
+
+def test_server_databases_get_a_pool():
+    config = {key: getattr(WorkerConfig, key) for key in dir(WorkerConfig) if key.isupper()}
+    config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://blog@db/blog'
+    options = engine_options(config)
+    assert options['pool_size'] == 2 and options['pool_pre_ping'] is True
+    assert options['pool_recycle'] == Config.DB_POOL_RECYCLE
+
+    # SQLite keeps SQLAlchemy's own pool, explicit options still win
+    config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {'echo': True}
+    assert engine_options(config) == {'echo': True}
+
+
+def test_reads_go_to_the_replica_until_the_client_writes(tmp_path):
+    from datetime import datetime
+    from flaskblog.models import User, Post
+
+    class ReplicaConfig(Config):
+        TESTING = True
+        SECRET_KEY = 'test_secret_key'
+        WTF_CSRF_ENABLED = False
+        REDIS_HOST = None
+        ELASTICSEARCH_URL = None
+        BCRYPT_LOG_ROUNDS = 4
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'primary.db'}"
+        DATABASE_REPLICA_URL = f"sqlite:///{tmp_path / 'replica.db'}"
+
+    app = create_app(ReplicaConfig)
+    with app.app_context():
+        replica = db.engines['replica']
+        db.metadata.create_all(db.engine)
+        db.metadata.create_all(replica)
+        # The same post, as the replica still has it
+        for engine, title, updated in ((db.engine, 'Primary title', datetime(2024, 1, 2)),
+                                       (replica, 'Replica title', datetime(2024, 1, 1))):
+            with engine.begin() as conn:
+                conn.execute(User.__table__.insert(), {'id': 1, 'username': 'author', 'email': 'a@example.com',
+                                                       'password': 'x', 'updated_at': updated})
+                conn.execute(Post.__table__.insert(), {'id': 1, 'title': title, 'content': 'Body', 'user_id': 1,
+                                                       'updated_at': updated})
+
+        client = app.test_client()
+        assert b'Replica title' in client.get('/post/1').data
+
+        # Registering writes to the primary, and pins this client to it for a while
+        response = client.post('/register', data={'username': 'reader', 'email': 'reader@example.com',
+                                                  'password': 'password', 'confirm_password': 'password'})
+        assert response.status_code == 302
+        assert b'Primary title' in client.get('/post/1').data
+
+        # Other clients still read from the replica
+        assert b'Replica title' in app.test_client().get('/post/1').data
+
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
@@ -1,3 +1,6 @@
+import json
+import re
+from unittest.mock import patch
 from flaskblog.models import Post, User
 from flaskblog import db
 
@@ -48,4 +51,287 @@ def test_home_page_with_category(client, app):
     response = client.get('/')
     assert response.status_code == 200
     assert b"Finance News" in response.data
-    assert b"Finance" in response.data
\ No newline at end of file
+    assert b"Finance" in response.data
+
+def test_home_page_loads_authors_in_bulk(client, make_posts, assert_max_queries):
+    # Five posts by five different authors: one COUNT plus one SELECT with the authors joined in
+    make_posts(5)
+    with assert_max_queries(2):
+        response = client.get('/')
+    assert response.status_code == 200
+    assert b"author4" in response.data
+
+
+def test_home_feed_switches_to_cursors_past_numbered_pages(client, app, make_posts, assert_max_queries):
+    app.config['FEED_NUMBERED_PAGES'] = 2
+    make_posts(12)
+
+    # Page 2 is the last numbered page, so its "Older" link is a cursor
+    response = client.get('/?page=2')
+    assert b'Post 6' in response.data
+    assert b'page=3' not in response.data
+    older = re.search(rb'href="([^"]*after=[^"]*)"', response.data).group(1).decode()
+
+    with assert_max_queries(2) as statements:
+        response = client.get(older)
+    # Seeks past the cursor instead of skipping rows
+    assert '(post.date_posted, post.id) <' in statements[0]
+    assert b'Post 1' in response.data
+    assert b'Post 5' not in response.data
+    newer = re.search(rb'href="([^"]*before=[^"]*)"', response.data).group(1).decode()
+    response = client.get(newer)
+    assert b'Post 6' in response.data and b'Post 2' in response.data
+    assert b'Post 7' not in response.data
+
+    # Deep page numbers are never served with OFFSET
+    assert client.get('/?page=3').status_code == 404
+
+
+def test_empty_cursor_pages_render_without_links(client, make_posts, assert_max_queries):
+    make_posts(3)
+    # Past the oldest post, and before the first possible one
+    with assert_max_queries(2):
+        response = client.get('/?after=19700101000000000000-1')
+    assert response.status_code == 200
+    assert b'Post 0' not in response.data
+    assert b'Older' not in response.data
+    assert b'before=' not in response.data
+
+    response = client.get('/?before=99991231235959999999-1')
+    assert response.status_code == 200
+    assert b'Newer' not in response.data
+
+    # A cursor from a page whose posts were all deleted still leads back
+    response = client.get('/?before=19700101000000000000-1')
+    assert b'Post 2' in response.data
+    assert b'Newer' not in response.data and b'Older' not in response.data
+
+
+def test_article_fragments_are_cached_and_invalidated(client, app, make_posts):
+    from flask import template_rendered
+    rendered = []
+    def record(sender, template, context, **extra):
+        rendered.append(template.name)
+
+    post = make_posts(1)[0]
+    template_rendered.connect(record, app)
+    try:
+        client.get('/')
+        client.get('/')
+        assert rendered.count('partials/_post_article.html') == 1
+
+        # Editing the post or renaming its author invalidates the cached article
+        post.title = 'Edited Title'
+        db.session.commit()
+        assert b'Edited Title' in client.get('/').data
+        post.author.username = 'Renamed'
+        db.session.commit()
+        assert b'Renamed' in client.get('/').data
+        assert rendered.count('partials/_post_article.html') == 3
+    finally:
+        template_rendered.disconnect(record, app)
+
+
+def test_post_fragments_are_invalidated_on_commit_only(client, app, make_posts):
+    post = make_posts(1)[0]
+    client.get('/')
+    generations = app.extensions['fragment_cache'].generations
+    key = f'fragment:gen:post:{post.id}'
+    before = generations.get(key, 0)
+
+    post.title = 'Rolled Back'
+    db.session.flush()
+    assert generations.get(key, 0) == before
+    db.session.rollback()
+    assert generations.get(key, 0) == before
+
+    post.title = 'Committed'
+    db.session.flush()
+    db.session.commit()
+    assert generations[key] == before + 1
+
+
+def test_cached_article_keeps_author_buttons_per_viewer(client, auth, test_user, make_posts):
+    post = make_posts(1, author=test_user)[0]
+    post.summary = 'A short summary.'
+    db.session.commit()
+
+    assert b'Regenerate AI Summary' not in client.get('/').data
+    auth.login()
+    assert b'Regenerate AI Summary' in client.get('/').data
+    auth.logout()
+    assert b'Regenerate AI Summary' not in client.get('/').data
+
+
+def test_built_static_files_are_fingerprinted_and_cached_forever(client, app, tmp_path):
+    import gzip
+    from flask import url_for
+    from flaskblog.assets import build_assets, load_manifest
+    static = tmp_path / 'static'
+    (static / 'js').mkdir(parents=True)
+    (static / 'main.css').write_text('body { color: #333; }\n' * 50)
+    (static / 'js' / 'app.js').write_text('console.log("hi");\n')
+
+    manifest = build_assets(str(static), progress=lambda message: None)
+    assert re.fullmatch(r'main\.[0-9a-f]{12}\.css', manifest['main.css'])
+    assert re.fullmatch(r'js/app\.[0-9a-f]{12}\.js', manifest['js/app.js'])
+    # Rebuilding leaves the fingerprints alone and doesn't fingerprint its own output
+    assert build_assets(str(static), progress=lambda message: None) == manifest
+
+    app.static_folder = str(static)
+    load_manifest(app)
+    with app.test_request_context():
+        url = url_for('static', filename='main.css')
+    assert url.endswith(manifest['main.css'])
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert gzip.decompress(response.data) == (static / 'main.css').read_bytes()
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == app.config['ASSETS_MAX_AGE']
+
+    # Unfingerprinted names still work but aren't cached as immutable
+    response = client.get('/static/main.css')
+    assert response.status_code == 200
+    assert not response.cache_control.immutable
+
+
+def test_processed_pictures_are_cached_forever_in_every_format(client, app, avatar_folder):
+    import os
+    digest = 'ab' * 12
+    for name in (f'{digest}-65.webp', f'{digest}-65.jpg', 'uploaded.jpg'):
+        with open(os.path.join(avatar_folder, name), 'wb') as f:
+            f.write(b'picture')
+    # The test's picture folder is <tmp>/profile_pics
+    app.static_folder = os.path.dirname(avatar_folder)
+
+    assert client.get(f'/static/profile_pics/{digest}-65.webp').cache_control.immutable
+    assert client.get(f'/static/profile_pics/{digest}-65.jpg').cache_control.immutable
+    assert not client.get('/static/profile_pics/uploaded.jpg').cache_control.immutable
+
+
+def test_vendored_files_are_checked_without_the_network(tmp_path):
+    import base64
+    import hashlib
+    import pytest
+    from flaskblog.assets import AssetError, check_vendored
+    body = b'/* pinned */'
+    pinned = {'lib.css': ('https://cdn.example/lib.css',
+                          'sha384-' + base64.b64encode(hashlib.sha384(body).digest()).decode('ascii'))}
+    with patch('flaskblog.assets.VENDOR_ASSETS', pinned):
+        with pytest.raises(AssetError, match='missing'):
+            check_vendored(str(tmp_path), progress=lambda message: None)
+        (tmp_path / 'vendor').mkdir()
+        (tmp_path / 'vendor' / 'lib.css').write_bytes(b'/* edited */')
+        with pytest.raises(AssetError, match='pinned hash'):
+            check_vendored(str(tmp_path), progress=lambda message: None)
+        (tmp_path / 'vendor' / 'lib.css').write_bytes(body)
+        check_vendored(str(tmp_path), progress=lambda message: None)
+
+
+def test_pages_load_the_vendored_libraries(client, app, tmp_path, caplog):
+    data = client.get('/about').data
+    assert b'/static/vendor/bootstrap.min.' in data and b'/static/vendor/htmx.min.' in data
+    assert b'cdn.jsdelivr.net' not in data and b'unpkg.com' not in data
+
+    # Without the files pages still work off the CDN, with a warning
+    app.static_folder = str(tmp_path)
+    app.extensions['assets'].pop('vendored')
+    assert b'https://cdn.jsdelivr.net/npm/bootstrap@' in client.get('/about').data
+    assert 'static/vendor/bootstrap.min.css is missing' in caplog.text
+
+def test_unchanged_pages_answer_304(client, app, make_posts):
+    posts = make_posts(3)
+    first = client.get('/')
+    etag = first.headers['ETag']
+    assert first.last_modified is not None
+
+    with patch('flaskblog.conditional.render_template') as render:
+        response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert not response.data
+    # The page wasn't rendered at all
+    render.assert_not_called()
+
+    # Anonymous clients that only keep the date are served too
+    response = client.get('/', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert response.status_code == 304
+
+    posts[1].title = 'Edited'
+    db.session.commit()
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+    # An author's new name changes every page showing their posts
+    etag = response.headers['ETag']
+    post_etag = client.get(f'/post/{posts[0].id}').headers['ETag']
+    posts[0].author.username = 'renamed'
+    db.session.commit()
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 200
+    assert client.get(f'/post/{posts[0].id}', headers={'If-None-Match': post_etag}).status_code == 200
+
+
+def test_seed_command_bulk_inserts_users_and_posts(app, test_user, queued_tasks):
+    result = app.test_cli_runner().invoke(args=['seed', '--users', '20', '--posts', '120', '--batch-size', '50'])
+    assert result.exit_code == 0, result.output
+    assert 'Added 120/120 posts' in result.output
+    # Bulk inserts skip the indexing/summarizing hooks
+    queued_tasks.assert_not_called()
+
+    assert db.session.scalar(db.select(db.func.count()).select_from(User)) == 21
+    posts = db.session.scalars(db.select(Post).order_by(Post.id)).all()
+    assert len(posts) == 120
+    assert {post.category for post in posts} <= {'General', 'Tech', 'Finance', 'Life'}
+    assert all(post.author is not None and len(post.content.split()) >= 10 for post in posts)
+    # Oldest first, like posts written over time
+    assert posts[0].date_posted < posts[-1].date_posted
+
+
+def test_requests_report_server_timing_and_metrics(client, app, make_posts):
+    app.config['METRICS_ENDPOINT'] = True
+    make_posts(5)
+    response = client.get('/')
+    timing = dict(entry.split(';', 1) for entry in response.headers['Server-Timing'].split(', '))
+    assert set(timing) == {'db', 'render', 'total'}
+    assert '(2)' in timing['db']
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'flaskblog_requests_total{endpoint="main.home",method="GET",status="200"} 1' in text
+    assert 'flaskblog_request_duration_seconds_bucket{endpoint="main.home",method="GET",le="+Inf"} 1' in text
+    assert 'flaskblog_request_phase_seconds_count{endpoint="main.home",phase="render"} 1' in text
+    assert 'flaskblog_request_sql_queries_bucket{endpoint="main.home",le="2"} 1' in text
+
+
+def test_metrics_endpoint_is_off_by_default_and_can_need_a_token(client, app):
+    assert client.get('/metrics').status_code == 404
+
+    app.config.update(METRICS_ENDPOINT=True, METRICS_TOKEN='s3cret')
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+
+def test_clients_are_built_on_first_use(app):
+    assert 'elasticsearch' not in app.__dict__ and 'redis' not in app.__dict__
+    client = app.elasticsearch
+    assert client is not None and app.elasticsearch is client
+    # REDIS_HOST is unset in tests
+    assert app.redis is None
+
+
+def test_import_time_reports_each_process_type(app, tmp_path):
+    output = tmp_path / 'startup.json'
+    result = app.test_cli_runner().invoke(args=['import-time', '--runs', '1', '--process', 'import',
+                                                '--output', str(output)])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines()[1].startswith('import')
+    report = json.loads(output.read_text())
+    assert set(report) == {'import'}
+    assert report['import']['seconds'] > 0 and report['import']['max_rss_mb'] > 0
+    # Pillow and the OpenAI client are for the worker's tasks only
+    assert not {'PIL', 'openai', 'flaskblog.tasks'} & set(report['import']['heavy'])
@@ -1,3 +1,4 @@
+import pytest
 from flaskblog.models import Post, User
 from flaskblog import db
 
@@ -40,4 +41,71 @@ def test_update_post_category(client, app):
     assert response.status_code == 200
     with app.app_context():
         updated_post = db.get_or_404(Post, post_id)
-        assert updated_post.category == 'Tech'
\ No newline at end of file
+        assert updated_post.category == 'Tech'
+
+def test_summary_stream_needs_redis(client, app, make_posts):
+    post = make_posts(1)[0]
+    response = client.get(f'/summaries/stream?ids={post.id}')
+    # No stream without pub/sub: the page keeps polling
+    assert response.status_code == 204
+
+
+def test_summary_stream_pushes_finished_summaries(client, app, make_posts):
+    import json
+    from unittest.mock import MagicMock
+    done, pending, ignored = make_posts(3)
+    done.summary = 'Already done.'
+    pending.summary = None
+    ignored.summary = None
+    db.session.commit()
+    done_id, pending_id, ignored_id = done.id, pending.id, ignored.id
+
+    messages = iter([ignored_id, None, pending_id])
+
+    def next_message(timeout):
+        post_id = next(messages)
+        if post_id == pending_id:
+            # The worker writes the summary, then publishes the post id
+            db.session.execute(db.update(Post).where(Post.id == post_id).values(summary='Pushed summary.'))
+            db.session.commit()
+        return {'data': str(post_id).encode()} if post_id else None
+
+    app.redis = MagicMock()
+    app.redis.pubsub.return_value.get_message.side_effect = next_message
+    response = client.get(f'/summaries/stream?ids={done_id},{pending_id}')
+
+    assert response.mimetype == 'text/event-stream'
+    assert response.get_data(as_text=True).startswith(f"retry: {app.config['SUMMARY_STREAM_RETRY_MS']}\n")
+    events = [json.loads(line[len('data: '):]) for line in response.get_data(as_text=True).splitlines()
+              if line.startswith('data: ')]
+    assert [event['id'] for event in events] == [done_id, pending_id]
+    assert 'Pushed summary.' in events[1]['html']
+    app.redis.pubsub.return_value.close.assert_called_once()
+
+
+def test_lazy_author_load_names_the_template_line(client, app, make_posts):
+    from flask import render_template
+    from flaskblog.lazyloads import LazyLoadError
+
+    app.add_url_rule('/unloaded/<int:post_id>', 'unloaded',
+                     lambda post_id: render_template('post.html', title='', post=db.session.get(Post, post_id)))
+    post_id = make_posts(1)[0].id
+    # Start from an empty identity map, like a request in production
+    db.session.expunge_all()
+    with pytest.raises(LazyLoadError, match=r'Post\.author at post\.html:5'):
+        client.get(f'/unloaded/{post_id}')
+
+    db.session.expunge_all()
+    assert client.get(f'/post/{post_id}').status_code == 200
+
+
+def test_post_page_stays_within_query_budget(client, make_posts, assert_max_queries):
+    post_id = make_posts(1)[0].id
+    assert_max_queries.per_request('posts.post', 1)
+    db.session.expunge_all()
+    assert client.get(f'/post/{post_id}').status_code == 200
+
+    assert_max_queries.per_request('posts.post', 0)
+    db.session.expunge_all()
+    with pytest.raises(AssertionError, match=r'posts\.post ran 1 queries \(budget 0\)'):
+        client.get(f'/post/{post_id}')
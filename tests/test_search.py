@@ -1,16 +1,28 @@
+import asyncio
 import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from flask import url_for
+from flaskblog import create_app, db
+from flaskblog.config import Config
+from flaskblog.main.routes import search_async
 from flaskblog.models import Post
+from flaskblog.fts import FTS5Backend
+from flaskblog.search import SearchBackend, mark_dirty, rebuild_index, search_cache_stats
+from flaskblog.tasks import flush_search_index_task, update_index_task
+
 
 def test_search_results_page(client, app, cleanup_search):
     """Test that the search route returns 200."""
     response = client.get('/search?q=test')
     assert response.status_code == 200
 
+
 def test_search_empty_query(client):
     """Test that an empty query redirects home."""
     response = client.get('/search?q=', follow_redirects=True)
     assert b"Latest Posts" in response.data
 
+
 def test_elasticsearch_integration(client, app, auth, test_user, cleanup_search):
     """Test that a created post is actually searchable."""
     auth.login()
@@ -25,7 +37,6 @@ def test_elasticsearch_integration(client, app, auth, test_user, cleanup_search)
     # 2. MANUALLY push to Elasticsearch
     # Since background tasks are unreliable in a synchronous test suite,
     # we fetch the post we just made and index it ourselves.
-    from flaskblog.models import Post
     with app.app_context():
         post = Post.query.filter_by(title='Docker Magic').first()
         # We call the indexing method directly
@@ -39,6 +50,7 @@ def test_elasticsearch_integration(client, app, auth, test_user, cleanup_search)
     # Check if the highlight is there
     assert b'Docker <em>Magic</em>' in response.data
 
+
 def test_search_intelligence_and_highlights(client, app, auth, test_user, cleanup_search):
     """Test that stemming (post/posted) and highlighting work together."""
     auth.login()
@@ -52,7 +64,6 @@ def test_search_intelligence_and_highlights(client, app, auth, test_user, cleanu
     
     # 2. MANUALLY push to Elasticsearch 
     # This replaces the sleep(1) with a guaranteed action
-    from flaskblog.models import Post
     with app.app_context():
         post = Post.query.filter_by(title='Building with Flask').first()
         Post.add_to_index(post)
@@ -64,4 +75,313 @@ def test_search_intelligence_and_highlights(client, app, auth, test_user, cleanu
     # Lowercase the data for easier assertion comparison
     response_text = response.data.lower()
     assert b'<em>building</em>' in response_text
-    assert b'flask' in response_text
\ No newline at end of file
+    assert b'flask' in response_text
+
+
+def test_reindex_builds_new_index_and_swaps_alias(app, make_posts):
+    make_posts(7)
+    app.elasticsearch = MagicMock()
+    # The live 'post' index predates aliases
+    app.elasticsearch.indices.exists_alias.return_value = False
+    app.elasticsearch.indices.exists.return_value = True
+
+    sent = []
+    def fake_bulk(es, actions, **kwargs):
+        sent.extend(actions)
+        return len(actions), 0
+
+    with patch('flaskblog.elastic.bulk', side_effect=fake_bulk):
+        result = app.test_cli_runner().invoke(args=['reindex', '--chunk-size', '3', '--workers', '2'])
+
+    assert result.exit_code == 0, result.output
+    assert 'Indexed 7/7 documents' in result.output
+    assert sorted(action['_id'] for action in sent) == list(range(1, 8))
+
+    # The old index is never deleted up front; it's dropped in the same call that adds the alias
+    app.elasticsearch.indices.delete.assert_not_called()
+    create_kwargs = app.elasticsearch.indices.create.call_args.kwargs
+    new_index = create_kwargs['index']
+    assert new_index.startswith('post-')
+    assert create_kwargs['body']['settings']['index']['refresh_interval'] == '-1'
+    actions = app.elasticsearch.indices.update_aliases.call_args.kwargs['actions']
+    assert {'add': {'index': new_index, 'alias': 'post'}} in actions
+    assert {'remove_index': {'index': 'post'}} in actions
+
+
+def test_writes_during_a_rebuild_are_replayed_after_the_swap(app, queued_tasks):
+    app.redis = MagicMock()
+    app.elasticsearch = MagicMock()
+    pipe = app.redis.pipeline.return_value
+
+    # A commit while the rebuild runs is recorded for replay
+    pipe.execute.return_value = [1, 1, 1]
+    mark_dirty('post', [4])
+    app.redis.sadd.assert_called_once_with('search:rebuild-dirty:post', 4)
+
+    pipe.execute.side_effect = [[1, {b'4', b'9'}, 1], [1, 2, 0]]
+    with patch('flaskblog.elastic.ElasticsearchBackend.rebuild', return_value=('post-1', 10, 0)):
+        rebuild_index(Post, progress=lambda message: None)
+
+    assert app.redis.set.call_args.args[0] == 'search:rebuilding:post'
+    pipe.delete.assert_any_call('search:rebuilding:post')
+    assert sorted(pipe.sadd.call_args.args[1:]) == [4, 9]
+    assert queued_tasks.call_args.args[0].__name__ == 'flush_search_index_task'
+
+
+def test_repeated_edits_in_one_commit_queue_one_update(app, make_posts, queued_tasks):
+    post = make_posts(1)[0]
+    post.title = 'First edit'
+    db.session.flush()
+    post.title = 'Second edit'
+    db.session.commit()
+    assert queued_tasks.call_count == 1
+    assert queued_tasks.call_args.args[0].__name__ == 'update_index_task'
+
+
+def test_flush_task_syncs_dirty_posts_in_one_bulk_request(app, make_posts):
+    posts = make_posts(3)
+    db.session.delete(posts[1])
+    db.session.commit()
+
+    app.redis = MagicMock()
+    app.redis.spop.side_effect = [[b'1', b'2', b'3'], []]
+    app.elasticsearch = MagicMock()
+    with patch('flaskblog.elastic.bulk') as mocked_bulk:
+        flush_search_index_task()
+
+    assert mocked_bulk.call_count == 1
+    assert mocked_bulk.call_args.kwargs['refresh'] == 'wait_for'
+    actions = mocked_bulk.call_args.args[1]
+    assert [(a['_op_type'], a['_id']) for a in actions] == [('index', 1), ('index', 3), ('delete', 2)]
+
+
+def test_commits_mark_posts_dirty_and_schedule_one_flush(app, make_posts, queued_tasks):
+    post = make_posts(1)[0]
+    app.redis = MagicMock()
+    app.redis.pipeline.return_value.execute.return_value = [1, 1, 0]
+    post.title = 'Edited'
+    db.session.commit()
+    app.redis.pipeline.return_value.sadd.assert_called_once_with('search:dirty:post', post.id)
+    assert queued_tasks.call_args.args[0].__name__ == 'flush_search_index_task'
+    assert 'when' in queued_tasks.call_args.kwargs
+
+
+def _hit(post_id, title, highlight=None, **source):
+    hit = {'_id': str(post_id), '_source': dict(source, title=title) if source else {'title': title}}
+    if highlight:
+        hit['highlight'] = highlight
+    return hit
+
+
+def test_search_renders_results_from_stored_documents(client, app, assert_max_queries):
+    app.elasticsearch = MagicMock()
+    app.elasticsearch.indices.exists.return_value = True
+    app.elasticsearch.search.return_value = {'hits': {'total': {'value': 1}, 'hits': [
+        _hit(7, 'Stored Title', {'title': ['<em>Stored</em> Title']}, excerpt='Stored excerpt',
+             category='Tech', user_id=3, author='Indexer', author_image='default.jpg',
+             date_posted='2026-01-02T03:04:05')
+    ]}}
+
+    with assert_max_queries(0):
+        response = client.get('/search?q=stored')
+        client.get('/search?q=stored')
+
+    assert b'<em>Stored</em> Title' in response.data
+    assert b'Stored excerpt' in response.data
+    assert b'Indexer' in response.data
+    # Index existence is checked once, not before every query
+    assert app.elasticsearch.indices.exists.call_count == 1
+
+
+def test_search_hydrates_old_documents_in_relevance_order(client, app, make_posts):
+    make_posts(3)
+    app.elasticsearch = MagicMock()
+    app.elasticsearch.indices.exists.return_value = True
+    # Documents indexed before the display fields existed only have the searchable text
+    app.elasticsearch.search.return_value = {'hits': {'total': {'value': 3}, 'hits': [
+        _hit(3, 'Post 2'), _hit(1, 'Post 0', {'content': ['<em>Content</em> 0']}), _hit(2, 'Post 1'),
+    ]}}
+
+    data = client.get('/search?q=post').data
+    assert data.index(b'Post 2') < data.index(b'Post 0') < data.index(b'Post 1')
+    assert b'<em>Content</em> 0' in data
+
+
+def test_repeated_searches_are_served_from_cache_until_the_index_changes(client, app, make_posts):
+    post = make_posts(1)[0]
+    app.elasticsearch = MagicMock()
+    app.elasticsearch.indices.exists.return_value = True
+    app.elasticsearch.search.return_value = {'hits': {'total': {'value': 1}, 'hits': [
+        _hit(post.id, 'Cached Title', excerpt='Cached excerpt', category='Tech', user_id=post.user_id,
+             author='Cacher', author_image='default.jpg', date_posted='2026-01-02T03:04:05')
+    ]}, 'aggregations': {'facets': {'buckets': [{'key': 'Tech', 'doc_count': 1}]}}}
+
+    client.get('/search?q=Cached+Title')
+    response = client.get('/search?q=%20cached%20%20title')
+    assert app.elasticsearch.search.call_count == 1
+    assert b'Cached excerpt' in response.data
+    assert b'Tech (1)' in response.data
+
+    # Any index write starts a new generation
+    update_index_task(post.id)
+    client.get('/search?q=cached title')
+    assert app.elasticsearch.search.call_count == 2
+    assert search_cache_stats() == {'hits': 1, 'misses': 2, 'hit_ratio': 1 / 3}
+
+
+def test_reindexing_a_post_invalidates_fragments_rendered_from_its_old_document(client, app, make_posts):
+    post = make_posts(1)[0]
+    app.elasticsearch = MagicMock()
+    app.elasticsearch.indices.exists.return_value = True
+    app.elasticsearch.search.return_value = {'hits': {'total': {'value': 1}, 'hits': [
+        _hit(post.id, 'Old Title', excerpt='Old excerpt', category='Tech', user_id=post.user_id,
+             author='Old Name', author_image='default.jpg', date_posted='2026-01-02T03:04:05')
+    ]}}
+    # Renamed, but the stored document still has the old name until the index task runs
+    post.author.username = 'New Name'
+    db.session.commit()
+    assert b'Old Name' in client.get('/search?q=old').data
+
+    app.elasticsearch.search.return_value['hits']['hits'][0]['_source']['author'] = 'New Name'
+    update_index_task(post.id)
+    assert b'New Name' in client.get('/search?q=old').data
+
+
+def test_fts5_backend_searches_inside_sqlite(client, app, test_user, queued_tasks):
+    app.config['SEARCH_BACKEND'] = 'fts5'
+    app.extensions.pop('search_backend', None)
+    db.session.add_all([
+        Post(title='Watering the garden', content='Keep a flask of water while building raised beds.',
+             author=test_user, summary=''),
+        Post(title='Building with Flask', content='I am currently building a <b>blog</b> platform.',
+             author=test_user, summary=''),
+    ])
+    db.session.commit()
+
+    # Stemmed, title matches ranked first, highlights escaped around the markup
+    data = client.get('/search?q=flask+build').data
+    assert data.index(b'<em>Building</em> with <em>Flask</em>') < data.index(b'Watering the garden')
+    assert b'<em>building</em> a &lt;b&gt;blog&lt;/b&gt;' in data
+
+    # Triggers index new posts in the same transaction; no index tasks are queued
+    db.session.add(Post(title='Flask tips', content='Short ones.', author=test_user, summary=''))
+    db.session.commit()
+    queued_tasks.assert_not_called()
+    assert b'<em>Flask</em> tips' in client.get('/search?q=flask+build').data
+
+    db.session.get(Post, 1).category = 'Life'
+    db.session.commit()
+    data = client.get('/search?q=flask&category=Life').data
+    assert b'Watering the garden' in data and b'Building with' not in data
+    assert b'General (2)' in data and b'Life (1)' in data
+
+    assert b'0</span>' in client.get('/search?q=%22%29+OR+*').data
+
+
+def test_fts5_table_comes_with_the_schema(app):
+    # create_all() made it along with post; databases that predate it get it from `flask db upgrade`
+    assert FTS5Backend().available()
+    db.session.execute(db.text('DROP TABLE post_fts'))
+    app.extensions.pop('fts_tables')
+    assert not FTS5Backend().available()
+
+
+def test_search_backends_implement_every_operation():
+    class SearchOnly(SearchBackend):
+        def search(self, model, expression, page, per_page, category=None):
+            return [], 0, [], None
+
+    with pytest.raises(TypeError):
+        SearchOnly()
+
+
+def test_category_filter_and_facets(client, app):
+    app.elasticsearch = MagicMock()
+    app.elasticsearch.indices.exists.return_value = True
+    app.elasticsearch.search.return_value = {'hits': {'total': {'value': 1}, 'hits': [
+        _hit(4, 'Filtered Title', excerpt='Filtered excerpt', category='Tech', user_id=1,
+             author='Filterer', author_image='default.jpg', date_posted='2026-01-02T03:04:05')
+    ]}, 'aggregations': {'facets': {'buckets': [{'key': 'Tech', 'doc_count': 3}, {'key': 'Life', 'doc_count': 2}]}}}
+
+    data = client.get('/search?q=title&category=Tech').data
+    filtered = app.elasticsearch.search.call_args_list[0].kwargs
+    assert filtered['query']['bool']['filter'] == [{'term': {'category': 'Tech'}}]
+    assert filtered['aggs'] is None
+    # Facets count every match, not just the selected category's
+    counted = app.elasticsearch.search.call_args_list[1].kwargs
+    assert counted['size'] == 0 and 'bool' not in counted['query']
+    assert b'Tech (3)' in data and b'Life (2)' in data
+    assert b'category=Tech&amp;page=2' not in data  # Only one page
+
+    # Counts are cached until the next index write
+    client.get('/search?q=title&category=Life')
+    assert app.elasticsearch.search.call_count == 3
+
+
+def test_async_search_sends_results_and_facet_requests_together(app):
+    app.elasticsearch = MagicMock()
+    app.async_elasticsearch = MagicMock()
+    app.async_elasticsearch.indices.exists = AsyncMock(return_value=True)
+    in_flight, peak = 0, 0
+
+    async def search(**request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        if request['size'] == 0:
+            return {'hits': {'total': {'value': 2}, 'hits': []},
+                    'aggregations': {'facets': {'buckets': [{'key': 'Tech', 'doc_count': 1},
+                                                            {'key': 'Life', 'doc_count': 1}]}}}
+        return {'hits': {'total': {'value': 1}, 'hits': [_hit(4, 'Async Title')]}}
+
+    app.async_elasticsearch.search = AsyncMock(side_effect=search)
+    ids, total, hits, facets = asyncio.run(Post.search_async('async', 1, 5, category='Tech'))
+    assert (ids, total) == ([4], 1)
+    assert facets == [('Tech', 1), ('Life', 1)]
+    assert peak == 2
+
+    # Both parts are cached like the synchronous search's
+    assert asyncio.run(Post.search_async('async', 1, 5, category='Tech'))[:2] == ([4], 1)
+    assert app.async_elasticsearch.search.await_count == 2
+    assert Post.search_facets('async') == facets
+    # Even the index check went through the async client
+    app.elasticsearch.indices.exists.assert_not_called()
+
+
+class AsyncConfig(Config):
+    TESTING = True
+    SERVER_NAME = 'localhost.localdomain'
+    REDIS_HOST = None
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SEARCH_ASYNC = True
+
+
+def test_search_async_setting_swaps_in_the_async_view():
+    app = create_app(AsyncConfig)
+    assert app.view_functions['main.search'] is search_async
+    with app.app_context():
+        assert url_for('main.search', q='x') == 'http://localhost.localdomain/search?q=x'
+
+
+def test_async_search_view_renders_results():
+    app = create_app(AsyncConfig)
+    with app.app_context():
+        db.create_all()
+        app.elasticsearch = MagicMock()
+        app.async_elasticsearch = MagicMock()
+        app.async_elasticsearch.indices.exists = AsyncMock(return_value=True)
+        app.async_elasticsearch.search = AsyncMock(return_value={'hits': {'total': {'value': 1}, 'hits': [
+            _hit(4, 'Async Title', {'title': ['<em>Async</em> Title']}, excerpt='Async excerpt', category='Tech',
+                 user_id=1, author='Awaiter', author_image='default.jpg', date_posted='2026-01-02T03:04:05')
+        ]}, 'aggregations': {'facets': {'buckets': [{'key': 'Tech', 'doc_count': 1}]}}})
+
+        response = app.test_client().get('/search?q=async')
+        db.drop_all()
+
+    assert response.status_code == 200
+    assert b'<em>Async</em> Title' in response.data
+    assert b'Awaiter' in response.data
+    assert b'Tech (1)' in response.data
+    app.elasticsearch.search.assert_not_called()
@@ -1,11 +1,16 @@
 import pytest
 import io
+import os
+import threading
 from PIL import Image
 from unittest.mock import patch, MagicMock
-from flaskblog import db, tiger
+from tasktiger import Task
+from flaskblog import db, tiger, tasks, worker
+from flaskblog.avatars import AVATAR_NAME
 from flaskblog.models import Post, User
-from flaskblog.tasks import process_profile_pic_task, summarize_post_task
-import os
+from flaskblog.summarizer import get_backend, SummaryError
+from flaskblog.tasks import process_profile_pic_task, summarize_post_task, flush_summaries_task
+
 
 def test_new_post_queues_indexing_task(client, auth, app, test_user):
     auth.login(email=test_user.email, password='password')
@@ -24,6 +29,7 @@ def test_new_post_queues_indexing_task(client, auth, app, test_user):
     
     tiger.config['ALWAYS_EAGER'] = True
 
+
 def test_delete_post_queues_removal_task(client, auth, app, test_user):
     auth.login(email=test_user.email, password='password')
     
@@ -38,7 +44,6 @@ def test_delete_post_queues_removal_task(client, auth, app, test_user):
         post_id = post.id
 
     # 2. Setup the mock and run the delete
-    from flaskblog import tiger
     tiger.config['ALWAYS_EAGER'] = False
     with patch('flaskblog.models.tiger.delay') as mocked_delay:
         client.post(f'/post/{post_id}/delete', follow_redirects=True)
@@ -50,16 +55,18 @@ def test_delete_post_queues_removal_task(client, auth, app, test_user):
     
     tiger.config['ALWAYS_EAGER'] = True
 
+
 def test_send_reset_email_queues_task(client, app, test_user):
     tiger.config['ALWAYS_EAGER'] = False
 
-    with patch('flaskblog.users.utils.send_async_email.delay') as mocked_email_delay:
+    with patch('flaskblog.tasks.send_async_email.delay') as mocked_email_delay:
         # Use the actual email of the test_user we just created
         client.post('/reset_password', data={'email': test_user.email})
         assert mocked_email_delay.called
 
     tiger.config['ALWAYS_EAGER'] = True
 
+
 def test_upload_queues_image_processing(client, auth, app, test_user):
     auth.login(email=test_user.email, password='password')
     
@@ -85,14 +92,13 @@ def test_upload_queues_image_processing(client, auth, app, test_user):
     
     tiger.config['ALWAYS_EAGER'] = True
 
-def test_image_processing_task_updates_db(app, test_user):
+
+def test_image_processing_task_updates_db(app, test_user, avatar_folder):
     # This test runs the task function directly to verify the logic
     # 1. Setup paths and a "raw" image in the processing folder
     raw_filename = 'raw_test.jpg'
-    proc_dir = os.path.join(app.root_path, 'static/profile_pics/processing')
-    if not os.path.exists(proc_dir):
-        os.makedirs(proc_dir)
-        
+    proc_dir = os.path.join(avatar_folder, 'processing')
+
     temp_path = os.path.join(proc_dir, raw_filename)
     image = Image.new('RGB', (500, 500), color='blue')
     image.save(temp_path)
@@ -106,18 +112,65 @@ def test_image_processing_task_updates_db(app, test_user):
         db.session.expire_all()
 
         user = db.session.get(User, test_user.id)
-        # Check DB update
-        assert user.image_file == raw_filename
+        # Check DB update: the picture is named after its content
+        assert AVATAR_NAME.match(user.image_file)
         
-        # Check file resizing
-        final_path = os.path.join(app.root_path, 'static/profile_pics', raw_filename)
-        assert os.path.exists(final_path)
-        with Image.open(final_path) as img:
-            assert img.size == (125, 125)
+        # Check file resizing: every size, as WebP and JPEG
+        digest = user.image_file.split('-')[0]
+        for size in app.config['AVATAR_SIZES']:
+            for ext in ('webp', 'jpg'):
+                final_path = os.path.join(avatar_folder, f'{digest}-{size}.{ext}')
+                assert os.path.exists(final_path)
+                with Image.open(final_path) as img:
+                    assert img.size == (size, size)
             
         # Check cleanup
         assert not os.path.exists(temp_path)
 
+
+def test_identical_uploads_share_one_stored_picture(app, test_user, avatar_folder):
+    proc_dir = os.path.join(avatar_folder, 'processing')
+    other = User(username='other', email='other@test.com', password='password')
+    db.session.add(other)
+    db.session.commit()
+
+    for user, raw_filename in ((test_user, 'first.jpg'), (other, 'second.jpg')):
+        Image.new('RGB', (400, 300), color='green').save(os.path.join(proc_dir, raw_filename))
+        process_profile_pic_task(user.id, raw_filename, 'default.jpg')
+
+    db.session.expire_all()
+    image_file = db.session.get(User, test_user.id).image_file
+    assert db.session.get(User, other.id).image_file == image_file
+
+    # Replacing one user's picture leaves the one they shared in place
+    Image.new('RGB', (400, 300), color='purple').save(os.path.join(proc_dir, 'third.jpg'))
+    process_profile_pic_task(other.id, 'third.jpg', image_file)
+    assert os.path.exists(os.path.join(avatar_folder, image_file))
+
+
+def test_picture_is_only_reused_once_every_variant_is_written(app, test_user, avatar_folder):
+    written = []
+    save = Image.Image.save
+    def record(img, path, *args, **kwargs):
+        written.append(os.path.basename(path))
+        return save(img, path, *args, **kwargs)
+
+    Image.new('RGB', (300, 300), color='orange').save(os.path.join(avatar_folder, 'processing', 'raw.jpg'))
+    with patch.object(Image.Image, 'save', record):
+        process_profile_pic_task(test_user.id, 'raw.jpg', 'default.jpg')
+
+    db.session.expire_all()
+    # An interrupted run leaves no fallback JPEG, so the next upload processes it again
+    assert written[-1] == db.session.get(User, test_user.id).image_file + '.tmp'
+    assert len(written) == len(app.config['AVATAR_SIZES']) * 2
+
+
+def test_picture_processing_errors_are_logged_with_a_traceback(app, test_user, caplog):
+    # Nothing was uploaded under this name
+    process_profile_pic_task(test_user.id, 'missing.jpg', 'default.jpg')
+    record = next(r for r in caplog.records if 'missing.jpg' in r.getMessage())
+    assert record.levelname == 'ERROR' and record.exc_info is not None
+
 def test_summarize_post_task(app, sample_post):
     """
     Test that the background task correctly updates the post summary
@@ -135,14 +188,121 @@ def test_summarize_post_task(app, sample_post):
         
         mock_openai_instance.chat.completions.create.return_value = mock_response
 
-        # Patch the 'openai' module INSIDE flaskblog.tasks
-        with patch('flaskblog.tasks.openai.OpenAI', return_value=mock_openai_instance):
+        # Patch the OpenAI client the worker builds
+        with patch('openai.OpenAI', return_value=mock_openai_instance):
             
             # Run the task
             summarize_post_task(sample_post.id)
             
             # Assert the DB was updated
-            from flaskblog.models import Post
-            from flaskblog import db
             updated_post = db.session.get(Post, sample_post.id)
-            assert updated_post.summary == "Mocked Summary"
\ No newline at end of file
+            assert updated_post.summary == "Mocked Summary"
+
+
+def test_summarize_post_task_fails_when_the_summary_does(app, make_posts):
+    app.config['SUMMARY_BACKEND'] = 'stub'
+    post = make_posts(1)[0]
+    with patch.object(get_backend(), 'summarize', side_effect=RuntimeError('rate limited')):
+        with pytest.raises(SummaryError):
+            summarize_post_task(post.id)
+
+
+def test_worker_builds_app_once_per_process(app):
+    apps = []
+    def run_tasks():
+        # A worker thread has no app context of its own
+        for _ in range(3):
+            with worker.task_context('probe') as task_app:
+                apps.append(task_app)
+
+    with patch.object(worker, '_app', None), patch('flaskblog.create_app', return_value=app) as factory:
+        thread = threading.Thread(target=run_tasks)
+        thread.start()
+        thread.join()
+
+    assert factory.call_count == 1
+    assert apps == [app, app, app]
+    assert worker.setup_stats['probe']['count'] >= 3
+
+
+def test_task_setup_times_are_served_with_the_metrics(client, app):
+    app.config['METRICS_ENDPOINT'] = True
+    with worker.task_context('probe'):
+        pass
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'flaskblog_task_setup_total{task="probe"}' in text
+
+    # With Redis, the totals are every worker's
+    app.redis = MagicMock()
+    with worker.task_context('probe'):
+        pass
+    pipe = app.redis.pipeline.return_value
+    pipe.hincrby.assert_called_once_with('metrics:task_setup', 'probe:count', 1)
+    app.redis.hgetall.return_value = {b'probe:count': b'4', b'probe:seconds': b'0.5'}
+    with patch.object(tiger, 'get_queue_stats', return_value={}):
+        text = client.get('/metrics').get_data(as_text=True)
+    assert 'flaskblog_task_setup_total{task="probe"} 4' in text
+    assert 'flaskblog_task_setup_seconds_total{task="probe"} 0.5' in text
+
+def test_failed_smtp_connections_are_not_reused(app):
+    broken, fresh = MagicMock(), MagicMock()
+    broken.send.side_effect = ConnectionResetError()
+    with patch('flaskblog.mail.connect') as connect:
+        connect.return_value.__enter__.side_effect = [broken, fresh]
+        with pytest.raises(ConnectionResetError):
+            worker.send_mail(app, 'first')
+        assert 'smtp_connection' not in app.extensions
+        broken.__exit__.assert_called_once()
+
+        worker.send_mail(app, 'second')
+    fresh.send.assert_called_once_with('second')
+
+
+def test_summaries_are_batched_and_deduplicated_by_content(app, make_posts):
+    app.config.update(SUMMARY_BACKEND='stub', SUMMARY_BATCH_SIZE=2)
+    posts = make_posts(5)
+    posts[3].content = posts[4].content = 'Same text. Twice over. And more.'
+    db.session.commit()
+
+    app.redis = MagicMock()
+    app.redis.get.return_value = None
+    app.redis.spop.side_effect = [[str(post.id).encode() for post in posts], []]
+    app.redis.pipeline.return_value.execute.return_value = [1, 1, 0]
+    backend = get_backend()
+    with patch.object(backend, 'summarize', wraps=backend.summarize) as summarize:
+        flush_summaries_task()
+
+    # Four distinct contents, two per call
+    assert [len(call.args[0]) for call in summarize.call_args_list] == [2, 2]
+    db.session.expire_all()
+    assert db.session.get(Post, posts[0].id).summary == 'Content 0'
+    assert db.session.get(Post, posts[4].id).summary == 'Same text. Twice over.'
+    assert app.redis.publish.call_count == 5
+
+
+def test_regenerating_an_unchanged_post_reuses_its_summary(client, app, auth, test_user):
+    app.config['SUMMARY_BACKEND'] = 'stub'
+    app.elasticsearch = None
+    auth.login(email=test_user.email, password='password')
+    client.post('/post/new', data={'title': 'Stub', 'content': 'First point. Second point. Third.',
+                                   'category': 'General'})
+    post = db.session.scalar(db.select(Post).filter_by(title='Stub'))
+    assert post.summary == 'First point. Second point.'
+
+    response = client.post(f'/post/{post.id}/summarize')
+
+    assert get_backend().calls == 1
+    assert b'First point. Second point.' in response.data
+
+
+def test_tasks_are_split_into_interactive_and_bulk_queues():
+    def queue(func):
+        return Task.queue_from_function(func, tiger)
+
+    interactive = [tasks.send_async_email, tasks.update_index_task, tasks.remove_index_task,
+                   tasks.flush_search_index_task]
+    bulk = [tasks.process_profile_pic_task, tasks.summarize_post_task, tasks.flush_summaries_task]
+    # Workers subscribe by prefix (tasktiger -q interactive / -q bulk)
+    assert all(queue(func).startswith('interactive.') for func in interactive)
+    assert all(queue(func).startswith('bulk.') for func in bulk)
+    assert queue(tasks.summarize_post_task) != queue(tasks.process_profile_pic_task)
@@ -64,7 +64,7 @@ def test_logout(client, app):
     assert b"Login" in response.data
     assert b"Logout" not in response.data
 
-def test_update_account_with_picture(app, client, auth, test_user, cleanup_test_images):
+def test_update_account_with_picture(app, client, auth, test_user):
     # Authenticate via test_user fixture using plain text password
     auth.login(email=test_user.email, password='password')
     
@@ -95,4 +95,73 @@ def test_update_account_with_picture(app, client, auth, test_user, cleanup_test_
     updated_user = db.session.execute(
         db.select(User).filter_by(email='updated@email.com')
         ).scalar_one()
-    assert b'Your profile picture is being processed and will appear in a few minutes' in response.data
\ No newline at end of file
+    assert b'Your profile picture is being processed and will appear in a few minutes' in response.data
+
+def test_user_posts_loads_authors_in_bulk(client, test_user, make_posts, assert_max_queries):
+    make_posts(5, author=test_user)
+    # user lookup, page of posts with authors, capped count for the page links and heading
+    with assert_max_queries(3):
+        response = client.get('/user/TestUser')
+    assert response.status_code == 200
+    assert b"Posts by TestUser (5)" in response.data
+
+
+def test_user_posts_heading_count_stops_at_the_numbered_pages(app, client, test_user, make_posts):
+    app.config['FEED_NUMBERED_PAGES'] = 2
+    make_posts(app.config['POSTS_PER_PAGE'] * 2 + 1, author=test_user)
+    response = client.get('/user/TestUser')
+    assert b"Posts by TestUser (10+)" in response.data
+
+
+def test_logged_in_user_is_loaded_from_the_identity_cache(app, test_user, assert_max_queries):
+    from flaskblog.models import load_user
+    user_id = str(test_user.id)
+    identity = load_user(user_id)
+    assert identity.username == test_user.username
+    # Checks like `post.author == current_user` still work either way round
+    assert test_user == identity and not (test_user != identity)
+
+    with assert_max_queries(0):
+        assert load_user(user_id) is identity
+
+    test_user.username = 'renamed'
+    db.session.commit()
+    assert load_user(user_id).username == 'renamed'
+
+    # Password resets drop the cached identity too
+    cached = load_user(user_id)
+    test_user.password = bcrypt.generate_password_hash('new-password').decode('utf-8')
+    db.session.commit()
+    assert load_user(user_id) is not cached
+
+
+def test_login_rehashes_password_at_current_cost(client, app):
+    from flaskblog.passwords import hash_cost
+    old_hash = bcrypt.generate_password_hash('password123', 5).decode('utf-8')
+    user = User(username='OldHash', email='old@hash.com', password=old_hash)
+    db.session.add(user)
+    db.session.commit()
+
+    response = client.post('/login', data={'email': 'old@hash.com', 'password': 'password123'},
+                           follow_redirects=True)
+    assert b"You have been logged in!" in response.data
+
+    db.session.refresh(user)
+    assert hash_cost(user.password) == app.config['BCRYPT_LOG_ROUNDS'] == 4
+    assert bcrypt.check_password_hash(user.password, 'password123')
+
+
+def test_busy_password_hasher_answers_503(client, app):
+    app.config['PASSWORD_HASH_WORKERS'] = 1
+    app.config['PASSWORD_HASH_QUEUE'] = 0
+    from flaskblog.passwords import _hasher
+    # Every slot is taken by hashes still running
+    assert _hasher().slots.acquire(blocking=False)
+
+    response = client.post('/register', data={
+        'username': 'busy', 'email': 'busy@test.com',
+        'password': 'password', 'confirm_password': 'password'
+    })
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert User.query.filter_by(username='busy').first() is None